@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tag XML documents from Python, without running the scripts.
+
+    from api import Tagger
+
+    with Tagger(language='es', element='p', sentence=True,
+                tokenize=True) as tagger:
+        for source, text in tagger.tag_documents(documents):
+            ...
+
+A Tagger does to every document what treetagger.py does to a file, and a
+Pipeline what pipeline.py does (normalize, tag and fix). Options are
+keywords named as the long options of the scripts. The tokenizer,
+TreeTagger instances and cache of a language are loaded the first time
+it is used and kept until close, so a service tagging many small batches
+only pays for them once.
+"""
+
+import io
+import argparse
+from lxml import etree
+import vrt
+import rules
+import pipeline
+from treetagger import TagWithTreeTagger, StreamWriter, LANGUAGES
+
+
+# options of treetagger.py that apply to documents, and their defaults
+TAGGER_OPTIONS = {
+    'language': None,
+    'element': 'p',
+    'is_root': False,
+    'sentence': False,
+    'tokenize': False,
+    'abbreviation': None,
+    'batch': 0,
+    'taggers': 1,
+    'cache': None,
+    'cache_size': 1000000,
+    'timeout': 0,
+    'retries': 1,
+    'metrics': None,
+    'profile': 0}
+PIPELINE_OPTIONS = dict(
+    TAGGER_OPTIONS,
+    text='s',
+    strip=False,
+    rules=rules.DIRECTORY)
+# options about files, directories and processes, fixed for documents
+FILE_OPTIONS = {
+    'input': None,
+    'output': None,
+    'language_from': None,
+    'pattern': '*.xml',
+    'compress': None,
+    'concatenate': None,
+    'shard_size': 0,
+    'columns': None,
+    'stream': False,
+    'jobs': 1,
+    'readers': 0,
+    'queue_size': 4,
+    'order': 'directory',
+    'incremental': False,
+    'debug': None}
+
+
+def parse(xml):
+    """Get an ElementTree from XML as a string or bytes.
+
+    Keyword arguments:
+    xml -- a string or bytes with a whole XML document.
+    """
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.parse(io.BytesIO(xml), parser)
+
+
+class Embedded(object):
+    """Configure a script from keywords and process documents with it."""
+
+    options = TAGGER_OPTIONS
+
+    def __init__(self, **options):
+        """Constructor.
+
+        Keyword arguments:
+        options -- values of the long options of the script, the others
+                   keeping their default.
+        """
+        unknown = sorted(set(options) - set(self.options))
+        if unknown:
+            raise TypeError("unknown options: {}".format(', '.join(unknown)))
+        args = dict(FILE_OPTIONS)
+        args.update(self.options)
+        args.update(options)
+        if args['language'] is not None:
+            self.check_language(args['language'])
+        self.configure(argparse.Namespace(**args))
+        self.server = None
+        self.metrics = self.init_metrics()
+        self.manifest = None
+        self.counter = 0
+        self.hits = 0
+        self.misses = 0
+        self.languages = set()
+        self.stages = None
+        self.documents = []
+        self.shards = None
+        self.column_store = None
+        self.models = {}
+        self.pools = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """Stop the TreeTagger instances and close the metrics."""
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
+        self.models = {}
+        self.metrics.close()
+        pass
+
+    def check_language(self, language):
+        if language not in LANGUAGES:
+            raise ValueError("unknown language {!r}, one of {}".format(
+                language, ', '.join(LANGUAGES)))
+
+    def choose_language(self, language):
+        """Switch to the language of a document.
+
+        Keyword arguments:
+        language -- one of LANGUAGES or None.
+        """
+        language = language or self.default_language
+        if language is None:
+            raise ValueError("no language given for the document")
+        self.check_language(language)
+        self.use_language(language)
+
+    def write_vrt(self, root, ofile):
+        """Write a processed document as VRT.
+
+        Keyword arguments:
+        root -- Element or ElementTree returned by tag_document.
+        ofile -- a file object open for writing text.
+        """
+        vrt.write(root, ofile)
+
+    def tag_xml(self, xml, language=None, source='<document>'):
+        """Process a document, return its VRT as a string.
+
+        A tree is changed in place, unless it has to be tagged again after
+        a timeout.
+
+        Keyword arguments:
+        xml -- an lxml ElementTree or Element, or a string or bytes with
+               a whole XML document.
+        language -- one of LANGUAGES, by default the one of the options.
+        source -- a string naming the document in the metrics.
+        """
+        bytes_in = 0
+        if isinstance(xml, (str, bytes)):
+            bytes_in = len(xml.encode('utf-8') if isinstance(xml, str)
+                           else xml)
+        elif self.timeout:
+            xml = etree.tostring(xml)  # a timed out attempt may change it
+        self.metrics.start(source, bytes_in)
+        try:
+            self.choose_language(language)
+            self.metrics.set('language', self.language)
+
+            def attempt():
+                if isinstance(xml, (str, bytes)):
+                    with self.metrics.phase('read'):
+                        tree = parse(xml)
+                elif hasattr(xml, 'getroottree'):
+                    tree = xml.getroottree()
+                else:
+                    tree = xml
+                return self.tag_document(source, tree)
+            root = self.retrying(source, attempt)
+            output = io.StringIO()
+            with self.metrics.phase('write'):
+                self.write_vrt(root, output)
+            output = output.getvalue()
+            self.metrics.count('bytes_out', len(output.encode('utf-8')))
+        except Exception:
+            # the TreeTagger pipe may be unusable after an error
+            if self.language is not None:
+                self.restart_tagger(self.language)
+            self.metrics.add(*self.metrics.stop(error=True))
+            raise
+        self.metrics.add(*self.metrics.stop())
+        self.counter += 1
+        hits, misses = self.cache_usage()
+        self.hits += hits
+        self.misses += misses
+        return output
+
+    def tag_documents(self, documents, language=None):
+        """Process documents, yield (source, VRT) as each one is done.
+
+        Keyword arguments:
+        documents -- an iterable of (source, xml) pairs, xml being what
+                     tag_xml takes and source any string naming it.
+        language -- one of LANGUAGES, by default the one of the options.
+        """
+        for source, xml in documents:
+            yield source, self.tag_xml(xml, language, source)
+
+
+class Tagger(Embedded, TagWithTreeTagger):
+    """Tag documents with TreeTagger as treetagger.py tags files."""
+
+    options = TAGGER_OPTIONS
+
+    def iter_vrt(self, xml, language=None):
+        """Tag a document element by element, yield its VRT as it is done.
+
+        The document is parsed and tagged as with --stream, so memory
+        usage doesn't grow with its size. Not with is_root, and --timeout
+        doesn't apply.
+
+        Keyword arguments:
+        xml -- a string or bytes with a whole XML document, or a binary
+               file object to read it from.
+        language -- one of LANGUAGES, by default the one of the options.
+        """
+        if self.is_root:
+            raise ValueError("iter_vrt can't be used with is_root")
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        if isinstance(xml, bytes):
+            xml = io.BytesIO(xml)
+        self.choose_language(language)
+        output = io.StringIO()
+        writer = StreamWriter(output)
+        for piece in self.stream_pieces(xml):
+            writer.write(piece)
+            if output.tell():
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        writer.flush()
+        if output.tell():
+            yield output.getvalue()
+        self.counter += 1
+
+
+class Pipeline(Embedded, pipeline.Pipeline):
+    """Normalize, tag and fix documents as pipeline.py does with files."""
+
+    options = PIPELINE_OPTIONS
+
+    def write_vrt(self, root, ofile):
+        vrt.write(root, ofile, break_tags=False, encoding='UTF-8')
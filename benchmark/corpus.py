@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Generate synthetic XML corpora to benchmark the scripts."""
+
+import os
+import html
+import random
+import argparse
+
+
+WORDS = {
+    'en': [
+        'the', 'of', 'and', 'to', 'in', 'that', 'is', 'for', 'this', 'we',
+        'Parliament', 'Commission', 'Council', 'report', 'Member', 'States',
+        'President', 'vote', 'amendment', 'proposal', 'European', 'Union',
+        'debate', 'question', 'important', 'citizens', 'must', 'would',
+        'support', 'agreement', 'policy', 'Mr', 'Mrs', 'a&b', '2017', '15'],
+    'es': [
+        'el', 'la', 'de', 'que', 'y', 'en', 'los', 'se', 'del', 'las',
+        'Parlamento', 'Comisión', 'Consejo', 'informe', 'Estados',
+        'miembros', 'Presidente', 'votación', 'enmienda', 'propuesta',
+        'europeo', 'Unión', 'debate', 'pregunta', 'importante',
+        'ciudadanos', 'debemos', 'apoyo', 'acuerdo', 'política', 'Sr.',
+        'Sra.', 'señor', 'a&b', '2017', '15'],
+    'de': [
+        'der', 'die', 'und', 'in', 'den', 'von', 'zu', 'das', 'mit', 'sich',
+        'Parlament', 'Kommission', 'Rat', 'Bericht', 'Mitgliedstaaten',
+        'Präsident', 'Abstimmung', 'Änderungsantrag', 'Vorschlag',
+        'europäischen', 'Union', 'Aussprache', 'Frage', 'wichtig',
+        'Bürger', 'müssen', 'Unterstützung', 'Abkommen', 'Politik', 'Hr.',
+        'Fr.', 'a&b', '2017', '15'],
+}
+# formulaic sentences repeated across documents
+BOILERPLATE = {
+    'en': [
+        'The debate is closed.',
+        'The vote will take place tomorrow at 12 noon.',
+        'Thank you very much, Mr President.'],
+    'es': [
+        'Se cierra el debate.',
+        'La votación tendrá lugar mañana a las 12.00 horas.',
+        'Muchas gracias, señor Presidente.'],
+    'de': [
+        'Die Aussprache ist geschlossen.',
+        'Die Abstimmung findet morgen um 12.00 Uhr statt.',
+        'Vielen Dank, Herr Präsident.'],
+}
+LAYOUTS = ['elements', 'vertical', 'root']
+
+
+def sentence(rng, language, words, repeat):
+    """Get a list with the tokens of a random sentence.
+
+    Keyword arguments:
+    rng -- a random.Random instance.
+    language -- one of 'en', 'es' or 'de'.
+    words -- mean number of words in the sentence.
+    repeat -- probability of a boilerplate sentence.
+    """
+    if rng.random() < repeat:
+        return rng.choice(BOILERPLATE[language]).split()
+    length = max(1, int(rng.expovariate(1 / words)))
+    tokens = [rng.choice(WORDS[language]) for i in range(length)]
+    tokens[0] = tokens[0].capitalize()
+    for i in range(1, length - 1):
+        if rng.random() < 0.08:
+            tokens[i] += rng.choice([',', ';', ':'])
+    tokens[-1] += rng.choice(['.', '.', '.', '?', '!'])
+    return tokens
+
+
+def document(rng, number, layout, language, elements, sentences, words,
+             repeat):
+    """Get a serialized document and its number of tokens.
+
+    Keyword arguments:
+    rng -- a random.Random instance.
+    number -- an int identifying the document.
+    layout -- 'elements' for text in <p> elements, 'vertical' for one
+              token per line in <p> elements, 'root' for text in the root.
+    language -- one of 'en', 'es' or 'de'.
+    elements -- number of <p> elements.
+    sentences -- mean number of sentences per <p> (or root) element.
+    words -- mean number of words per sentence.
+    repeat -- probability of a boilerplate sentence.
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>']
+    tokens = 0
+    if layout == 'root':
+        elements = 1
+    else:
+        lines.append('<text id="d{}">'.format(number))
+        lines.append('<div>')
+    for i in range(elements):
+        text = []
+        for j in range(max(1, int(rng.expovariate(1 / sentences)))):
+            text += sentence(rng, language, words, repeat)
+        tokens += len(text)
+        text = [html.escape(t, quote=False) for t in text]
+        if layout == 'root':
+            lines.append('<s id="r{}">{}</s>'.format(number, ' '.join(text)))
+        elif layout == 'vertical':
+            lines.append('<p id="p{}">'.format(i))
+            lines += text
+            lines.append('</p>')
+        else:
+            lines.append('<p id="p{}">{}</p>'.format(i, ' '.join(text)))
+    if layout != 'root':
+        lines.append('</div>')
+        lines.append('</text>')
+    return '\n'.join(lines) + '\n', tokens
+
+
+def generate(outdir, files, layout='elements', language='es', elements=20,
+             sentences=3, words=20, repeat=0.1, seed=0):
+    """Write a synthetic corpus, return a dict with its size.
+
+    Keyword arguments:
+    outdir -- a string for the output directory.
+    files -- number of files to be written.
+    The rest of the arguments are the ones of document, and the seed of
+    the random generator.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    rng = random.Random(seed)
+    stats = {'files': files, 'tokens': 0, 'bytes': 0}
+    for number in range(files):
+        text, tokens = document(rng, number, layout, language, elements,
+                                sentences, words, repeat)
+        text = text.encode('utf-8')
+        with open(os.path.join(outdir, 'doc{}.xml'.format(number)),
+                  mode='wb') as ofile:
+            ofile.write(text)
+        stats['tokens'] += tokens
+        stats['bytes'] += len(text)
+    return stats
+
+
+def cli():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o", "--output",
+        required=True,
+        help="path to the output directory.")
+    parser.add_argument(
+        "-n", "--files",
+        required=False,
+        default=100,
+        type=int,
+        help="number of files.")
+    parser.add_argument(
+        "--layout",
+        required=False,
+        default='elements',
+        choices=LAYOUTS,
+        help="text in <p> elements, one token per line in <p> elements\
+              (vertical) or text in the root element.")
+    parser.add_argument(
+        "-l", "--language",
+        required=False,
+        default='es',
+        choices=['en', 'es', 'de'],
+        help="language of the text.")
+    parser.add_argument(
+        "--elements",
+        required=False,
+        default=20,
+        type=int,
+        help="number of <p> elements per file.")
+    parser.add_argument(
+        "--sentences",
+        required=False,
+        default=3,
+        type=float,
+        help="mean number of sentences per element.")
+    parser.add_argument(
+        "--words",
+        required=False,
+        default=20,
+        type=float,
+        help="mean number of words per sentence.")
+    parser.add_argument(
+        "--repeat",
+        required=False,
+        default=0.1,
+        type=float,
+        help="probability of a sentence being repeated boilerplate.")
+    parser.add_argument(
+        "--seed",
+        required=False,
+        default=0,
+        type=int,
+        help="seed of the random generator.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = cli()
+    stats = generate(args.output, args.files, args.layout, args.language,
+                     args.elements, args.sentences, args.words, args.repeat,
+                     args.seed)
+    print("{files} files, {tokens} tokens, {bytes} bytes written!".format(
+        **stats))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Deterministic stand-in for mytreetaggerwrapper used by the benchmarks.
+
+It has the interface of mytreetaggerwrapper.TreeTagger used by
+treetagger.py and returns one "word\\tPOS\\tlemma" line per token, so the
+scripts can be benchmarked where TreeTagger is not installed. It doesn't
+cost what TreeTagger costs: set FAKE_TREETAGGER_LATENCY to a number of
+seconds to be waited on every call, to emulate the round trip of the
+TreeTagger pipe. The tests set FAKE_TREETAGGER_CRASH to a word that makes
+the process exit at once, as a crash of TreeTagger may do, and
+FAKE_TREETAGGER_HANG to a word that makes the call wait for a child
+process that never answers, as TreeTagger stuck on a document would; it
+only returns if that process is killed.
+"""
+
+import os
+import re
+import sys
+import time
+import zlib
+import subprocess
+
+
+TAGS = ['NC', 'VLfin', 'ADJ', 'ART', 'PREP', 'ADV', 'NP', 'CC']
+TOKEN = re.compile(r"<[^<>]*>|[^\s<>]+")
+PUNCTUATION = re.compile(r"^(.*?)([.,;:!?]+)$")
+
+
+class TreeTagger(object):
+
+    def __init__(self, TAGLANG='en', TAGABBREV=None, **kwargs):
+        self.language = TAGLANG
+        self.abbreviations = set()
+        if TAGABBREV is not None:
+            with open(TAGABBREV, mode='r', encoding='utf-8') as afile:
+                self.abbreviations = set(afile.read().split())
+        self.latency = float(os.environ.get('FAKE_TREETAGGER_LATENCY', 0))
+        self.crash = os.environ.get('FAKE_TREETAGGER_CRASH')
+        self.hang = os.environ.get('FAKE_TREETAGGER_HANG')
+        self.process = None
+
+    def tokenize(self, text):
+        tokens = []
+        for token in TOKEN.findall(text):
+            match = PUNCTUATION.match(token)
+            if (token[0] == '<' or match is None or not match.group(1) or
+                    token in self.abbreviations):
+                tokens.append(token)
+            else:
+                tokens.append(match.group(1))
+                tokens.append(match.group(2))
+        return tokens
+
+    def tag_token(self, token):
+        if re.match(r'^[.,;:!?]+$', token):
+            return '{}\tFS\t{}'.format(token, token)
+        if token.isdigit():
+            return '{}\tCARD\t@card@'.format(token)
+        tag = TAGS[zlib.crc32(token.encode('utf-8')) % len(TAGS)]
+        return '{}\t{}\t{}'.format(token, tag, token.lower())
+
+    def tag_text(self, text, notagdns=False, notagip=False, notagurl=False,
+                 notagemail=False, tagonly=False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.crash and self.crash in text:
+            os._exit(70)
+        if self.hang and self.hang in text:
+            self.process = subprocess.Popen(
+                [sys.executable, '-c', 'import time; time.sleep(3600)'])
+            self.process.wait()
+            raise BrokenPipeError("TreeTagger exited with {}".format(
+                self.process.returncode))
+        if tagonly:
+            tokens = [t.strip() for t in text.split('\n') if t.strip()]
+        else:
+            tokens = self.tokenize(text)
+        return [t if t[0] == '<' and t[-1] == '>' else self.tag_token(t)
+                for t in tokens]
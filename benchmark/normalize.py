@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark the character normalization of pre_treetagger.py.
+
+PreTokenizer.search_and_replace is run on the text nodes of a synthetic
+corpus, in a single process, so the figures only measure normalization.
+With -c, the pre_treetagger.py of another revision is measured on the
+same texts and its output compared.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import importlib.util
+import subprocess
+import tempfile
+import corpus
+
+
+BENCHMARK = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(BENCHMARK)
+# characters rewritten by search_and_replace, mixed into the texts
+NOISE = ['，', '。', '“', '”', '（', '）', '％', '…', '’', '‘', '«', '»',
+         '–', ' - ', '  ', ' %', ' :', ' ?', '"', ',"', '１', '​']
+
+
+def texts(count, language, words, noise, seed):
+    """Get a list of random text nodes.
+
+    Keyword arguments:
+    count -- number of texts.
+    language -- one of 'en', 'es' or 'de'.
+    words -- mean number of words per sentence.
+    noise -- probability of a character of NOISE after a token.
+    seed -- seed of the random generator.
+    """
+    rng = random.Random(seed)
+    found = []
+    for i in range(count):
+        tokens = []
+        for j in range(3):
+            for token in corpus.sentence(rng, language, words, 0.1):
+                tokens.append(token)
+                if rng.random() < noise:
+                    tokens.append(rng.choice(NOISE))
+        found.append(' '.join(tokens))
+    return found
+
+
+def load(revision):
+    """Import pre_treetagger.py, from a git revision if provided.
+
+    Keyword arguments:
+    revision -- a string naming a commit, or None for the working tree.
+    """
+    path = os.path.join(REPOSITORY, 'pre_treetagger.py')
+    if revision is not None:
+        source = subprocess.check_output(
+            ['git', 'show', '{}:pre_treetagger.py'.format(revision)],
+            cwd=REPOSITORY)
+        # early revisions ran the script when imported
+        source = source.replace(b'\nprint(PreTokenizer())', b'\n')
+        handle, path = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(handle, mode='wb') as ofile:
+            ofile.write(source)
+    if REPOSITORY not in sys.path:
+        sys.path.insert(0, REPOSITORY)
+    spec = importlib.util.spec_from_file_location(
+        'pre_treetagger_{}'.format(revision or 'tree'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if revision is not None:
+        os.remove(path)
+    return module
+
+
+def measure(module, language, nodes, runs):
+    """Normalize texts, return the best time in seconds and the output.
+
+    Keyword arguments:
+    module -- pre_treetagger as returned by load.
+    language -- one of 'en', 'es' or 'de'.
+    nodes -- a list of strings.
+    runs -- number of runs, the fastest one is reported.
+    """
+    normalizer = module.PreTokenizer.__new__(module.PreTokenizer)
+    normalizer.lang = language
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        output = [normalizer.search_and_replace(text) for text in nodes]
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, output
+
+
+def cli():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--texts",
+        required=False,
+        default=20000,
+        type=int,
+        help="number of text nodes.")
+    parser.add_argument(
+        "-l", "--language",
+        required=False,
+        default='es',
+        choices=['en', 'es', 'de'],
+        help="language of the texts.")
+    parser.add_argument(
+        "--words",
+        required=False,
+        default=20,
+        type=float,
+        help="mean number of words per sentence.")
+    parser.add_argument(
+        "--noise",
+        required=False,
+        default=0.1,
+        type=float,
+        help="probability of a character to be normalized after a token.")
+    parser.add_argument(
+        "--seed",
+        required=False,
+        default=0,
+        type=int,
+        help="seed of the random generator.")
+    parser.add_argument(
+        "-r", "--repeat_runs",
+        required=False,
+        default=5,
+        type=int,
+        help="runs of every implementation, the fastest one is reported.")
+    parser.add_argument(
+        "-c", "--compare",
+        required=False,
+        default=None,
+        help="if provided, git revision whose pre_treetagger.py is also\
+              measured, e.g. the parent of a change.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = cli()
+    nodes = texts(args.texts, args.language, args.words, args.noise,
+                  args.seed)
+    characters = sum(len(text) for text in nodes)
+    seconds, output = measure(load(None), args.language, nodes,
+                              args.repeat_runs)
+    print('{:<12} {:>8.3f} s {:>12.0f} chars/s'.format(
+        'tree', seconds, characters / seconds))
+    if args.compare is not None:
+        old_seconds, old_output = measure(
+            load(args.compare), args.language, nodes, args.repeat_runs)
+        print('{:<12} {:>8.3f} s {:>12.0f} chars/s {:>6.2f}x'.format(
+            args.compare, old_seconds, characters / old_seconds,
+            old_seconds / seconds))
+        mismatches = sum(1 for a, b in zip(output, old_output) if a != b)
+        print('{} of {} texts differ'.format(mismatches, len(nodes)))
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark the scripts on synthetic corpora.
+
+Every stage runs in its own process, so that its peak RSS can be
+measured, on a corpus written by corpus.py. TreeTagger is replaced by the
+stand-in in benchmark/fake unless --real is provided.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import subprocess
+import corpus
+
+
+BENCHMARK = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(BENCHMARK)
+# name, corpus layout, script, arguments, input (a corpus or a stage)
+# the startup stages measure the time spent before any file is tagged
+STAGES = [
+    ('startup --help', 'empty', 'treetagger.py', ['--help'], None),
+    ('startup -s', 'empty', 'treetagger.py', ['-s', '-p', '*.xml'], None),
+    ('pre', 'elements', 'pre_treetagger.py',
+     ['-t', 'p', '-g', '*.xml'], None),
+    ('tag -s', 'elements', 'treetagger.py',
+     ['-e', 'p', '-s', '-p', '*.xml'], None),
+    ('tag -s --tokenize', 'elements', 'treetagger.py',
+     ['-e', 'p', '-s', '--tokenize', '-p', '*.xml'], None),
+    ('tag', 'vertical', 'treetagger.py',
+     ['-e', 'p', '-p', '*.xml'], None),
+    ('tag --tokenize', 'vertical', 'treetagger.py',
+     ['-e', 'p', '--tokenize', '-p', '*.xml'], None),
+    ('tag -r -s', 'root', 'treetagger.py',
+     ['-r', '-s', '-p', '*.xml'], None),
+    ('tag -r -s --tokenize', 'root', 'treetagger.py',
+     ['-r', '-s', '--tokenize', '-p', '*.xml'], None),
+    ('post', 'elements', 'post_treetagger.py',
+     ['-t', 'p', '-g', '*.vrt'], 'tag -s --tokenize'),
+    ('post --stream', 'elements', 'post_treetagger.py',
+     ['-t', 'p', '-g', '*.vrt', '--stream'], 'tag -s --tokenize'),
+]
+
+
+def run(script, args, env):
+    """Run a script, return its wall time and peak RSS in KiB.
+
+    Keyword arguments:
+    script -- a string with the file name of the script.
+    args -- a list of strings with its arguments.
+    env -- a dict with the environment of the process.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPOSITORY, script)] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env)
+    error = process.stderr.read()
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError('{} {} failed:\n{}'.format(
+            script, ' '.join(args), error.decode(errors='replace')))
+    return elapsed, usage.ru_maxrss
+
+
+def commit():
+    """Get the current commit of the repository, None if unknown."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPOSITORY,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(args):
+    """Run the stages selected with -k, return the results.
+
+    Keyword arguments:
+    args -- argparse.Namespace with the options of cli
+    """
+    env = dict(os.environ)
+    if not args.real:
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.join(BENCHMARK, 'fake')] +
+            [p for p in [env.get('PYTHONPATH')] if p])
+    workdir = tempfile.mkdtemp(prefix='ttg-benchmark-')
+    corpora = {}
+    outputs = {}
+    results = []
+    try:
+        for name, layout, script, options, source in STAGES:
+            if args.stages and name not in args.stages:
+                continue
+            if script == 'post_treetagger.py' and args.language == 'de':
+                continue  # post_treetagger.py has no rules for German
+            if layout not in corpora:
+                indir = os.path.join(workdir, layout)
+                files = 0 if layout == 'empty' else args.files
+                corpora[layout] = indir, corpus.generate(
+                    indir, files, layout, args.language, args.elements,
+                    args.sentences, args.words, args.repeat, args.seed)
+            indir, stats = corpora[layout]
+            if source is not None:
+                if source not in outputs:
+                    continue
+                indir = outputs[source]
+            options = options + ['-l', args.language] + args.extra
+            times = []
+            peak = 0
+            for i in range(args.repeat_runs):
+                outdir = os.path.join(workdir, 'out', name.replace(' ', '_'))
+                shutil.rmtree(outdir, ignore_errors=True)
+                elapsed, rss = run(
+                    script, ['-i', indir, '-o', outdir] + options, env)
+                times.append(elapsed)
+                peak = max(peak, rss)
+            outputs[name] = outdir
+            best = min(times)
+            results.append({
+                'stage': name,
+                'seconds': best,
+                'tokens_per_second': stats['tokens'] / best,
+                'files_per_second': stats['files'] / best,
+                'peak_rss_kib': peak,
+                'tokens': stats['tokens'],
+                'files': stats['files'],
+                'bytes': stats['bytes']})
+            print(row(results[-1]))
+    finally:
+        if args.keep:
+            print('corpora and outputs kept in {}'.format(workdir))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'commit': commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'backend': 'real' if args.real else 'fake',
+        'options': {
+            'files': args.files,
+            'language': args.language,
+            'elements': args.elements,
+            'sentences': args.sentences,
+            'words': args.words,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'extra': args.extra},
+        'results': results}
+
+
+def row(result, baseline=None):
+    """Format a result as a line of the report.
+
+    Keyword arguments:
+    result -- a dict for a stage as returned by benchmark.
+    baseline -- the dict for the same stage in a previous run, if any.
+    """
+    line = ('{:<22} {:>8.2f} s {:>10.0f} tokens/s {:>8.1f} files/s'
+            ' {:>8.1f} MiB').format(
+        result['stage'],
+        result['seconds'],
+        result['tokens_per_second'],
+        result['files_per_second'],
+        result['peak_rss_kib'] / 1024)
+    if baseline is not None:
+        line += ' {:>6.2f}x {:>+7.1f} MiB'.format(
+            baseline['seconds'] / result['seconds'],
+            (result['peak_rss_kib'] - baseline['peak_rss_kib']) / 1024)
+    return line
+
+
+def compare(report, path):
+    """Print the speedup of every stage over a saved report.
+
+    Keyword arguments:
+    report -- a dict as returned by benchmark.
+    path -- a string for the path of a saved report.
+    """
+    with open(path, mode='r', encoding='utf-8') as ifile:
+        baseline = json.load(ifile)
+    stages = {r['stage']: r for r in baseline['results']}
+    print('compared with {} ({}):'.format(baseline['commit'], path))
+    for result in report['results']:
+        print(row(result, stages.get(result['stage'])))
+
+
+def save(report, directory):
+    """Save a report as JSON, return its path.
+
+    Keyword arguments:
+    report -- a dict as returned by benchmark.
+    directory -- a string for the directory of the reports.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '{}-{}.json'.format(
+        report['date'].replace(':', ''), report['commit'] or 'unknown'))
+    with open(path, mode='w', encoding='utf-8') as ofile:
+        json.dump(report, ofile, indent=2)
+    return path
+
+
+def cli():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--files",
+        required=False,
+        default=50,
+        type=int,
+        help="number of files of every corpus.")
+    parser.add_argument(
+        "-l", "--language",
+        required=False,
+        default='es',
+        choices=['en', 'es', 'de'],
+        help="language of the corpora.")
+    parser.add_argument(
+        "--elements",
+        required=False,
+        default=20,
+        type=int,
+        help="number of <p> elements per file.")
+    parser.add_argument(
+        "--sentences",
+        required=False,
+        default=3,
+        type=float,
+        help="mean number of sentences per element.")
+    parser.add_argument(
+        "--words",
+        required=False,
+        default=20,
+        type=float,
+        help="mean number of words per sentence.")
+    parser.add_argument(
+        "--repeat",
+        required=False,
+        default=0.1,
+        type=float,
+        help="probability of a sentence being repeated boilerplate.")
+    parser.add_argument(
+        "--seed",
+        required=False,
+        default=0,
+        type=int,
+        help="seed of the random generator.")
+    parser.add_argument(
+        "-k", "--stages",
+        required=False,
+        nargs='+',
+        default=None,
+        choices=[s[0] for s in STAGES],
+        help="stages to be run, all by default.")
+    parser.add_argument(
+        "-x", "--extra",
+        required=False,
+        default='',
+        help="extra options passed to every script, e.g. '-b 2000'.")
+    parser.add_argument(
+        "-r", "--repeat_runs",
+        required=False,
+        default=3,
+        type=int,
+        help="runs of every stage, the fastest one is reported.")
+    parser.add_argument(
+        "--real",
+        required=False,
+        default=False,
+        action="store_true",
+        help="use the installed mytreetaggerwrapper and TreeTagger instead\
+              of the stand-in.")
+    parser.add_argument(
+        "--results",
+        required=False,
+        default=os.path.join(BENCHMARK, 'results'),
+        help="directory where the report is saved.")
+    parser.add_argument(
+        "-c", "--compare",
+        required=False,
+        default=None,
+        help="path to a saved report to compare with.")
+    parser.add_argument(
+        "--keep",
+        required=False,
+        default=False,
+        action="store_true",
+        help="keep the corpora and outputs.")
+    args = parser.parse_args()
+    args.extra = args.extra.split()
+    return args
+
+
+if __name__ == '__main__':
+    args = cli()
+    report = benchmark(args)
+    print('report saved in {}'.format(save(report, args.results)))
+    if args.compare is not None:
+        compare(report, args.compare)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keep TreeTagger output of sentences on disk to avoid tagging them again."""
+
+import time
+import hashlib
+import sqlite3
+
+
+# share of the cache evicted at once when it is full
+EVICT = 20
+# pending use times written even if nothing is stored
+PENDING = 10000
+
+
+class TagCache(object):
+    """Least recently used cache of tagged sentences in a SQLite database.
+
+    Entries are keyed by the hash of a namespace (the options the tagging
+    depends on) and the sentence text, and hold the TreeTagger output
+    lines. The database can be shared by several processes at once.
+
+    The number of rows is counted when the cache is opened and then kept
+    in memory; it is only counted again when it reaches size, and then
+    1/EVICT of the entries are removed at once. The time an entry is used
+    is written with the next put or flush instead of with every get.
+    """
+
+    def __init__(self, path, namespace, size):
+        """Constructor.
+
+        Keyword arguments:
+        path -- a string for the path of the database file.
+        namespace -- a string identifying the tagger configuration.
+        size -- maximum number of sentences kept in the cache.
+        """
+        self.namespace = namespace
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.used = {}  # key: time of the last get, not written yet
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS tags ('
+                'key TEXT PRIMARY KEY, tags TEXT, used REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS tags_used ON tags (used)')
+        self.count = self.connection.execute(
+            'SELECT COUNT(*) FROM tags').fetchone()[0]
+
+    def key(self, sentence):
+        key = '{}\n{}'.format(self.namespace, sentence)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, sentences):
+        """Get the cached output of a list of sentences, None if missing.
+
+        Keyword arguments:
+        sentences -- a list of strings with the sentences to be tagged.
+        """
+        keys = [self.key(s) for s in sentences]
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i+500]
+            found.update(self.connection.execute(
+                'SELECT key, tags FROM tags WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk))),
+                chunk))
+        now = time.time()
+        for key in found:
+            self.used[key] = now
+        if len(self.used) >= PENDING:
+            self.flush()
+        tagged = []
+        for key in keys:
+            if key in found:
+                self.hits += 1
+                tags = found[key]
+                tagged.append(tags.split('\n') if tags else [])
+            else:
+                self.misses += 1
+                tagged.append(None)
+        return tagged
+
+    def put(self, tagged):
+        """Store tagged sentences, evicting the least recently used ones.
+
+        Keyword arguments:
+        tagged -- a dict mapping sentences to lists of TreeTagger lines.
+        """
+        if not tagged:
+            return
+        now = time.time()
+        with self.connection:
+            self.write_used()
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO tags VALUES (?, ?, ?)',
+                [(self.key(s), '\n'.join(t), now) for s, t in tagged.items()])
+            self.count += len(tagged)
+            if self.count > self.size:
+                # other processes may have added or removed rows meanwhile
+                self.count = self.connection.execute(
+                    'SELECT COUNT(*) FROM tags').fetchone()[0]
+            if self.count > self.size:
+                evicted = self.count - self.size + self.size // EVICT
+                self.connection.execute(
+                    'DELETE FROM tags WHERE key IN ('
+                    'SELECT key FROM tags ORDER BY used LIMIT ?)',
+                    (evicted,))
+                self.count -= evicted
+
+    def write_used(self):
+        if self.used:
+            self.connection.executemany(
+                'UPDATE tags SET used = ? WHERE key = ?',
+                [(t, k) for k, t in self.used.items()])
+            self.used = {}
+
+    def flush(self):
+        """Write the time the entries got since the last put were used."""
+        if self.used:
+            with self.connection:
+                self.write_used()
+
+    def usage(self):
+        """Return hits and misses since the last call and reset them.
+
+        The pending use times are written too; the scripts call it after
+        every file.
+        """
+        self.flush()
+        usage = self.hits, self.misses
+        self.hits = 0
+        self.misses = 0
+        return usage
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Write the tokens of VRT documents as columns of integer ids.
+
+A store NAME in a directory is made of these files:
+
+    NAME.word, NAME.pos, NAME.lemma    an id per token (little-endian uint32)
+    NAME.word.vocab...                 a string per line, its id being the
+                                       number of the line (from 0)
+    NAME.sentences                     the first token of every sentence
+                                       (little-endian uint64)
+    NAME.documents                     a line per document with its id,
+                                       first token, number of tokens, first
+                                       sentence and number of sentences
+
+so the columns can be mapped in memory with NumPy (see load) and counted
+without parsing any XML. Documents are appended one at a time; the line of
+NAME.documents is written last, so a store left by an interrupted run is
+cut back to its last complete document when it is opened again.
+"""
+
+import os
+import sys
+import array
+import vrt
+import compression
+
+
+COLUMNS = ['word', 'pos', 'lemma']
+
+
+def typecode(itemsize):
+    """Get the array typecode of unsigned integers of itemsize bytes."""
+    for code in 'BHILQ':
+        if array.array(code).itemsize == itemsize:
+            return code
+    raise ValueError('no unsigned integers of {} bytes'.format(itemsize))
+
+
+IDS = typecode(4)
+OFFSETS = typecode(8)
+# tokens of a document kept in memory before their ids are written
+CHUNK = 65536
+
+
+def read_documents(path):
+    """Read the documents of a store, return a list of [id, first token,
+    tokens, first sentence, sentences].
+
+    Keyword arguments:
+    path -- a string for the path of NAME.documents.
+    """
+    documents = []
+    if not os.path.exists(path):
+        return documents
+    with open(path, mode='r', encoding='utf-8') as dfile:
+        for line in dfile:
+            if not line.endswith('\n'):
+                break  # interrupted while writing it
+            fields = line.rstrip('\n').split('\t')
+            documents.append([fields[0]] + [int(f) for f in fields[1:]])
+    return documents
+
+
+def read_vocabulary(path):
+    """Read a vocabulary, return a list of strings.
+
+    Keyword arguments:
+    path -- a string for the path of NAME.COLUMN.vocab.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, mode='r', encoding='utf-8', newline='\n') as vfile:
+        lines = vfile.read().split('\n')
+    return lines[:-1]  # the last one is empty or was interrupted
+
+
+class Tee(object):
+    """Write text to a file and to a ColumnDocument."""
+
+    def __init__(self, ofile, document):
+        self.ofile = ofile
+        self.document = document
+
+    def write(self, text):
+        self.ofile.write(text)
+        self.document.write(text)
+
+
+class ColumnDocument(object):
+    """Append the tokens of a document to a store as its VRT is written.
+
+    Lines are parsed as soon as they are complete, and the ids of their
+    tokens written every CHUNK tokens. The line of NAME.documents is only
+    written by close, and abort cuts the columns back, so a document that
+    couldn't be written doesn't end up in the store.
+    """
+
+    def __init__(self, store, source):
+        """Constructor.
+
+        Keyword arguments:
+        store -- the ColumnWriter the document is appended to.
+        source -- a string with the id of the document.
+        """
+        self.store = store
+        self.source = source
+        self.start = ('<{}>'.format(store.boundary),
+                      '<{} '.format(store.boundary))
+        self.rest = ''  # last line, not complete yet
+        self.tokens = 0
+        self.sentences = 0
+        self.new = True  # the next token starts a sentence
+        self.ids = [array.array(IDS) for column in COLUMNS]
+        self.starts = array.array(OFFSETS)
+
+    def write(self, text):
+        """Add a piece of the VRT of the document.
+
+        Keyword arguments:
+        text -- a string with the piece.
+        """
+        lines = (self.rest + text).split('\n')
+        self.rest = lines.pop()
+        for line in lines:
+            self.add_line(line)
+        if len(self.ids[0]) >= CHUNK:
+            self.flush()
+
+    def add_line(self, line):
+        if not line.strip():
+            return
+        if line[0] == '<':
+            if line.startswith(self.start):
+                self.new = True
+            return
+        if self.new:
+            self.starts.append(self.store.tokens + self.tokens)
+            self.sentences += 1
+            self.new = False
+        fields = vrt.unescape(line).split('\t')
+        fields += [''] * (3 - len(fields))
+        for k, column in enumerate(COLUMNS):
+            self.ids[k].append(self.store.intern(column, fields[k]))
+        self.tokens += 1
+
+    def flush(self):
+        for k, column in enumerate(COLUMNS):
+            self.store.write(column, self.ids[k])
+            self.ids[k] = array.array(IDS)
+        for column in COLUMNS:
+            self.store.files[column + '.vocab'].flush()
+        self.store.write('sentences', self.starts)
+        self.starts = array.array(OFFSETS)
+
+    def close(self):
+        """Write the rest of the document and its line in NAME.documents."""
+        self.add_line(self.rest)
+        self.rest = ''
+        self.flush()
+        store = self.store
+        store.files['documents'].write('{}\t{}\t{}\t{}\t{}\n'.format(
+            self.source.replace('\t', ' '), store.tokens, self.tokens,
+            store.sentences, self.sentences))
+        store.files['documents'].flush()
+        store.tokens += self.tokens
+        store.sentences += self.sentences
+
+    def abort(self):
+        """Remove the tokens written so far from the columns."""
+        for column in COLUMNS:
+            self.store.files[column].truncate(self.store.tokens * 4)
+        self.store.files['sentences'].truncate(self.store.sentences * 8)
+
+
+class ColumnWriter(object):
+    """Append the tokens of documents to a store, interning every value."""
+
+    def __init__(self, outdir, name, boundary='s'):
+        """Constructor.
+
+        An existing store is opened to be appended to.
+
+        Keyword arguments:
+        outdir -- a string for the output directory.
+        name -- a string for the name of the store.
+        boundary -- a string with the name of the element starting a
+                    sentence.
+        """
+        self.prefix = os.path.join(outdir, name)
+        self.boundary = boundary
+        documents = read_documents(self.prefix + '.documents')
+        self.tokens = 0
+        self.sentences = 0
+        if documents:
+            last = documents[-1]
+            self.tokens = last[1] + last[2]
+            self.sentences = last[3] + last[4]
+        self.ids = {}
+        self.files = {}
+        for column in COLUMNS:
+            path = '{}.{}.vocab'.format(self.prefix, column)
+            vocabulary = read_vocabulary(path)
+            self.ids[column] = {value: i for i, value in enumerate(vocabulary)}
+            self.files[column + '.vocab'] = self.reopen(
+                path, len(''.join(v + '\n' for v in vocabulary).encode(
+                    'utf-8')), False)
+            self.files[column] = self.reopen(
+                '{}.{}'.format(self.prefix, column), self.tokens * 4)
+        self.files['sentences'] = self.reopen(
+            self.prefix + '.sentences', self.sentences * 8)
+        self.files['documents'] = self.reopen(
+            self.prefix + '.documents',
+            len(''.join('\t'.join(str(f) for f in d) + '\n'
+                        for d in documents).encode('utf-8')),
+            False)
+
+    def reopen(self, path, size, binary=True):
+        """Open a file of the store for appending, cut to size bytes."""
+        with open(path, mode='ab') as afile:
+            afile.truncate(size)
+        if binary:
+            return open(path, mode='ab')
+        return open(path, mode='a', encoding='utf-8', newline='\n')
+
+    def intern(self, column, value):
+        ids = self.ids[column]
+        if value not in ids:
+            ids[value] = len(ids)
+            self.files[column + '.vocab'].write(value + '\n')
+        return ids[value]
+
+    def write(self, name, numbers):
+        if sys.byteorder == 'big':
+            numbers.byteswap()
+        self.files[name].write(numbers.tobytes())
+        self.files[name].flush()
+
+    def document(self, source):
+        """Start appending a document, return its ColumnDocument.
+
+        Keyword arguments:
+        source -- a string with the id of the document.
+        """
+        return ColumnDocument(self, source)
+
+    def add(self, source, text):
+        """Append the tokens of a document.
+
+        Keyword arguments:
+        source -- a string with the id of the document.
+        text -- a string with the VRT of the document.
+        """
+        document = self.document(source)
+        document.write(text)
+        document.close()
+
+    def add_file(self, source, path):
+        """Append the tokens of a document reading its VRT file.
+
+        Keyword arguments:
+        source -- a string with the id of the document.
+        path -- a string for the path of the VRT file, maybe compressed.
+        """
+        document = self.document(source)
+        try:
+            with compression.open_file(path) as ifile:
+                for chunk in iter(lambda: ifile.read(1 << 20), ''):
+                    document.write(chunk)
+        except BaseException:
+            document.abort()
+            raise
+        document.close()
+
+    def close(self):
+        for cfile in self.files.values():
+            cfile.close()
+        self.files = {}
+
+
+def load(directory, name):
+    """Map a store in memory with NumPy.
+
+    Return a dict with an array per column and for 'sentences', a list of
+    strings per vocabulary ('word.vocab'...) and the documents as read by
+    read_documents.
+
+    Keyword arguments:
+    directory -- a string for the directory of the store.
+    name -- a string for the name of the store.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is needed to load columns: pip install numpy")
+    prefix = os.path.join(directory, name)
+    store = {'documents': read_documents(prefix + '.documents')}
+    for column, dtype in [(c, '<u4') for c in COLUMNS] + [
+            ('sentences', '<u8')]:
+        path = '{}.{}'.format(prefix, column)
+        if os.path.getsize(path):
+            store[column] = numpy.memmap(path, dtype=dtype, mode='r')
+        else:
+            store[column] = numpy.zeros(0, dtype=dtype)
+    for column in COLUMNS:
+        store[column + '.vocab'] = read_vocabulary(
+            '{}.{}.vocab'.format(prefix, column))
+    return store
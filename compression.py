@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read and write files compressed with gzip, xz, bz2 or zstd.
+
+The compression of a file is told by its extension. The modules are only
+imported when a compressed file is opened; zstd needs the zstandard
+package.
+"""
+
+import io
+import os
+import fnmatch
+
+
+# extension of the compressed files, as given to --compress
+COMPRESSIONS = ['gz', 'xz', 'bz2', 'zst']
+
+
+def detect(path):
+    """Get the compression of a file from its extension, None if plain.
+
+    Keyword arguments:
+    path -- a string for the path of the file.
+    """
+    extension = os.path.splitext(path)[1][1:]
+    if extension in COMPRESSIONS:
+        return extension
+    return None
+
+
+def strip(path):
+    """Remove the compression extension of a path, if any.
+
+    Keyword arguments:
+    path -- a string for the path of the file.
+    """
+    if detect(path) is not None:
+        return os.path.splitext(path)[0]
+    return path
+
+
+def suffix(compression):
+    """Get the extension added to the output files for --compress.
+
+    Keyword arguments:
+    compression -- one of COMPRESSIONS or None.
+    """
+    if compression is None:
+        return ''
+    return '.' + compression
+
+
+def filter_files(filenames, pattern):
+    """Get the file names matching a glob pattern, compressed or not.
+
+    'doc.xml.gz' matches '*.xml' as well as '*.gz'.
+
+    Keyword arguments:
+    filenames -- a list of strings with file names.
+    pattern -- a string as glob pattern.
+    """
+    return [f for f in filenames
+            if fnmatch.fnmatch(f, pattern) or
+            fnmatch.fnmatch(strip(f), pattern)]
+
+
+def open_file(path, mode='r', encoding='utf-8', compression=None):
+    """Open a file, compressed or not, as the built-in open does.
+
+    Keyword arguments:
+    path -- a string for the path of the file.
+    mode -- 'r', 'w', 'a', 'rb', 'wb' or 'ab'.
+    encoding -- the encoding of text modes, None for binary modes.
+    compression -- one of COMPRESSIONS, by default the one of the
+                   extension of path.
+    """
+    if compression is None:
+        compression = detect(path)
+    if compression is None:
+        return open(path, mode=mode, encoding=encoding)
+    binary = mode.replace('b', '') + 'b'
+    if compression == 'gz':
+        import gzip
+        # level 6, as gzip(1): 9 is much slower for little gain
+        stream = gzip.open(path, binary, compresslevel=6)
+    elif compression == 'xz':
+        import lzma
+        stream = lzma.open(path, binary)
+    elif compression == 'bz2':
+        import bz2
+        stream = bz2.open(path, binary)
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "zstandard is needed for {}: pip install zstandard".format(
+                    path))
+        stream = zstandard.open(path, binary)
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding)
+
+
+def compress(data, compression):
+    """Compress bytes as a complete stream, that can be concatenated.
+
+    Keyword arguments:
+    data -- bytes to be compressed.
+    compression -- one of COMPRESSIONS or None to leave data as it is.
+    """
+    if compression is None:
+        return data
+    if compression == 'gz':
+        import gzip
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    elif compression == 'xz':
+        import lzma
+        return lzma.compress(data)
+    elif compression == 'bz2':
+        import bz2
+        return bz2.compress(data)
+    import zstandard
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def decompress(data, compression):
+    """Decompress bytes compressed with compress.
+
+    Keyword arguments:
+    data -- bytes to be decompressed.
+    compression -- one of COMPRESSIONS or None if data is not compressed.
+    """
+    if compression is None:
+        return data
+    if compression == 'gz':
+        import gzip
+        return gzip.decompress(data)
+    elif compression == 'xz':
+        import lzma
+        return lzma.decompress(data)
+    elif compression == 'bz2':
+        import bz2
+        return bz2.decompress(data)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
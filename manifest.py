@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keep track of processed files to skip them in incremental runs."""
+
+import os
+import json
+import hashlib
+import contextlib
+import compression
+
+
+def fingerprint(paths):
+    """Hash the content of a list of files.
+
+    Keyword arguments:
+    paths -- a list of strings with the paths of the files.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, mode='rb') as ifile:
+            for chunk in iter(lambda: ifile.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', encoding='utf-8'):
+    """Open a file for writing that replaces path only once it is complete.
+
+    The file is compressed if the extension of path tells so, and its
+    directory is created if needed.
+
+    Keyword arguments:
+    path -- a string for the path of the file to be written.
+    mode -- the mode to open the file with.
+    encoding -- the encoding of the file, None for binary modes.
+    """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    try:
+        with compression.open_file(
+                tmp, mode, encoding, compression.detect(path)) as ofile:
+            yield ofile
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Manifest(object):
+    """Record of the files processed with a given configuration.
+
+    Every line of the manifest is a JSON object with the path of an input
+    file (relative to the input directory), its size, modification time
+    and content hash, and the hash of the configuration used to process
+    it. Entries are appended as soon as each output is written, so an
+    interrupted run can be resumed. A file whose size and modification
+    time haven't changed is not hashed again.
+    """
+
+    def __init__(self, path, indir, config, output_path):
+        """Constructor.
+
+        Keyword arguments:
+        path -- a string for the path of the manifest file.
+        indir -- a string for the input directory.
+        config -- a dict with the options affecting the output.
+        output_path -- a function returning the output path of an input.
+        """
+        self.path = path
+        self.indir = indir
+        self.config = hashlib.sha1(
+            json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+        self.output_path = output_path
+        self.done = {}
+        self.current = {}
+        if os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as mfile:
+                for line in mfile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # line cut by a killed run
+                        continue
+                    self.done[entry['input']] = entry
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with atomic_open(path) as mfile:  # drop superseded entries
+            for entry in self.done.values():
+                mfile.write(json.dumps(entry) + '\n')
+        self.mfile = open(path, mode='a', encoding='utf-8')
+
+    def pending(self, infiles):
+        """Get the files whose output is missing or out of date.
+
+        Keyword arguments:
+        infiles -- a list of strings with the paths of the input files.
+        """
+        pending = []
+        for infile in infiles:
+            key = os.path.relpath(infile, self.indir)
+            stat = os.stat(infile)
+            entry = self.done.get(key)
+            if (entry is not None and
+                    entry['size'] == stat.st_size and
+                    entry['mtime'] == stat.st_mtime_ns):
+                digest = entry['hash']
+            else:
+                digest = fingerprint([infile])
+            self.current[infile] = {
+                'input': key,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'hash': digest,
+                'config': self.config}
+            if (entry is None or
+                    entry['hash'] != digest or
+                    entry['config'] != self.config or
+                    not os.path.exists(self.output_path(infile))):
+                pending.append(infile)
+            elif entry['mtime'] != stat.st_mtime_ns:
+                # touched but not changed: not hashed again next time
+                self.record(infile)
+        return pending
+
+    def record(self, infile):
+        """Record that the output of a file has been written.
+
+        Keyword arguments:
+        infile -- a string with the path of an input file from pending.
+        """
+        self.mfile.write(json.dumps(self.current[infile]) + '\n')
+        self.mfile.flush()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure files and processing phases, and profile the slowest files."""
+
+import os
+import json
+import time
+import heapq
+import marshal
+import cProfile
+import resource
+import threading
+
+
+SLOW = 5  # slowest files named in the summary
+
+
+class Phase(object):
+    """Context manager adding its wall time to a phase of the current file.
+
+    Time spent in a nested phase is only counted for the nested one.
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        now = time.perf_counter()
+        stack = self.metrics.stack
+        if stack:
+            self.metrics.add_time(stack[-1][0], now - stack[-1][1])
+        stack.append([self.name, now])
+        return self
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        stack = self.metrics.stack
+        name, start = stack.pop()
+        self.metrics.add_time(name, now - start)
+        if stack:
+            stack[-1][1] = now
+        return False
+
+
+class Metrics(object):
+    """Per-file and per-phase metrics written as JSON lines.
+
+    Every processed file gets a record with its wall time, the time spent
+    in every phase, counters (sentences, tokens...), bytes read and
+    written and the peak RSS of the process so far. If profiles is
+    greater than 0, every file is run under cProfile and the profiles of
+    the slowest ones are dumped when the run is closed.
+
+    The record of the current file is kept per thread, and it can be
+    handed over to another thread with suspend and resume.
+    """
+
+    def __init__(self, path=None, profiles=0, directory=None):
+        """Constructor.
+
+        Keyword arguments:
+        path -- a string for the path of the metrics file, None to keep
+                the totals only.
+        profiles -- number of slowest files whose profile is dumped.
+        directory -- a string for the path to the input directory, the
+                     profiles are named after the paths below it.
+        """
+        self.path = path
+        self.profiles = profiles
+        self.directory = directory
+        self.started = time.perf_counter()
+        self.files = 0
+        self.phases = {}
+        self.counts = {}  # totals of the counters of the records
+        self.slow = []  # heap of (seconds, path) of the slowest files
+        self.failed = []  # paths of the files that could not be processed
+        self.local = threading.local()
+        self.slowest = []  # heap of (seconds, counter, path, stats)
+        self.mfile = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.mfile = open(path, mode='a', encoding='utf-8')
+
+    def __getstate__(self):
+        # copies sent to worker processes only collect records
+        return {'path': None, 'profiles': self.profiles,
+                'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def record(self):
+        return getattr(self.local, 'record', None)
+
+    @record.setter
+    def record(self, record):
+        self.local.record = record
+
+    @property
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @stack.setter
+    def stack(self, stack):
+        self.local.stack = stack
+
+    @property
+    def profile(self):
+        return getattr(self.local, 'profile', None)
+
+    @profile.setter
+    def profile(self, profile):
+        self.local.profile = profile
+
+    def phase(self, name):
+        """Time a phase of the current file within a with statement.
+
+        Keyword arguments:
+        name -- a string with the name of the phase.
+        """
+        return Phase(self, name)
+
+    def add_time(self, name, seconds):
+        if self.record is not None:
+            phases = self.record['phases']
+            phases[name] = phases.get(name, 0) + seconds
+
+    def count(self, name, n=1):
+        """Add n to a counter of the current file.
+
+        Keyword arguments:
+        name -- a string with the name of the counter.
+        n -- the number to be added.
+        """
+        if self.record is not None:
+            self.record[name] = self.record.get(name, 0) + n
+
+    def set(self, name, value):
+        """Set a field of the record of the current file.
+
+        Keyword arguments:
+        name -- a string with the name of the field.
+        value -- a value that can be serialized as JSON.
+        """
+        if self.record is not None:
+            self.record[name] = value
+
+    def start(self, infile, bytes_in=None):
+        """Start the record of a file.
+
+        Keyword arguments:
+        infile -- a string for the path to the file being processed.
+        bytes_in -- the size of the input, by default the one of the file.
+        """
+        if bytes_in is None:
+            bytes_in = os.path.getsize(infile)
+        self.record = {
+            'file': infile,
+            'seconds': time.perf_counter(),
+            'phases': {},
+            'bytes_in': bytes_in}
+        self.stack = []
+        if self.profiles:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def suspend(self):
+        """Detach the record of the current file from this thread.
+
+        Return the record, to be passed to resume in another thread.
+        Files that are profiled can't be suspended.
+        """
+        record = self.record
+        self.record = None
+        self.stack = []
+        return record
+
+    def resume(self, record):
+        """Make a suspended record the one of the current file.
+
+        Keyword arguments:
+        record -- a dict as returned by suspend.
+        """
+        self.record = record
+        self.stack = []
+
+    def stop(self, error=False):
+        """Close the record of the current file.
+
+        Return the record and the profile statistics, if any.
+
+        Keyword arguments:
+        error -- True if the file could not be processed.
+        """
+        stats = None
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.create_stats()
+            stats = self.profile.stats
+            self.profile = None
+        record = self.record
+        self.record = None
+        record['seconds'] = time.perf_counter() - record['seconds']
+        record['peak_rss_kib'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        if error:
+            record['error'] = True
+        return record, stats
+
+    def add(self, record, stats=None):
+        """Add the record of a file to the totals and the metrics file.
+
+        Keyword arguments:
+        record -- a dict as returned by stop.
+        stats -- the profile statistics as returned by stop.
+        """
+        self.files += 1
+        entry = (record['seconds'], record['file'])
+        if len(self.slow) < SLOW:
+            heapq.heappush(self.slow, entry)
+        else:
+            heapq.heappushpop(self.slow, entry)
+        if record.get('error'):
+            self.failed.append(record['file'])
+        for name, seconds in record['phases'].items():
+            self.phases[name] = self.phases.get(name, 0) + seconds
+        for name, value in record.items():
+            if (isinstance(value, int) and not isinstance(value, bool) and
+                    name != 'peak_rss_kib'):
+                self.counts[name] = self.counts.get(name, 0) + value
+        if self.mfile is not None:
+            self.mfile.write(json.dumps(record) + '\n')
+            self.mfile.flush()
+        if stats is not None:
+            entry = (record['seconds'], self.files, record['file'], stats)
+            if len(self.slowest) < self.profiles:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def file(self, infile):
+        """Measure a file within a with statement.
+
+        Keyword arguments:
+        infile -- a string for the path to the file being processed.
+        """
+        return FileRecord(self, infile)
+
+    def close(self):
+        """Dump the profiles of the slowest files and close the output."""
+        if self.slowest:
+            directory = os.path.splitext(self.path or 'metrics')[0]
+            directory += '-profiles'
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            names = set()
+            for seconds, counter, infile, stats in sorted(self.slowest):
+                name = self.profile_name(infile)
+                if name in names:  # the same source given twice
+                    name = '{}~{}'.format(name, counter)
+                names.add(name)
+                name += '.prof'
+                with open(os.path.join(directory, name), mode='wb') as pfile:
+                    marshal.dump(stats, pfile)
+        if self.mfile is not None:
+            self.mfile.close()
+            self.mfile = None
+
+    def profile_name(self, infile):
+        """Get the path of a file below the input directory as a file name.
+
+        Keyword arguments:
+        infile -- a string for the path to the processed file.
+        """
+        name = infile
+        if self.directory is not None:
+            name = os.path.relpath(infile, self.directory)
+        name = name.replace('%', '%25')
+        for separator in {os.sep, os.altsep or os.sep, '/'}:
+            name = name.replace(separator, '%2F')
+        return name
+
+    def summary(self):
+        """Get a line with the total wall time and the time of each phase."""
+        phases = ', '.join(
+            '{} {:.2f}'.format(name, seconds)
+            for name, seconds in sorted(
+                self.phases.items(), key=lambda x: -x[1]))
+        summary = '{} files in {:.2f} sec'.format(
+            self.files, time.perf_counter() - self.started)
+        if phases:
+            summary += ' ({})'.format(phases)
+        return summary
+
+    def files_summary(self):
+        """Get lines with the slowest files and the failed ones, if any."""
+        lines = []
+        if self.slow:
+            lines.append('slowest: ' + ', '.join(
+                '{} {:.2f} s'.format(path, seconds)
+                for seconds, path in sorted(self.slow, reverse=True)))
+        if self.failed:
+            lines.append('failed: ' + ', '.join(self.failed))
+        return '\n'.join(lines)
+
+
+class FileRecord(object):
+    """Context manager measuring a file with Metrics."""
+
+    def __init__(self, metrics, infile):
+        self.metrics = metrics
+        self.infile = infile
+
+    def __enter__(self):
+        self.metrics.start(self.infile)
+        return self.metrics
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.metrics.add(*self.metrics.stop(error=exc_type is not None))
+        return False
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import io
+import argparse
+from lxml import etree
+from pre_treetagger import PreTokenizer
+from treetagger import (
+    TagWithTreeTagger, LANGUAGES, check_languages, check_stages)
+from post_treetagger import PostTagger
+import pre_treetagger
+import treetagger
+import post_treetagger
+import vrt
+import rules
+import compression
+from manifest import Manifest, fingerprint
+from shards import ShardWriter
+from columns import ColumnWriter
+
+
+class PreStage(PreTokenizer):
+    """PreTokenizer configured by the pipeline."""
+
+    def __init__(self, args):
+        self.configure(args)
+
+
+class PostStage(PostTagger):
+    """PostTagger configured by the pipeline."""
+
+    def __init__(self, args):
+        self.configure(args)
+
+
+class Pipeline(TagWithTreeTagger):
+    """Normalize, tag and fix files parsing and writing them only once."""
+
+    def __str__(self):
+        message = "{} files in '{}' processed!".format(
+            str(self.counter),
+            "', '".join(sorted(self.languages)) or self.language)
+        fired = rules.report(self.metrics.counts)
+        if fired:
+            message += "\n" + fired
+        if self.stages is not None:
+            message += "\n" + self.stages
+        files = self.metrics.files_summary()
+        if files:
+            message += "\n" + files
+        return message
+
+    def config(self):
+        """Get the options and code versions the output depends on."""
+        config = TagWithTreeTagger.config(self)
+        config.update({
+            'text': self.pre.text,
+            'strip': self.pre.strip,
+            'rules': fingerprint(rules.rules_files(self.post.rules)),
+            'version': fingerprint([
+                __file__,
+                vrt.__file__,
+                pre_treetagger.__file__,
+                treetagger.__file__,
+                post_treetagger.__file__,
+                rules.__file__])})
+        return config
+
+    def init_manifest(self):
+        """Load the manifest of the output directory if -u is provided."""
+        if not self.incremental:
+            return None
+        return Manifest(
+            os.path.join(self.post.odir, '.pipeline.manifest'),
+            self.indir,
+            self.config(),
+            self.post.output_path)
+
+    def init_metrics(self):
+        """Create the Metrics of the run, shared with the other stages."""
+        metrics = TagWithTreeTagger.init_metrics(self)
+        self.pre.metrics = metrics
+        self.post.metrics = metrics
+        return metrics
+
+    def init_shards(self):
+        """Create the ShardWriter of the run if --concatenate is provided.
+
+        The documents are written by the post stage.
+        """
+        self.post.documents = self.documents
+        if self.concatenate is None:
+            return None
+        if not os.path.exists(self.post.odir):
+            os.makedirs(self.post.odir)
+        return ShardWriter(
+            self.post.odir,
+            self.concatenate,
+            self.shard_size * 1024 * 1024,
+            self.compress)
+
+    def init_columns(self):
+        """Create the ColumnWriter of the run if --columns is provided.
+
+        The documents are written by the post stage.
+        """
+        self.post.column_store = None
+        if self.columns is None:
+            return None
+        if not os.path.exists(self.post.odir):
+            os.makedirs(self.post.odir)
+        self.post.column_store = ColumnWriter(
+            self.post.odir, self.columns, self.boundary())
+        return self.post.column_store
+
+    def read_file(self, infile):
+        """Parse a file to be processed.
+
+        Keyword arguments:
+        infile -- a string for the path to the file to be processed.
+        """
+        return self.pre.read_xml(infile)
+
+    def tag_document(self, infile, tree):
+        """Normalize, tag and fix a parsed file.
+
+        Return the ElementTree to be serialized.
+
+        Keyword arguments:
+        infile -- a string for the path to the file being processed.
+        tree -- ElementTree returned by read_file.
+        """
+        self.pre.lang = self.language
+        self.post.lang = self.language
+        with self.metrics.phase('normalize'):
+            self.pre.process_tree(tree)
+        if self.debug is not None:
+            self.pre.serialize(etree.tostring(
+                tree,
+                encoding='utf-8',
+                method='xml',
+                xml_declaration=True,
+                pretty_print=True).decode(), infile)
+        xml = self.tag_tree(tree)
+        # PostTagger rules work on the text as laid out in the VRT file
+        with self.metrics.phase('vrt'):
+            output = io.StringIO()
+            vrt.write(xml, output)
+            output = output.getvalue()
+            if self.debug is not None:
+                debug_path = self.output_path(infile)
+                os.makedirs(os.path.dirname(debug_path), exist_ok=True)
+                with compression.open_file(debug_path, mode='w') as ofile:
+                    ofile.write(output)
+            parser = etree.XMLParser(remove_blank_text=True, encoding='utf-8')
+            tree = etree.parse(io.BytesIO(output.encode('utf-8')), parser)
+        with self.metrics.phase('fix'):
+            self.post.process_tree(tree)
+        return tree
+
+    def write_file(self, infile, tree):
+        """Serialize a processed file.
+
+        Keyword arguments:
+        infile -- a string for the path to the file processed.
+        tree -- ElementTree returned by tag_document.
+        """
+        self.post.serialize(tree, infile)
+
+    def cli(self):
+        """CLI parses command-line arguments"""
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            "-i", "--input",
+            required=True,
+            help="path to the input directory.")
+        parser.add_argument(
+            "-o", "--output",
+            required=True,
+            help="path to the output directory.")
+        parser.add_argument(
+            "-l", "--language",
+            required=False,
+            default=None,
+            choices=LANGUAGES,
+            help="language of the version to be processed (the default one\
+                  if --language_from is provided).")
+        parser.add_argument(
+            "--language_from",
+            required=False,
+            default=None,
+            help="if provided, where the language of each file is found:\
+                  'attribute:NAME' of the root element, 'path:N' for the Nth\
+                  directory below the input directory, or 'map:FILE' with a\
+                  path or file name and a language per line.")
+        parser.add_argument(
+            "-t", "--text",
+            required=False,
+            default="s",
+            help="element containing text to be normalized and fixed (by\
+                  default 's').")
+        parser.add_argument(
+            "--strip",
+            required=False,
+            default=False,
+            action="store_true",
+            help="strip empty lines and white spaces for text. False by\
+                  default.")
+        parser.add_argument(
+            "-e", "--element",
+            required=False,
+            default='p',
+            help="XML element containing the text to be split in sentences.")
+        parser.add_argument(
+            "-r", "--is_root",
+            required=False,
+            default=False,
+            action="store_true",
+            help="XML element containing the text is root.")
+        parser.add_argument(
+            "-p", "-g", "--pattern", "--glob_pattern",
+            dest="pattern",
+            required=False,
+            default="*.xml",
+            help="glob pattern to filter files.")
+        parser.add_argument(
+            '-s', "--sentence",
+            required=False,
+            default=False,
+            action="store_true",
+            help="if provided, it splits text in sentences.")
+        parser.add_argument(
+            "--tokenize",
+            required=False,
+            default=False,
+            action="store_true",
+            help="if provided, it tokenizes the text, else, it expects one\
+                  token per line.")
+        parser.add_argument(
+            "-a", "--abbreviation",
+            required=False,
+            default=None,
+            help="path to the abbreviation file, if not provided uses default\
+                  TreeTagger's abbreviation file.")
+        parser.add_argument(
+            "--rules",
+            required=False,
+            default=rules.DIRECTORY,
+            help="directory with a LANG.rules file per language fixing the\
+                  tagging (by default the rules directory of ttg).")
+        parser.add_argument(
+            "-z", "--compress",
+            required=False,
+            default=None,
+            choices=compression.COMPRESSIONS,
+            help="if provided, output files are compressed (input files are\
+                  decompressed according to their extension).")
+        parser.add_argument(
+            "--concatenate",
+            required=False,
+            default=None,
+            help="if provided, documents are written to NAME-0000.vrt...\
+                  in the output directory, each one in a <text> element,\
+                  with their offsets in NAME.index.")
+        parser.add_argument(
+            "--shard_size",
+            required=False,
+            default=0,
+            type=int,
+            help="maximum size of every file written with --concatenate in\
+                  MB, a single file if 0.")
+        parser.add_argument(
+            "--columns",
+            required=False,
+            default=None,
+            help="if provided, the word, POS and lemma of every token are\
+                  also appended as arrays of ids to NAME.word, NAME.pos and\
+                  NAME.lemma in the output directory, with their\
+                  vocabularies and the sentence and document offsets.")
+        parser.add_argument(
+            "-b", "--batch",
+            required=False,
+            default=0,
+            type=int,
+            help="if provided, sentences are sent to TreeTagger in batches\
+                  of up to BATCH characters.")
+        parser.add_argument(
+            "-j", "--jobs",
+            required=False,
+            default=1,
+            type=int,
+            help="number of worker processes, each one with its own\
+                  TreeTagger instance.")
+        parser.add_argument(
+            "--taggers",
+            required=False,
+            default=1,
+            type=int,
+            help="number of TreeTagger instances per language (and per\
+                  process with -j) tagging the elements or sentences of a\
+                  file at once.")
+        parser.add_argument(
+            "--readers",
+            required=False,
+            default=0,
+            type=int,
+            help="if provided, number of threads reading the next files\
+                  while the current one is processed, another thread writes\
+                  the processed files.")
+        parser.add_argument(
+            "--queue_size",
+            required=False,
+            default=4,
+            type=int,
+            help="maximum number of files read or processed waiting for the\
+                  next stage with --readers.")
+        parser.add_argument(
+            "--order",
+            required=False,
+            default='directory',
+            choices=treetagger.ORDERS,
+            help="order in which files are processed: as found in the input\
+                  directory or the largest first, so that no large file is\
+                  left for the end of a run with -j.")
+        parser.add_argument(
+            "--timeout",
+            required=False,
+            default=0,
+            type=float,
+            help="if provided, seconds after which the TreeTagger instances\
+                  tagging a file are killed and started again; a file\
+                  timing out in every attempt is put in quarantine and\
+                  skipped by the next runs with -u.")
+        parser.add_argument(
+            "--retries",
+            required=False,
+            default=1,
+            type=int,
+            help="number of times a file timing out is processed again with\
+                  --timeout.")
+        parser.add_argument(
+            "-d", "--debug",
+            required=False,
+            default=None,
+            help="if provided, path to a directory where the output of the\
+                  preprocessing and the tagging is also written.")
+        parser.add_argument(
+            "-u", "--incremental",
+            required=False,
+            default=False,
+            action="store_true",
+            help="if provided, files whose output is up to date are skipped\
+                  and processed files are recorded in a manifest in the\
+                  output directory.")
+        parser.add_argument(
+            "-c", "--cache",
+            required=False,
+            default=None,
+            help="if provided, path to a database where tagged sentences are\
+                  kept to avoid tagging them again (it can be shared by\
+                  several runs).")
+        parser.add_argument(
+            "--cache_size",
+            required=False,
+            default=1000000,
+            type=int,
+            help="maximum number of sentences in the cache, the least\
+                  recently used ones are removed first.")
+        parser.add_argument(
+            "-m", "--metrics",
+            required=False,
+            default=None,
+            help="if provided, path to a file where the time of every phase,\
+                  counts and memory usage of each file are written as JSON\
+                  lines.")
+        parser.add_argument(
+            "--profile",
+            required=False,
+            default=0,
+            type=int,
+            help="if provided, files are profiled and the profiles of the\
+                  PROFILE slowest ones are written next to the metrics file.")
+        args = parser.parse_args()
+        args.stream = False
+        check_languages(parser, args)
+        check_stages(parser, args)
+        if args.concatenate is not None and args.incremental:
+            parser.error("--concatenate can't be combined with -u")
+        if args.columns is not None and args.incremental:
+            parser.error("--columns can't be combined with -u")
+        self.configure(args)
+        self.server = None
+        pass
+
+    def configure(self, args):
+        """Set options from parsed arguments and configure the stages.
+
+        Keyword arguments:
+        args -- argparse.Namespace with the options of cli
+        """
+        TagWithTreeTagger.configure(self, args)
+        self.debug = args.debug
+        if self.debug is not None:
+            self.outdir = os.path.join(self.debug, 'tagged')
+            if not os.path.exists(self.outdir):
+                os.makedirs(self.outdir)
+        pre_output = None  # normalized files are only written with -d
+        if self.debug is not None:
+            pre_output = os.path.join(self.debug, 'pre')
+        self.pre = PreStage(argparse.Namespace(
+            input=args.input,
+            output=pre_output,
+            text=args.text,
+            glob_pattern=args.pattern,
+            strip=args.strip,
+            language=args.language,
+            compress=None,
+            jobs=1,
+            split_size=0,
+            concatenate=None,
+            shard_size=0,
+            columns=None,
+            incremental=False,
+            metrics=None,
+            profile=0))
+        self.post = PostStage(argparse.Namespace(
+            input=args.input,
+            output=args.output,
+            text=args.text,
+            glob_pattern=args.pattern,
+            language=args.language,
+            rules=args.rules,
+            compress=args.compress,
+            stream=False,
+            jobs=1,
+            split_size=0,
+            concatenate=args.concatenate,
+            shard_size=args.shard_size,
+            columns=args.columns,
+            incremental=False,
+            metrics=None,
+            profile=0))
+        pass
+
+
+if __name__ == '__main__':
+    print(Pipeline())
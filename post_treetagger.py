@@ -2,42 +2,118 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
+import sys
 import argparse
-import time
-import fnmatch
-from lxml import etree
 import re
+import traceback
+import collections
+import contextlib
+import pickle
+from lxml import etree
+import vrt
+import rules
+import compression
+from manifest import Manifest, atomic_open, fingerprint
+from metrics import Metrics
+from shards import ShardWriter, source_id
+from columns import ColumnWriter, Tee
+from stages import split_chunks
+
+
+TAG_NAME = re.compile(r"<([^\s/>]+)")
+worker = None
+
+
+def init_worker(tagger):
+    """Keep the PostTagger used by a worker process.
+
+    Keyword arguments:
+    tagger -- a configured PostTagger.
+    """
+    global worker
+    # the copy a spawned process gets, also when the pool forks: without
+    # the manifest, shards and columns of the main process
+    worker = pickle.loads(pickle.dumps(tagger))
 
 
-def timeit(method):
-    """Time methods."""
-    def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
+def process_file(ifile):
+    """Fix a file in a worker process, reporting any failure.
 
-        print('%r %2.2f sec' %
-              (method.__name__, te-ts))
-        return result
+    Return the path, the traceback of the error if any, the metrics
+    record and profile of the file, and the documents to be appended to
+    the shards or the columns.
 
-    return timed
+    Keyword arguments:
+    ifile -- path to the input file as string
+    """
+    error = None
+    worker.metrics.start(ifile)
+    try:
+        worker.process_file(ifile)
+    except Exception:
+        error = traceback.format_exc()
+    record = worker.metrics.stop(error is not None)
+    documents = list(worker.documents)
+    del worker.documents[:]
+    return ifile, error, record, documents
+
+
+def fix_chunk(texts):
+    """Fix a chunk of the text nodes of a file in a worker process.
+
+    Return the fixed strings and the times every rule fired.
+
+    Keyword arguments:
+    texts -- a list of strings.
+    """
+    texts = [worker.search_and_replace(tc) for tc in texts]
+    return texts, worker.ruleset().counts()
 
 
 class PostTagger(object):
     """Correct POS tagging."""
 
-    @timeit
     def __init__(self):
         """Constructor."""
         self.cli()
+        self.metrics = Metrics(self.metrics_path, self.profile, self.idir)
         self.ifiles = self.get_files(self.idir, self.pattern)
+        self.manifest = self.init_manifest()
+        if self.manifest is not None:
+            self.ifiles = self.manifest.pending(self.ifiles)
         self.counter = 0
-        self.main()
+        self.documents = []  # waiting to be appended to shards and columns
+        self.shards = self.init_shards()
+        self.column_store = self.init_columns()
+        try:
+            if self.jobs > 1:
+                self.main_parallel()
+            else:
+                self.main()
+        finally:
+            if self.shards is not None:
+                self.shards.close()
+            if self.column_store is not None:
+                self.column_store.close()
+        self.metrics.close()
+        print(self.metrics.summary())
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['manifest'] = None  # only the main process records files
+        state['shards'] = None  # and writes the shards
+        state['column_store'] = None  # and the columns
+        state['pool'] = None
+        return state
 
     def __str__(self):
         """Print The End message."""
         message = ["{} files processed!".format(self.counter)]
-        return " ".join(message)
+        fired = rules.report(self.metrics.counts)
+        if fired:
+            message.append(fired)
+        return "\n".join(message)
 
     def get_files(self, directory, fileclue):
         """Get all files in a directory matching a pattern.
@@ -48,7 +124,7 @@ class PostTagger(object):
         """
         matches = []
         for root, dirnames, filenames in os.walk(directory):
-            for filename in fnmatch.filter(filenames, fileclue):
+            for filename in compression.filter_files(filenames, fileclue):
                 matches.append(os.path.join(root, filename))
         return matches
 
@@ -59,86 +135,327 @@ class PostTagger(object):
         ifile -- path to the input file as string
         """
         parser = etree.XMLParser(remove_blank_text=True, encoding='utf-8')
-        with open(ifile, encoding='utf-8', mode='r') as input:
-            return etree.parse(input, parser)
+        with self.metrics.phase('read'):
+            with compression.open_file(ifile) as input:
+                return etree.parse(input, parser)
 
-    def serialize(self, tree_as_string, ifile):
+    def serialize(self, tree, ifile):
         """Serialize output.
 
         Keyword arguments:
-        tree_as_string -- tree as string
+        tree -- tree to be serialized as VRT
         ifile -- path to the input file as string
         """
         if not os.path.exists(self.odir):
             os.makedirs(self.odir)
-        outpath = os.path.join(  # output path
-            self.odir,
-            os.path.splitext(os.path.basename(ifile))[0]+'.vrt')
-        with open(outpath, mode='w', encoding='utf-8') as outfile:
-            outfile.write(tree_as_string)
+        with self.metrics.phase('write'):
+            with self.open_output(ifile) as outfile:
+                vrt.write(tree, outfile, break_tags=False, encoding='UTF-8')
         pass
 
-    def unprettify(self, tree):
-        """Remove any indentation introduced by pretty print."""
-        tree = etree.tostring(  # convert XML tree to string
-            tree,
-            encoding="UTF-8",
-            method="xml",
-            xml_declaration=True).decode(encoding='UTF-8')
-        tree = re.sub(  # remove trailing spaces before tag
-            r"(\n) +(<)",
-            r"\1\2",
-            tree)
-        tree = re.sub(  # put each XML element in a different line
-            r"> *<",
-            r">\n<",
-            tree)
-        tree = re.sub(
-            r"(>)([^.])",
-            r"\1\n\2",
-            tree)
-        tree = re.sub(  # remove unnecessary empty lines
-            r"\n\n+",
-            r"\n",
-            tree)
-        return tree
-    
+    @contextlib.contextmanager
+    def open_output(self, ifile):
+        """Open the output of a file for writing.
+
+        With --concatenate, the document is kept in self.documents to be
+        appended to the shards. With --columns, its tokens are appended to
+        the columns as it is written, or read back from the file by the
+        main process if this is a worker.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        """
+        source = source_id(ifile, self.idir)
+        if self.concatenate is None:
+            outpath = self.output_path(ifile)
+            document = None
+            if self.column_store is not None:
+                document = self.column_store.document(source)
+            try:
+                with atomic_open(outpath) as outfile:
+                    if document is not None:
+                        outfile = Tee(outfile, document)
+                    yield outfile
+            except BaseException:
+                if document is not None:
+                    document.abort()
+                raise
+            if document is not None:
+                document.close()
+            elif self.columns is not None:
+                self.documents.append((source, None, outpath))
+            self.metrics.count('bytes_out', os.path.getsize(outpath))
+        else:
+            outfile = io.StringIO()
+            yield outfile
+            text = outfile.getvalue()
+            self.documents.append((source, text, None))
+            self.metrics.count('bytes_out', len(text.encode('utf-8')))
+
+    def init_shards(self):
+        """Create the ShardWriter of the run if --concatenate is provided."""
+        if self.concatenate is None:
+            return None
+        if not os.path.exists(self.odir):
+            os.makedirs(self.odir)
+        return ShardWriter(
+            self.odir,
+            self.concatenate,
+            self.shard_size * 1024 * 1024,
+            self.compress)
+
+    def init_columns(self):
+        """Create the ColumnWriter of the run if --columns is provided."""
+        if self.columns is None:
+            return None
+        if not os.path.exists(self.odir):
+            os.makedirs(self.odir)
+        return ColumnWriter(self.odir, self.columns)
+
+    def flush_documents(self):
+        """Append the documents kept by open_output to shards and columns."""
+        for source, text, path in self.documents:
+            if self.shards is not None:
+                self.shards.add(source, text)
+            if self.column_store is not None:
+                if text is None:
+                    self.column_store.add_file(source, path)
+                else:
+                    self.column_store.add(source, text)
+        del self.documents[:]
+
+    def output_path(self, ifile):
+        """Get the path of the output file for an input file.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        """
+        # the subdirectories of the input directory are kept, so files with
+        # the same name in different ones don't overwrite each other
+        ofile_name = os.path.splitext(
+            compression.strip(os.path.relpath(ifile, self.idir)))[0]
+        return os.path.join(
+            self.odir, ofile_name+'.vrt'+compression.suffix(self.compress))
+
+    def config(self):
+        """Get the options and code versions the output depends on."""
+        return {
+            'text': self.text,
+            'language': self.lang,
+            'compress': self.compress,
+            'stream': self.stream,
+            'rules': fingerprint(rules.rules_files(self.rules)),
+            'version': fingerprint([__file__, vrt.__file__, rules.__file__])}
+
+    def init_manifest(self):
+        """Load the manifest of the output directory if -u is provided."""
+        if not self.incremental:
+            return None
+        return Manifest(
+            os.path.join(self.odir, '.post_treetagger.manifest'),
+            self.idir,
+            self.config(),
+            self.output_path)
+
+    def ruleset(self):
+        """Get the RuleSet of the language, reading it the first time."""
+        if self.lang not in self.rulesets:
+            self.rulesets[self.lang] = rules.load_language(
+                self.rules, self.lang)
+        return self.rulesets[self.lang]
+
     def search_and_replace(self, tc):
-        if self.lang == 'es':
-            tc = re.sub(
-                r"\nSr\.?\t.+?\n\.\tFS\t\.\n", r"\nSr.\tNC\tseñor\n", tc)
-            tc = re.sub(
-                r"\nSra\.?\t.+?\n\.\tFS\t\.\n", r"\nSra.\tNC\tseñora\n", tc)
-        if self.lang == 'en':
-            tc = re.sub(
-                r"(\n[tT]hat\tIN)/that(\tthat\n)", r"\1\2", tc)
-        return tc
+        return self.ruleset().apply(tc)
+
+    def process_tree(self, tree):
+        """Fix the annotation of the elements selected with -t.
+
+        Keyword arguments:
+        tree -- ElementTree to be modified in place
+        """
+#         text_containers = tree.xpath('.//{}'.format(self.text))
+        text_containers = tree.xpath('.//{}//text()'.format(self.text))
+        fixed = self.fix(text_containers)
+        for tc, fixed_tc in zip(text_containers, fixed):
+#             text = tc.text
+#             if self.lang == 'es':
+#                 text = re.sub(
+#                     r"\nSr\.\t.+?\n", r"\nSr.\tNC\tseñor\n", text)
+#                 text = re.sub(
+#                     r"\nSra\.\t.+?\n", r"\nSra.\tNC\tseñora\n", text)
+#             tc.text = text
+            tc_is_text = tc.is_text
+            tc_is_tail = tc.is_tail
+            parent = tc.getparent()
+            tc = fixed_tc
+            if tc_is_text:
+                parent.text = tc
+            elif tc_is_tail:
+                parent.tail = tc
+        self.count_rules()
+        pass
+
+    def fix(self, texts):
+        """Fix text nodes, in chunks across the workers if any.
+
+        Return a list with the fixed strings, in the same order.
+
+        Keyword arguments:
+        texts -- a list of the text nodes (strings) of a file
+        """
+        if self.pool is None or len(texts) < 2:
+            return [self.search_and_replace(tc) for tc in texts]
+        chunks = split_chunks([str(tc) for tc in texts], self.jobs * 4)
+        fired = self.ruleset().fired
+        output = []
+        for chunk, counts in self.pool.map(fix_chunk, chunks):
+            output += chunk
+            for name, n in counts.items():
+                fired[name] = fired.get(name, 0) + n
+        return output
+
+    def count_rules(self):
+        """Add the times every rule fired to the metrics of the file."""
+        ruleset = self.ruleset()
+        for name, n in ruleset.counts().items():
+            self.metrics.count('rule:{}/{}'.format(ruleset.name, name), n)
+        pass
+
+    def stream_file(self, ifile):
+        """Fix a VRT file reading and writing it line by line.
+
+        Markup lines are copied as they are, and only the token lines a
+        rule may still match are kept in memory. The file is expected to
+        have a tag or a token per line, as written by treetagger.py; the
+        output is then the same as the one of the tree.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        """
+        if not os.path.exists(self.odir):
+            os.makedirs(self.odir)
+        lines = [vrt.XML_DECLARATION.format('UTF-8')]
+        window = rules.Window(self.ruleset(), lines.append)
+        inside = 0  # open elements selected with -t
+        with compression.open_file(ifile) as input, \
+                self.open_output(ifile) as outfile:
+            for line in input:
+                line = line.rstrip('\n')
+                if not line.strip():
+                    continue  # blank text is removed, as by the parser
+                if line[0] != '<':
+                    if inside:
+                        window.add(line)
+                    else:
+                        lines.append(line)
+                    continue
+                window.flush()
+                if line.startswith('</'):
+                    if line[2:-1] == self.text:
+                        inside -= 1
+                elif line.startswith(('<?', '<!')):
+                    if line.startswith('<?xml '):
+                        continue  # replaced by the declaration of vrt
+                elif not line.endswith('/>'):
+                    match = TAG_NAME.match(line)
+                    if match is not None and match.group(1) == self.text:
+                        inside += 1
+                lines.append(line)
+                if len(lines) > 4096:
+                    outfile.write('\n'.join(lines))
+                    outfile.write('\n')
+                    del lines[:]
+            window.flush()
+            outfile.write('\n'.join(lines))
+        self.count_rules()
+        pass
+
+    def process_file(self, ifile):
+        """Fix a file and serialize the result.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        """
+        if self.stream:
+            with self.metrics.phase('stream'):
+                self.stream_file(ifile)
+            return
+        tree = self.read_xml(ifile)
+        with self.metrics.phase('fix'):
+            self.process_tree(tree)
+        self.serialize(tree, ifile)
+        pass
 
     def main(self):
         for ifile in self.ifiles:
             print(ifile)
-            tree = self.read_xml(ifile)
-#             text_containers = tree.xpath('.//{}'.format(self.text))
-            text_containers = tree.xpath('.//{}//text()'.format(self.text))
-            for tc in text_containers:
-#                 text = tc.text
-#                 if self.lang == 'es':
-#                     text = re.sub(
-#                         r"\nSr\.\t.+?\n", r"\nSr.\tNC\tseñor\n", text)
-#                     text = re.sub(
-#                         r"\nSra\.\t.+?\n", r"\nSra.\tNC\tseñora\n", text)
-#                 tc.text = text
-                tc_is_text = tc.is_text
-                tc_is_tail = tc.is_tail
-                parent = tc.getparent()
-                tc = self.search_and_replace(tc)
-                if tc_is_text:
-                    parent.text = tc
-                elif tc_is_tail:
-                    parent.tail = tc
-            output = self.unprettify(tree)
-            self.serialize(output, ifile)
+            with self.metrics.file(ifile):
+                self.process_file(ifile)
+                self.flush_documents()
             self.counter += 1
+            if self.manifest is not None:
+                self.manifest.record(ifile)
+        pass
+
+    def main_parallel(self):
+        """Fix files in a pool of processes.
+
+        Files are fixed whole by the workers, except the ones larger than
+        --split_size (without --stream): the main process parses and
+        writes them, and their text nodes are fixed in chunks by all the
+        workers. Files are finished in their order, as in a serial run.
+        """
+        if not self.ifiles:
+            return
+        import multiprocessing
+        self.pool = multiprocessing.Pool(
+            self.jobs,
+            initializer=init_worker,
+            initargs=(self,))
+        pending = collections.deque()
+        try:
+            for ifile in self.ifiles:
+                if (not self.stream and os.path.getsize(ifile) >
+                        self.split_size * 1024 * 1024):
+                    while pending:
+                        self.finish(*pending.popleft().get())
+                    print(ifile)
+                    with self.metrics.file(ifile):
+                        self.process_file(ifile)
+                    self.finish(ifile, None, None, [])
+                    continue
+                pending.append(self.pool.apply_async(process_file, (ifile,)))
+                if len(pending) > 2 * self.jobs:
+                    self.finish(*pending.popleft().get())
+            while pending:
+                self.finish(*pending.popleft().get())
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        pass
+
+    def finish(self, ifile, error, record, documents):
+        """Record a file processed by main_parallel.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        error -- the traceback of the error if any
+        record -- the metrics record and profile of a worker, None if the
+                  file was processed by the main process
+        documents -- the documents of a worker for the shards or columns
+        """
+        if record is not None:
+            print(ifile)
+            self.metrics.add(*record)
+        self.documents.extend(documents)
+        self.flush_documents()
+        if error is not None:
+            print("{} failed:\n{}".format(ifile, error), file=sys.stderr)
+            return
+        self.counter += 1
+        if self.manifest is not None:
+            self.manifest.record(ifile)
         pass
 
     def cli(self):
@@ -173,13 +490,121 @@ class PostTagger(object):
             choices=['es', 'en'],
             help="language."
         )
+        parser.add_argument(
+            "--rules",
+            required=False,
+            default=rules.DIRECTORY,
+            help="directory with a LANG.rules file per language fixing the\
+                  tagging (by default the rules directory of ttg).")
+        parser.add_argument(
+            "-z",
+            "--compress",
+            required=False,
+            default=None,
+            choices=compression.COMPRESSIONS,
+            help="compress the output files (input files are decompressed\
+                  according to their extension).")
+        parser.add_argument(
+            "--concatenate",
+            required=False,
+            default=None,
+            help="write the documents to NAME-0000.vrt... in the output\
+                  directory, each one in a <text> element, with their\
+                  offsets in NAME.index.")
+        parser.add_argument(
+            "--shard_size",
+            required=False,
+            default=0,
+            type=int,
+            help="maximum size of every file written with --concatenate in\
+                  MB, a single file if 0.")
+        parser.add_argument(
+            "--columns",
+            required=False,
+            default=None,
+            help="also append the word, POS and lemma of every token as\
+                  arrays of ids to NAME.word, NAME.pos and NAME.lemma in the\
+                  output directory, with their vocabularies and the sentence\
+                  (<s>) and document offsets.")
+        parser.add_argument(
+            "--stream",
+            required=False,
+            default=False,
+            action="store_true",
+            help="read and write files line by line without parsing them,\
+                  in constant memory (files must have a tag or token per\
+                  line, as written by treetagger.py).")
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            required=False,
+            default=1,
+            type=int,
+            help="number of worker processes fixing files.")
+        parser.add_argument(
+            "--split_size",
+            required=False,
+            default=32,
+            type=int,
+            help="with -j, files larger than SPLIT_SIZE MB are parsed by the\
+                  main process and their text is fixed in chunks by all the\
+                  workers (32 by default, not with --stream).")
+        parser.add_argument(
+            "-u",
+            "--incremental",
+            required=False,
+            default=False,
+            action="store_true",
+            help="skip files whose output is up to date and record processed\
+                  files in a manifest in the output directory.")
+        parser.add_argument(
+            "-m",
+            "--metrics",
+            required=False,
+            default=None,
+            help="path to a file where the time of every phase, counts and\
+                  memory usage of each file are written as JSON lines.")
+        parser.add_argument(
+            "--profile",
+            required=False,
+            default=0,
+            type=int,
+            help="profile files and write the profiles of the PROFILE\
+                  slowest ones next to the metrics file.")
         args = parser.parse_args()
+        if args.concatenate is not None and args.incremental:
+            parser.error("--concatenate can't be combined with -u")
+        if args.columns is not None and args.incremental:
+            parser.error("--columns can't be combined with -u")
+        self.configure(args)
+        pass
+
+    def configure(self, args):
+        """Set options from parsed arguments.
+
+        Keyword arguments:
+        args -- argparse.Namespace with the options of cli
+        """
         self.idir = args.input
         self.odir = args.output
         self.text = args.text
         self.pattern = args.glob_pattern
         self.lang = args.language
+        self.rules = args.rules
+        self.rulesets = {}  # language: RuleSet, read when needed
+        self.compress = args.compress
+        self.stream = args.stream
+        self.jobs = args.jobs
+        self.split_size = args.split_size
+        self.pool = None  # worker processes with -j
+        self.concatenate = args.concatenate
+        self.shard_size = args.shard_size
+        self.columns = args.columns
+        self.incremental = args.incremental
+        self.metrics_path = args.metrics
+        self.profile = args.profile
         pass
 
 
-print(PostTagger())
+if __name__ == '__main__':
+    print(PostTagger())
@@ -2,37 +2,109 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import argparse
-import time
-import fnmatch
+import traceback
+import collections
 from lxml import etree
 import regex as re
+import compression
+from manifest import Manifest, atomic_open, fingerprint
+from metrics import Metrics
+from stages import split_chunks
 
 
-def timeit(method):
-    """Time methods."""
-    def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
+# one-to-one character maps, applied with a single str.translate
+PUNCTUATION = str.maketrans({
+    '，': ',', '。': '. ', '、': ',', '”': '"', '“': '"', '∶': ':',
+    '：': ':', '？': '?', '《': '"', '》': '"', '）': ')', '！': '!',
+    '（': '(', '；': ';', '１': '"', '」': '"', '「': '"', '０': '0',
+    '３': '3', '２': '2', '５': '5', '６': '6', '９': '9', '７': '7',
+    '８': '8', '４': '4', '．': '. ', '～': '~', '’': "'", '…': r'\.\.\.',
+    '━': '-', '〈': '<', '〉': '>', '【': '[', '】': ']', '％': '%',
+    '`': "'", '„': '"', '‚': '"'})
+PARENTHESES = str.maketrans({'(': ' (', ')': ') '})
+PRIMES = str.maketrans({'–': '-', '´': "'"})
+PSEUDO_SPACE_MAP = {
+    ' %': r'\%', ' :': ':', ' ?': r'\?', ' !': r'\!', ' ;': ';'}
 
-        print('%r %2.2f sec' %
-              (method.__name__, te-ts))
-        return result
+# context-sensitive rules, compiled once
+DASHES = re.compile(r"(?<=\s)-+(?=\w)|(?<=\w)-+(?=\s)")
+SPACED_DASHES = re.compile(r"(\s)-+(\s)")
+SPACES = re.compile(r" {2,}")
+EXTRA_SPACES = re.compile(
+    r"(?<=\() | (?=[\):;])|(?<=\)) (?=[\.\!\:\?\;\,])|(?<=\d) (?=\%)")
+APOSTROPHE = re.compile(r"(\p{L})‘(\p{L})")
+GUILLEMETS = re.compile(r"« ?| ?»")
+PSEUDO_SPACES = re.compile(r" [%:?!;]")
+QUOTES = re.compile(r'(\.+)\"(\s*[^<])')
+NUMBERS = re.compile(
+    r' (\p{P})?(\d{1,3}) (\d{3}) ?(\d{3})? ?(\d{3})? ?(\d{3})? ?')
+CONTROL = re.compile(r"\p{C}")
+worker = None
 
-    return timed
+
+def init_worker(tokenizer):
+    """Keep the PreTokenizer used by a worker process.
+
+    Keyword arguments:
+    tokenizer -- a configured PreTokenizer.
+    """
+    global worker
+    worker = tokenizer
+
+
+def process_file(ifile):
+    """Normalize a file in a worker process, reporting any failure.
+
+    Return the path, the traceback of the error if any and the metrics
+    record and profile of the file.
+
+    Keyword arguments:
+    ifile -- path to the input file as string
+    """
+    error = None
+    worker.metrics.start(ifile)
+    try:
+        worker.process_file(ifile)
+    except Exception:
+        error = traceback.format_exc()
+    return ifile, error, worker.metrics.stop(error is not None)
+
+
+def normalize_chunk(texts):
+    """Normalize a chunk of the text nodes of a file in a worker process.
+
+    Keyword arguments:
+    texts -- a list of strings.
+    """
+    return [worker.search_and_replace(tc) for tc in texts]
 
 
 class PreTokenizer(object):
     """Normalize characters for better tokenization."""
 
-    @timeit
     def __init__(self):
         """Constructor."""
         self.cli()
+        self.metrics = Metrics(self.metrics_path, self.profile, self.idir)
         self.ifiles = self.get_files(self.idir, self.pattern)
+        self.manifest = self.init_manifest()
+        if self.manifest is not None:
+            self.ifiles = self.manifest.pending(self.ifiles)
         self.counter = 0
-        self.main()
+        if self.jobs > 1:
+            self.main_parallel()
+        else:
+            self.main()
+        self.metrics.close()
+        print(self.metrics.summary())
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['manifest'] = None  # only the main process records files
+        state['pool'] = None
+        return state
 
     def __str__(self):
         """Print The End message."""
@@ -48,7 +120,7 @@ class PreTokenizer(object):
         """
         matches = []
         for root, dirnames, filenames in os.walk(directory):
-            for filename in fnmatch.filter(filenames, fileclue):
+            for filename in compression.filter_files(filenames, fileclue):
                 matches.append(os.path.join(root, filename))
         return matches
 
@@ -59,8 +131,9 @@ class PreTokenizer(object):
         ifile -- path to the input file as string
         """
         parser = etree.XMLParser(remove_blank_text=True, encoding='utf-8')
-        with open(ifile, encoding='utf-8', mode='r') as input:
-            return etree.parse(input, parser)
+        with self.metrics.phase('read'):
+            with compression.open_file(ifile) as input:
+                return etree.parse(input, parser)
 
     def serialize(self, tree_as_string, ifile):
         """Serialize output.
@@ -71,13 +144,45 @@ class PreTokenizer(object):
         """
         if not os.path.exists(self.odir):
             os.makedirs(self.odir)
-        outpath = os.path.join(  # output path
-            self.odir,
-            os.path.splitext(os.path.basename(ifile))[0]+'.xml')
-        with open(outpath, mode='w', encoding='utf-8') as outfile:
-            outfile.write(tree_as_string)
+        outpath = self.output_path(ifile)
+        with self.metrics.phase('write'):
+            with atomic_open(outpath) as outfile:
+                outfile.write(tree_as_string)
+        self.metrics.count('bytes_out', os.path.getsize(outpath))
         pass
 
+    def output_path(self, ifile):
+        """Get the path of the output file for an input file.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        """
+        # the subdirectories of the input directory are kept, so files with
+        # the same name in different ones don't overwrite each other
+        ofile_name = os.path.splitext(
+            compression.strip(os.path.relpath(ifile, self.idir)))[0]
+        return os.path.join(
+            self.odir, ofile_name+'.xml'+compression.suffix(self.compress))
+
+    def config(self):
+        """Get the options and code versions the output depends on."""
+        return {
+            'text': self.text,
+            'strip': self.strip,
+            'language': self.lang,
+            'compress': self.compress,
+            'version': fingerprint([__file__])}
+
+    def init_manifest(self):
+        """Load the manifest of the output directory if -u is provided."""
+        if not self.incremental:
+            return None
+        return Manifest(
+            os.path.join(self.odir, '.pre_treetagger.manifest'),
+            self.idir,
+            self.config(),
+            self.output_path)
+
     def unprettify(self, tree):
         """Remove any indentation introduced by pretty print."""
         tree = etree.tostring(  # convert XML tree to string
@@ -104,141 +209,172 @@ class PreTokenizer(object):
         return tree
 
     def search_and_replace(self, tc):
+        """Normalize the characters of a text node.
+
+        Keyword arguments:
+        tc -- a string with the text to be normalized
+        """
         # replace unicode punctuation
-        tc = re.sub(r'，', r',', tc)
-        tc = re.sub(r'。', r'. ', tc)
-        tc = re.sub(r'、', r',', tc)
-        tc = re.sub(r'”', r'"', tc)
-        tc = re.sub(r'“', r'"', tc)
-        tc = re.sub(r'∶', r':', tc)
-        tc = re.sub(r'：', r':', tc)
-        tc = re.sub(r'？', r'?', tc)
-        tc = re.sub(r'《', r'"', tc)
-        tc = re.sub(r'》', r'"', tc)
-        tc = re.sub(r'）', r')', tc)
-        tc = re.sub(r'！', r'!', tc)
-        tc = re.sub(r'（', r'(', tc)
-        tc = re.sub(r'；', r';', tc)
-        tc = re.sub(r'１', r'"', tc)
-        tc = re.sub(r'」', r'"', tc)
-        tc = re.sub(r'「', r'"', tc)
-        tc = re.sub(r'０', r'0', tc)
-        tc = re.sub(r'３', r'3', tc)
-        tc = re.sub(r'２', r'2', tc)
-        tc = re.sub(r'５', r'5', tc)
-        tc = re.sub(r'６', r'6', tc)
-        tc = re.sub(r'９', r'9', tc)
-        tc = re.sub(r'７', r'7', tc)
-        tc = re.sub(r'８', r'8', tc)
-        tc = re.sub(r'４', r'4', tc)
-        tc = re.sub(r'．', r'. ', tc)
-        tc = re.sub(r'～', r'~', tc)
-        tc = re.sub(r'’', r"'", tc)
-        tc = re.sub(r'…', r'\.\.\.', tc)
-        tc = re.sub(r'━', r'-', tc)
-        tc = re.sub(r'〈', r'<', tc)
-        tc = re.sub(r'〉', r'>', tc)
-        tc = re.sub(r'【', r'[', tc)
-        tc = re.sub(r'】', r']', tc)
-        tc = re.sub(r'％', r'%', tc)
+        tc = tc.translate(PUNCTUATION)
         # normalize punctuation
-        tc = re.sub(r"(\s)-+(\w)", r"\1—\2", tc)
-        tc = re.sub(r"(\w)-+(\s)", r"\1—\2", tc)
-        tc = re.sub(r"(\s)-+(\s)", r"\1—\2", tc)
-        tc = re.sub(r"\r", r"", tc)
+        tc = DASHES.sub(r'—', tc)
+        tc = SPACED_DASHES.sub(r'\1—\2', tc)
+        tc = tc.replace('\r', '')
         # remove extra spaces
-        tc = re.sub(r'\(', r' (', tc)
-        tc = re.sub(r'\)', r') ', tc)
-        tc = re.sub(r' +', r' ', tc)
-        tc = re.sub(r'\) ([\.\!\:\?\;\,])', r')\1', tc)
-        tc = re.sub(r'\( ', r'(', tc)
-        tc = re.sub(r' \)', r')', tc)
-        tc = re.sub(r'(\d) \%', r'\1%', tc)
-        tc = re.sub(r' :', r':', tc)
-        tc = re.sub(r' ;', r';', tc)
+        tc = tc.translate(PARENTHESES)
+        tc = SPACES.sub(r' ', tc)
+        tc = EXTRA_SPACES.sub(r'', tc)
         # normalize unicode punctuation
-        tc = re.sub(r'\`', r"'", tc)
-        tc = re.sub(r'\'\'', r' " ', tc)
-        tc = re.sub(r'„', r'"', tc)
-        tc = re.sub(r'“', r'"', tc)
-        tc = re.sub(r'”', r'"', tc)
-        tc = re.sub(r'–', r'-', tc)
-#         tc = re.sub(r'—', r' - ', tc)
-        tc = re.sub(r' +', r' ', tc)
-        tc = re.sub(r'´', r"'", tc)
-        tc = re.sub(r'(\p{L})‘(\p{L})', r"\1'\2", tc)
-        tc = re.sub(r'(\p{L})’(\p{L})', r"\1'\2", tc)
-        tc = re.sub(r'‘', r'"', tc)
-        tc = re.sub(r'‚', r'"', tc)
-        tc = re.sub(r'’', r'"', tc)
-        tc = re.sub(r'\'\'', r'"', tc)
-        tc = re.sub(r'´´', r'"', tc)
-        tc = re.sub(r'…', r'...', tc)
+        tc = tc.replace("''", ' " ')
+        tc = tc.translate(PRIMES)
+        tc = SPACES.sub(r' ', tc)
+        tc = APOSTROPHE.sub(r"\1'\2", tc)
+        tc = tc.replace('‘', '"')
+        tc = tc.replace("''", '"')
         # French quotes
-        tc = re.sub(r' « ', r' "', tc)
-        tc = re.sub(r'« ', r'"', tc)
-        tc = re.sub(r'«', r'"', tc)
-        tc = re.sub(r' » ', r'" ', tc)
-        tc = re.sub(r' »', r'"', tc)
-        tc = re.sub(r'»', r'"', tc)
+        tc = GUILLEMETS.sub(r'"', tc)
         # handle pseudo-spaces
-        tc = re.sub(r' \%', r'\%', tc)
-        tc = re.sub(r'nº ', r'nº ', tc)
-        tc = re.sub(r' :', r':', tc)
-        tc = re.sub(r' ºC', r' ºC', tc)
-        tc = re.sub(r' cm', r' cm', tc)
-        tc = re.sub(r' \?', r'\?', tc)
-        tc = re.sub(r' \!', r'\!', tc)
-        tc = re.sub(r' ;', r';', tc)
-        tc = re.sub(r', ', r', ', tc)
-        tc = re.sub(r' +', r' ', tc)
-        # English "quotation," followed by comma, style
-        if self.lang is "en":
-            tc = re.sub(r'\"([,\.]+)', r'\1"', tc)
-        # German/Spanish/French "quotation", followed by comma, style
-        else:
-            tc = re.sub(r',\"', r'",', tc)
-            tc = re.sub(r'(\.+)\"(\s*[^<])', r'"\1\2', tc)
+        tc = PSEUDO_SPACES.sub(lambda m: PSEUDO_SPACE_MAP[m.group()], tc)
+        # German/Spanish/French "quotation", followed by comma, style, for
+        # English too: the English style was checked with `is "en"`, never
+        # true for the language given in the command line
+        tc = tc.replace(',"', '",')
+        tc = QUOTES.sub(r'"\1\2', tc)
         # Numbers
-        tc = re.sub(r' (\p{P})?(\d{1,3}) (\d{3}) ?(\d{3})? ?(\d{3})? ?(\d{3})? ?', r' \1\2\3\4\5\6 ', tc)
+        tc = NUMBERS.sub(r' \1\2\3\4\5\6 ', tc)
         # remove non-printing characters
-        tc = re.sub(r"\p{C}", r" ", tc)
+        tc = CONTROL.sub(r" ", tc)
         # remove too many white spaces
-        tc = re.sub(r" {2,}", r" ", tc)
+        tc = SPACES.sub(r" ", tc)
         return tc
 
-    def main(self):
-        for ifile in self.ifiles:
-            print(ifile)
-            tree = self.read_xml(ifile)
-            if self.strip is True:
-                elements = tree.xpath('.//{}'.format(self.text))
-                for e in elements:
-                    e.text = e.text.strip()
-            text_containers = tree.xpath('.//{}//text()'.format(self.text))
-            for tc in text_containers:
-#                 text = tc.text
-#                 tc = re.sub(r"(\s)-+(\w)", r"\1—\2", tc)
-#                 tc = re.sub(r"(\w)-+(\s)", r"\1—\2", tc)
-#                 tc = re.sub(r"(\s)-(\s)", r"\1—\2", tc)
-#                 tc.text = text
-                tc_is_text = tc.is_text
-                tc_is_tail = tc.is_tail
-                parent = tc.getparent()
-                tc = self.search_and_replace(tc)
-                if tc_is_text:
-                    parent.text = tc
-                elif tc_is_tail:
-                    parent.tail = tc
-#             output = self.unprettify(tree)
+    def process_tree(self, tree):
+        """Normalize the text of the elements selected with -t.
+
+        Keyword arguments:
+        tree -- ElementTree to be modified in place
+        """
+        if self.strip is True:
+            elements = tree.xpath('.//{}'.format(self.text))
+            for e in elements:
+                e.text = e.text.strip()
+        text_containers = tree.xpath('.//{}//text()'.format(self.text))
+        normalized = self.normalize(text_containers)
+        for tc, normalized_tc in zip(text_containers, normalized):
+#             text = tc.text
+#             tc = re.sub(r"(\s)-+(\w)", r"\1—\2", tc)
+#             tc = re.sub(r"(\w)-+(\s)", r"\1—\2", tc)
+#             tc = re.sub(r"(\s)-(\s)", r"\1—\2", tc)
+#             tc.text = text
+            tc_is_text = tc.is_text
+            tc_is_tail = tc.is_tail
+            parent = tc.getparent()
+            tc = normalized_tc
+            if tc_is_text:
+                parent.text = tc
+            elif tc_is_tail:
+                parent.tail = tc
+        pass
+
+    def normalize(self, texts):
+        """Normalize text nodes, in chunks across the workers if any.
+
+        Return a list with the normalized strings, in the same order.
+
+        Keyword arguments:
+        texts -- a list of the text nodes (strings) of a file
+        """
+        if self.pool is None or len(texts) < 2:
+            return [self.search_and_replace(tc) for tc in texts]
+        chunks = split_chunks([str(tc) for tc in texts], self.jobs * 4)
+        return [tc for chunk in self.pool.map(normalize_chunk, chunks)
+                for tc in chunk]
+
+    def process_file(self, ifile):
+        """Normalize a file and serialize the result.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        """
+        tree = self.read_xml(ifile)
+        with self.metrics.phase('normalize'):
+            self.process_tree(tree)
+#         output = self.unprettify(tree)
+        with self.metrics.phase('write'):
             output = etree.tostring(
                 tree,
                 encoding='utf-8',
                 method='xml',
                 xml_declaration=True,
                 pretty_print=True).decode()
-            self.serialize(output, ifile)
+        self.serialize(output, ifile)
+        pass
+
+    def main(self):
+        for ifile in self.ifiles:
+            print(ifile)
+            with self.metrics.file(ifile):
+                self.process_file(ifile)
             self.counter += 1
+            if self.manifest is not None:
+                self.manifest.record(ifile)
+        pass
+
+    def main_parallel(self):
+        """Normalize files in a pool of processes.
+
+        Files are normalized whole by the workers, except the ones larger
+        than --split_size: the main process parses and writes them, and
+        their text nodes are normalized in chunks by all the workers.
+        Files are finished in their order, as in a serial run.
+        """
+        if not self.ifiles:
+            return
+        import multiprocessing
+        self.pool = multiprocessing.Pool(
+            self.jobs,
+            initializer=init_worker,
+            initargs=(self,))
+        pending = collections.deque()
+        try:
+            for ifile in self.ifiles:
+                if os.path.getsize(ifile) > self.split_size * 1024 * 1024:
+                    while pending:
+                        self.finish(*pending.popleft().get())
+                    print(ifile)
+                    with self.metrics.file(ifile):
+                        self.process_file(ifile)
+                    self.finish(ifile, None, None)
+                    continue
+                pending.append(self.pool.apply_async(process_file, (ifile,)))
+                if len(pending) > 2 * self.jobs:
+                    self.finish(*pending.popleft().get())
+            while pending:
+                self.finish(*pending.popleft().get())
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        pass
+
+    def finish(self, ifile, error, record):
+        """Record a file processed by main_parallel.
+
+        Keyword arguments:
+        ifile -- path to the input file as string
+        error -- the traceback of the error if any
+        record -- the metrics record and profile of a worker, None if the
+                  file was processed by the main process
+        """
+        if record is not None:
+            print(ifile)
+            self.metrics.add(*record)
+        if error is not None:
+            print("{} failed:\n{}".format(ifile, error), file=sys.stderr)
+            return
+        self.counter += 1
+        if self.manifest is not None:
+            self.manifest.record(ifile)
         pass
 
     def cli(self):
@@ -279,14 +415,76 @@ class PreTokenizer(object):
             default=False,
             action="store_true",
             help="strip empty lines and white spaces for text. False by default.")
+        parser.add_argument(
+            "-z",
+            "--compress",
+            required=False,
+            default=None,
+            choices=compression.COMPRESSIONS,
+            help="compress the output files (input files are decompressed\
+                  according to their extension).")
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            required=False,
+            default=1,
+            type=int,
+            help="number of worker processes normalizing files.")
+        parser.add_argument(
+            "--split_size",
+            required=False,
+            default=32,
+            type=int,
+            help="with -j, files larger than SPLIT_SIZE MB are parsed by the\
+                  main process and their text is normalized in chunks by\
+                  all the workers (32 by default).")
+        parser.add_argument(
+            "-u",
+            "--incremental",
+            required=False,
+            default=False,
+            action="store_true",
+            help="skip files whose output is up to date and record processed\
+                  files in a manifest in the output directory.")
+        parser.add_argument(
+            "-m",
+            "--metrics",
+            required=False,
+            default=None,
+            help="path to a file where the time of every phase, counts and\
+                  memory usage of each file are written as JSON lines.")
+        parser.add_argument(
+            "--profile",
+            required=False,
+            default=0,
+            type=int,
+            help="profile files and write the profiles of the PROFILE\
+                  slowest ones next to the metrics file.")
         args = parser.parse_args()
+        self.configure(args)
+        pass
+
+    def configure(self, args):
+        """Set options from parsed arguments.
+
+        Keyword arguments:
+        args -- argparse.Namespace with the options of cli
+        """
         self.idir = args.input
         self.odir = args.output
         self.text = args.text
         self.pattern = args.glob_pattern
         self.strip = args.strip
         self.lang = args.language
+        self.compress = args.compress
+        self.jobs = args.jobs
+        self.split_size = args.split_size
+        self.pool = None  # worker processes with -j
+        self.incremental = args.incremental
+        self.metrics_path = args.metrics
+        self.profile = args.profile
         pass
 
 
-print(PreTokenizer())
+if __name__ == '__main__':
+    print(PreTokenizer())
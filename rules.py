@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Rules fixing sequences of tagged tokens, loaded from a file.
+
+A rules file has blocks like this one, separated by blank lines:
+
+    # Sr. split in two tokens
+    rule sr
+    Sr|Sr.	*	*
+    .	FS	.
+    =>
+    Sr.	NC	señor
+
+After the name, every line of the pattern matches a token line of the
+VRT (word, POS and lemma separated by tabs) and every line after => is a
+token line of the replacement. A pattern field is a value, several
+values separated by |, or * for any value. A replacement field = copies
+the field of the token matched at the same position.
+
+The rules of a language are read from LANG.rules in the rules directory,
+by default the one shipped with ttg.
+"""
+
+import os
+import vrt
+
+
+ANY = None  # pattern field matching any value
+# rules shipped with ttg, a LANG.rules file per language
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+
+
+class Rule(object):
+    """A pattern of tokens and the tokens replacing it."""
+
+    def __init__(self, name, pattern, replacement):
+        """Constructor.
+
+        Keyword arguments:
+        name -- a string with the name of the rule.
+        pattern -- a list of lists of fields, each one ANY or a set of
+                   strings.
+        replacement -- a list of lists of strings, '=' for a copied field.
+        """
+        self.name = name
+        self.pattern = pattern
+        self.replacement = replacement
+
+    def match(self, tokens, i):
+        """Return True if the pattern matches the tokens from i on.
+
+        Keyword arguments:
+        tokens -- a list of lists of fields.
+        i -- the position of the first token.
+        """
+        if i + len(self.pattern) > len(tokens):
+            return False
+        for fields, token in zip(self.pattern, tokens[i:]):
+            for k, field in enumerate(fields):
+                if field is not ANY and (
+                        k >= len(token) or token[k] not in field):
+                    return False
+        return True
+
+    def apply(self, tokens, i):
+        """Get the lines replacing the tokens matched from i on.
+
+        Keyword arguments:
+        tokens -- a list of lists of fields.
+        i -- the position of the first token.
+        """
+        lines = []
+        for j, fields in enumerate(self.replacement):
+            matched = tokens[i + j] if i + j < len(tokens) else []
+            lines.append('\t'.join(
+                matched[k] if field == '=' and k < len(matched) else field
+                for k, field in enumerate(fields)))
+        return lines
+
+
+class RuleSet(object):
+    """Rules indexed by the word or POS of their first token.
+
+    A token only tries the rules indexed by its word, by its POS and the
+    ones starting with * *, so the number of rules hardly matters.
+    """
+
+    def __init__(self, name='rules'):
+        """Constructor.
+
+        Keyword arguments:
+        name -- a string naming the set in the counts of fired rules.
+        """
+        self.name = name
+        self.rules = []
+        self.by_word = {}
+        self.by_pos = {}
+        self.anywhere = []
+        self.fired = {}  # rule name: times fired since the last call
+
+    def add(self, rule):
+        """Add a rule, the first added rules are tried first."""
+        rule.order = len(self.rules)
+        self.rules.append(rule)
+        first = rule.pattern[0]
+        if first[0] is not ANY:
+            for word in first[0]:
+                self.by_word.setdefault(word, []).append(rule)
+        elif len(first) > 1 and first[1] is not ANY:
+            for pos in first[1]:
+                self.by_pos.setdefault(pos, []).append(rule)
+        else:
+            self.anywhere.append(rule)
+
+    def size(self):
+        """Get the number of tokens of the longest pattern."""
+        return max([len(rule.pattern) for rule in self.rules] or [0])
+
+    def candidates(self, token):
+        rules = self.by_word.get(token[0], [])
+        if len(token) > 1 and token[1] in self.by_pos:
+            rules = rules + self.by_pos[token[1]]
+        if self.anywhere:
+            rules = rules + self.anywhere
+        if len(rules) > 1:
+            rules = sorted(rules, key=lambda rule: rule.order)
+        return rules
+
+    def match(self, tokens, i):
+        """Get the first rule matching the tokens from i on, or None.
+
+        The rule returned is counted as fired.
+
+        Keyword arguments:
+        tokens -- a list of lists of fields.
+        i -- the position of the first token.
+        """
+        token = tokens[i]
+        if not (token[0] in self.by_word or self.anywhere or
+                (len(token) > 1 and token[1] in self.by_pos)):
+            return None
+        for rule in self.candidates(token):
+            if rule.match(tokens, i):
+                self.fired[rule.name] = self.fired.get(rule.name, 0) + 1
+                return rule
+        return None
+
+    def apply(self, text):
+        """Apply the rules to the token lines of a text node.
+
+        Tokens are the lines between two line breaks. Matches don't
+        overlap and are searched from left to right, the first rule of
+        the file matching at a position being applied.
+
+        Keyword arguments:
+        text -- a string with the text of an element of the VRT.
+        """
+        lines = text.split('\n')
+        if len(lines) < 3 or not self.rules:
+            return text
+        # only the lines between two line breaks are whole tokens
+        tokens = [line.split('\t') for line in lines[1:-1]]
+        output = None
+        i = 0
+        while i < len(tokens):
+            rule = self.match(tokens, i)
+            if rule is not None:
+                if output is None:
+                    output = lines[:i + 1]
+                output += rule.apply(tokens, i)
+                i += len(rule.pattern)
+            else:
+                if output is not None:
+                    output.append(lines[i + 1])
+                i += 1
+        if output is None:
+            return text
+        output.append(lines[-1])
+        return '\n'.join(output)
+
+    def counts(self):
+        """Return the times every rule fired since the last call."""
+        fired = self.fired
+        self.fired = {}
+        return fired
+
+
+class Window(object):
+    """Apply a RuleSet to the token lines of a VRT file read one by one.
+
+    Only the lines the longest pattern may still match are kept, the
+    others are passed to write as soon as no rule can change them.
+    """
+
+    def __init__(self, ruleset, write):
+        """Constructor.
+
+        Keyword arguments:
+        ruleset -- the RuleSet to be applied.
+        write -- a function taking every output line, escaped.
+        """
+        self.ruleset = ruleset
+        self.write = write
+        self.size = ruleset.size()
+        self.lines = []
+        self.tokens = []
+
+    def add(self, line):
+        """Add the next token line of the current text node.
+
+        Keyword arguments:
+        line -- a string with the line as written in the VRT file.
+        """
+        if not self.size:
+            self.write(line)
+            return
+        self.lines.append(line)
+        self.tokens.append(vrt.unescape(line).split('\t'))
+        if len(self.tokens) >= self.size:
+            self.step()
+
+    def step(self):
+        rule = self.ruleset.match(self.tokens, 0)
+        if rule is None:
+            self.write(self.lines[0])
+            n = 1
+        else:
+            for line in rule.apply(self.tokens, 0):
+                self.write(line.translate(vrt.TEXT))
+            n = len(rule.pattern)
+        del self.lines[:n]
+        del self.tokens[:n]
+
+    def flush(self):
+        """Write the lines left at the end of a text node."""
+        while self.tokens:
+            self.step()
+
+
+def parse_field(field):
+    if field == '*':
+        return ANY
+    return set(field.split('|'))
+
+
+def load(path):
+    """Read a rules file, return a RuleSet.
+
+    Keyword arguments:
+    path -- a string for the path of the rules file.
+    """
+    ruleset = RuleSet(os.path.splitext(os.path.basename(path))[0])
+    blocks = []
+    with open(path, mode='r', encoding='utf-8') as rfile:
+        block = []
+        for number, line in enumerate(rfile, 1):
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                continue
+            if not line.strip():
+                if block:
+                    blocks.append(block)
+                block = []
+            else:
+                block.append((number, line))
+        if block:
+            blocks.append(block)
+    for block in blocks:
+        number, header = block[0]
+        keyword, _, name = header.partition(' ')
+        lines = [line for number, line in block[1:]]
+        if keyword != 'rule' or not name.strip() or '=>' not in lines:
+            raise ValueError(
+                "{}:{}: a rule is 'rule NAME', its pattern, '=>' and its"
+                " replacement".format(path, number))
+        arrow = lines.index('=>')
+        if arrow == 0:
+            raise ValueError("{}:{}: rule {} has no pattern".format(
+                path, number, name))
+        ruleset.add(Rule(
+            name.strip(),
+            [[parse_field(f) for f in line.split('\t')]
+             for line in lines[:arrow]],
+            [line.split('\t') for line in lines[arrow + 1:]]))
+    return ruleset
+
+
+def rules_files(directory):
+    """Get the sorted paths of the rules files of a directory.
+
+    Keyword arguments:
+    directory -- a string for the path of the rules directory.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.endswith('.rules')]
+
+
+def load_language(directory, language):
+    """Read the rules of a language, an empty RuleSet if it has none.
+
+    Keyword arguments:
+    directory -- a string for the path of the rules directory.
+    language -- a string with the code of the language.
+    """
+    path = os.path.join(directory, language + '.rules')
+    if not os.path.exists(path):
+        return RuleSet(language)
+    return load(path)
+
+
+def report(counts):
+    """Get a line with the times every rule fired, '' if none did.
+
+    Keyword arguments:
+    counts -- a dict with the totals of the counters of the metrics, the
+              rules being counted as 'rule:SET/NAME'.
+    """
+    fired = sorted(
+        (name[len('rule:'):], n) for name, n in counts.items()
+        if name.startswith('rule:'))
+    if not fired:
+        return ''
+    return 'rules fired: ' + ', '.join(
+        '{} {}'.format(name, n) for name, n in fired)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tag files sent by treetagger.py --server with models loaded only once."""
+
+import os
+import sys
+import json
+import signal
+import argparse
+import threading
+import traceback
+import socketserver
+from treetagger import TagWithTreeTagger
+
+
+class TaggerPool(object):
+    """A bounded pool of TreeTagger instances for a language.
+
+    Instances are created when needed, up to size, and reused by the
+    jobs. A job waits for an instance when all of them are busy.
+    """
+
+    def __init__(self, size, factory):
+        """Constructor.
+
+        Keyword arguments:
+        size -- maximum number of TreeTagger instances.
+        factory -- a function returning a new TreeTagger instance.
+        """
+        self.size = size
+        self.factory = factory
+        self.idle = []
+        self.created = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Get an idle instance, creating it if the pool isn't full."""
+        with self.condition:
+            while not self.idle and self.created >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return self.factory()
+        except Exception:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, tagger, broken=False):
+        """Give an instance back to the pool.
+
+        Keyword arguments:
+        tagger -- an instance returned by acquire.
+        broken -- True if it can't be used again (e.g. a failed pipe).
+        """
+        with self.condition:
+            if broken:
+                self.created -= 1
+            else:
+                self.idle.append(tagger)
+            self.condition.notify()
+
+
+class Job(TagWithTreeTagger):
+    """A treetagger.py run done by the server for a client."""
+
+    def __init__(self, args, server, reply):
+        """Constructor.
+
+        Keyword arguments:
+        args -- argparse.Namespace with the options of treetagger.py.
+        server -- the TaggingServer holding the loaded models.
+        reply -- a function sending a dict to the client.
+        """
+        self.configure(args)
+        self.jobs = 1  # the server already bounds the TreeTagger instances
+        self.readers = 0
+        self.taggers = 1  # and takes a TreeTagger instance per file
+        self.timeout = 0  # instances of the pool are not killed
+        self.server = server
+        self.reply = reply
+
+    def init_tokenizer(self):
+        return self.server.tokenizer(self)
+
+    def init_tagger(self):
+        return None  # taken from the pool for every file
+
+    def main(self):
+        for infile in self.infiles:
+            error = None
+            self.tagger = None
+            try:
+                with self.metrics.file(infile):
+                    self.use_language(self.file_language(infile))
+                    self.metrics.set('language', self.language)
+                    pool = self.server.pool(self)
+                    self.tagger = pool.acquire()
+                    self.process_file(infile)
+                    self.flush_documents()
+            except Exception:
+                error = traceback.format_exc()
+            if self.tagger is not None:
+                # the TreeTagger pipe may be unusable after an error
+                pool.release(self.tagger, broken=error is not None)
+                self.tagger = None
+            if error is None:
+                self.counter += 1
+                if self.manifest is not None:
+                    self.manifest.record(infile)
+            hits, misses = self.cache_usage()
+            self.hits += hits
+            self.misses += misses
+            self.reply({'file': infile, 'error': error})
+        pass
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Read a job as a JSON line and reply with a JSON line per file."""
+
+    def handle(self):
+        def reply(message):
+            self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+            self.wfile.flush()
+        try:
+            options = json.loads(self.rfile.readline().decode('utf-8'))
+            job = Job(argparse.Namespace(**options), self.server, reply)
+            job.run()
+            reply({
+                'counter': job.counter,
+                'languages': sorted(job.languages),
+                'hits': job.hits,
+                'misses': job.misses,
+                'summary': job.metrics.summary()})
+        except BrokenPipeError:
+            pass  # the client is gone
+        except Exception:
+            reply({'fatal': traceback.format_exc()})
+
+
+class TaggingServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    """Keep tokenizers and TreeTagger instances loaded between jobs.
+
+    Every connection is a job handled in its own thread. Models are
+    loaded for every language and abbreviation file the first time they
+    are needed, and kept until the server stops.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, instances):
+        """Constructor.
+
+        Keyword arguments:
+        path -- a string for the path of the Unix socket.
+        instances -- maximum number of TreeTagger instances per language.
+        """
+        self.instances = instances
+        self.tokenizers = {}
+        self.pools = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            os.remove(path)  # left by a server that was killed
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+    def key(self, job):
+        return job.language, job.abbreviation
+
+    def tokenizer(self, job):
+        """Get the loaded tokenizer for the options of a job."""
+        key = self.key(job)
+        with self.lock:
+            if key not in self.tokenizers:
+                self.tokenizers[key] = TagWithTreeTagger.init_tokenizer(job)
+            return self.tokenizers[key]
+
+    def pool(self, job):
+        """Get the TaggerPool for the options of a job."""
+        key = self.key(job)
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = TaggerPool(
+                    self.instances,
+                    lambda: TagWithTreeTagger.init_tagger(job))
+            return self.pools[key]
+
+    def warm(self, language, abbreviation):
+        """Load the models of a language before the first job.
+
+        Keyword arguments:
+        language -- one of 'en', 'es' or 'de'.
+        abbreviation -- path to an abbreviation file or None.
+        """
+        job = TagWithTreeTagger.__new__(TagWithTreeTagger)
+        job.language = language
+        job.abbreviation = abbreviation
+        self.tokenizer(job)
+        pool = self.pool(job)
+        pool.release(pool.acquire())
+
+
+def cli():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s", "--socket",
+        required=True,
+        help="path to the Unix socket where jobs are received.")
+    parser.add_argument(
+        "-l", "--languages",
+        required=False,
+        nargs='+',
+        default=[],
+        choices=['en', 'es', 'de'],
+        help="languages whose models are loaded at start, the rest are\
+              loaded when needed.")
+    parser.add_argument(
+        "-a", "--abbreviation",
+        required=False,
+        default=None,
+        help="path to the abbreviation file used by the languages loaded\
+              at start.")
+    parser.add_argument(
+        "-n", "--instances",
+        required=False,
+        default=2,
+        type=int,
+        help="maximum number of TreeTagger instances per language, shared\
+              by the jobs running at once.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = cli()
+    server = TaggingServer(args.socket, args.instances)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for language in args.languages:
+            abbreviation = args.abbreviation
+            if abbreviation is not None:
+                abbreviation = os.path.abspath(abbreviation)
+            server.warm(language, abbreviation)
+        print("listening on {}".format(args.socket), flush=True)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
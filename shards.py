@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Write documents to a few large VRT files with an index of their offsets.
+
+Every document is wrapped in a <text> element whose id is the path of its
+input file (a <text> root of the document gets the id instead), and
+appended to NAME-0000.vrt, NAME-0001.vrt... in the output directory, a
+new shard being started when the current one reaches the maximum size.
+NAME.index has a line per document with its id, shard, byte offset and
+length, so a document can be read or replaced without reading the rest
+of the corpus. Shards left by a previous run beyond the last one are
+removed when the writer is closed. Compressed shards are made of a stream
+(gzip member, xz stream...) per document, so the offsets can be used as
+they are and the shards can still be decompressed with the usual tools.
+"""
+
+import os
+import re
+import argparse
+import compression
+import vrt
+from manifest import atomic_open
+
+
+# XML declaration, doctype, comments and processing instructions
+PROLOG = re.compile(
+    r'\s*(?:<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^\[>]*(?:\[.*?\])?\s*>)',
+    re.DOTALL)
+EPILOG = [('<!--', '-->'), ('<?', '?>')]
+TEXT = re.compile(r'<text(?=[\s/>])')
+ID = re.compile(r'\sid\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+
+
+def source_id(infile, indir):
+    """Get the id of a document: the path of its file below indir.
+
+    Keyword arguments:
+    infile -- a string for the path to the input file.
+    indir -- a string for the path to the input directory.
+    """
+    return os.path.relpath(infile, indir).replace(os.sep, '/')
+
+
+def strip_prolog(text):
+    """Remove what comes before and after the root element of a VRT.
+
+    Keyword arguments:
+    text -- a string with the VRT of a document.
+    """
+    start = 0
+    match = PROLOG.match(text)
+    while match is not None:
+        start = match.end()
+        match = PROLOG.match(text, start)
+    end = len(text)
+    node = end
+    while node >= start:
+        end = node
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        node = -1
+        for opening, closing in EPILOG:
+            # the root ends with a tag, so these come after it
+            if text.endswith(closing, start, end):
+                node = text.rfind(opening, start, end)
+                break
+    while start < end and text[start].isspace():
+        start += 1
+    return text[start:end]
+
+
+def wrap(source, text):
+    """Wrap the VRT of a document in a <text> element.
+
+    The prolog (declaration, doctype, comments...) is removed. If the root
+    of the document is already a <text> element, its id is set instead.
+
+    Keyword arguments:
+    source -- a string with the id of the document.
+    text -- a string with the VRT of the document.
+    """
+    text = strip_prolog(text)
+    attribute = ' id="{}"'.format(source.translate(vrt.ATTRIBUTE))
+    if TEXT.match(text):
+        end = text.index('>')
+        if text[end - 1] == '/':
+            end -= 1
+        return '{}{}{}\n'.format(
+            ID.sub('', text[:end]), attribute, text[end:])
+    if text:
+        text += '\n'
+    return '<text{}>\n{}</text>\n'.format(attribute, text)
+
+
+def read_index(path):
+    """Read an index, return a list of [id, shard, offset, length].
+
+    Keyword arguments:
+    path -- a string for the path of the index.
+    """
+    entries = []
+    with open(path, mode='r', encoding='utf-8') as ifile:
+        for line in ifile:
+            source, shard, offset, length = line.rstrip('\n').split('\t')
+            entries.append([source, shard, int(offset), int(length)])
+    return entries
+
+
+class ShardWriter(object):
+    """Append documents to VRT shards and record their byte offsets."""
+
+    def __init__(self, outdir, name, size=0, compress=None):
+        """Constructor.
+
+        Keyword arguments:
+        outdir -- a string for the output directory.
+        name -- a string for the name of the shards and the index.
+        size -- maximum size of a shard in bytes, 0 for a single shard.
+        compress -- one of compression.COMPRESSIONS or None.
+        """
+        self.outdir = outdir
+        self.name = name
+        self.size = size
+        self.compress = compress
+        self.number = -1
+        self.shard = None
+        self.sfile = None
+        self.offset = 0
+        self.ifile = open(
+            os.path.join(outdir, name + '.index'), mode='w', encoding='utf-8')
+
+    def next_shard(self):
+        if self.sfile is not None:
+            self.sfile.close()
+        self.number += 1
+        self.shard = '{}-{:04d}.vrt{}'.format(
+            self.name, self.number, compression.suffix(self.compress))
+        self.sfile = open(os.path.join(self.outdir, self.shard), mode='wb')
+        self.offset = 0
+
+    def add(self, source, text):
+        """Append a document to the current shard.
+
+        Keyword arguments:
+        source -- a string with the id of the document.
+        text -- a string with the VRT of the document.
+        """
+        data = compression.compress(
+            wrap(source, text).encode('utf-8'), self.compress)
+        if self.sfile is None or (self.size and self.offset and
+                                  self.offset + len(data) > self.size):
+            self.next_shard()
+        self.sfile.write(data)
+        self.sfile.flush()
+        self.ifile.write('{}\t{}\t{}\t{}\n'.format(
+            source, self.shard, self.offset, len(data)))
+        self.ifile.flush()
+        self.offset += len(data)
+
+    def close(self):
+        if self.sfile is not None:
+            self.sfile.close()
+            self.sfile = None
+        self.ifile.close()
+        self.remove_stale()
+        pass
+
+    def remove_stale(self):
+        """Remove the shards of a previous run that weren't written again.
+
+        They would be read along with the new shards, e.g. by a glob, but
+        aren't in the index anymore.
+        """
+        written = set(
+            '{}-{:04d}.vrt{}'.format(
+                self.name, number, compression.suffix(self.compress))
+            for number in range(self.number + 1))
+        shard = re.compile(r'{}-\d{{4,}}\.vrt(?:\.(?:{}))?$'.format(
+            re.escape(self.name), '|'.join(compression.COMPRESSIONS)))
+        for entry in os.scandir(self.outdir):
+            if shard.match(entry.name) and entry.name not in written:
+                os.remove(entry.path)
+        pass
+
+
+def extract(index, source):
+    """Get the VRT of a document, with its <text> element.
+
+    Keyword arguments:
+    index -- a string for the path of the index.
+    source -- a string with the id of the document.
+    """
+    for entry in read_index(index):
+        if entry[0] == source:
+            path = os.path.join(os.path.dirname(index), entry[1])
+            with open(path, mode='rb') as sfile:
+                sfile.seek(entry[2])
+                data = sfile.read(entry[3])
+            return compression.decompress(
+                data, compression.detect(path)).decode('utf-8')
+    raise KeyError(source)
+
+
+def replace(index, source, text):
+    """Replace a document in its shard, e.g. after tagging it again.
+
+    Only the shard of the document and the index are written again.
+
+    Keyword arguments:
+    index -- a string for the path of the index.
+    source -- a string with the id of the document.
+    text -- a string with the new VRT of the document.
+    """
+    entries = read_index(index)
+    for entry in entries:
+        if entry[0] == source:
+            break
+    else:
+        raise KeyError(source)
+    shard, offset, length = entry[1:]
+    path = os.path.join(os.path.dirname(index), shard)
+    data = compression.compress(
+        wrap(source, text).encode('utf-8'), compression.detect(path))
+    # the data is already compressed: '.new' keeps atomic_open from
+    # compressing it again
+    with open(path, mode='rb') as sfile, \
+            atomic_open(path + '.new', mode='wb', encoding=None) as ofile:
+        ofile.write(sfile.read(offset))
+        ofile.write(data)
+        sfile.seek(offset + length)
+        for chunk in iter(lambda: sfile.read(1 << 20), b''):
+            ofile.write(chunk)
+    os.replace(path + '.new', path)
+    entry[3] = len(data)
+    for other in entries:
+        if other[1] == shard and other[2] > offset:
+            other[2] += len(data) - length
+    with atomic_open(index) as ofile:
+        for entry in entries:
+            ofile.write('{}\t{}\t{}\t{}\n'.format(*entry))
+
+
+def cli():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "index",
+        help="path to the index of the shards (NAME.index).")
+    parser.add_argument(
+        "id",
+        help="id of the document: the path of its input file below the\
+              input directory.")
+    parser.add_argument(
+        "-r", "--replace",
+        required=False,
+        default=None,
+        help="if provided, path to a VRT file replacing the document,\
+              else the document is printed.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = cli()
+    if args.replace is None:
+        print(extract(args.index, args.id), end='')
+    else:
+        with compression.open_file(args.replace) as ifile:
+            replace(args.index, args.id, ifile.read())
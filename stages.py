@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Overlap reading, processing and writing of files with threads.
+
+InstancePool spreads the calls to several instances of a program, e.g.
+TreeTagger, over threads. split_chunks cuts the text nodes of a file in
+chunks for worker processes.
+"""
+
+import time
+import queue
+import threading
+
+
+DONE = object()  # put by a stage when it has no more items
+
+
+class Stopped(Exception):
+    """Raised in a stage when another one failed."""
+
+
+class Stage(object):
+    """Time a stage run by one or more threads spends working."""
+
+    def __init__(self, name, threads=1):
+        """Constructor.
+
+        Keyword arguments:
+        name -- a string with the name of the stage.
+        threads -- number of threads running the stage.
+        """
+        self.name = name
+        self.threads = threads
+        self.busy = 0
+        self.lock = threading.Lock()
+
+    def add(self, busy):
+        with self.lock:
+            self.busy += busy
+
+    def report(self, seconds):
+        """Get a string with the busy time and utilization of the stage.
+
+        Keyword arguments:
+        seconds -- wall time of the run.
+        """
+        share = self.busy / (seconds * self.threads) if seconds else 0
+        report = '{} {:.2f} s ({:.0%}'.format(self.name, self.busy, share)
+        if self.threads > 1:
+            report += ', {} threads'.format(self.threads)
+        return report + ')'
+
+
+class StagedLoop(object):
+    """Run read, process and write functions over files at once.
+
+    Reader threads call read for the next files, the calling thread calls
+    process with every item read, and a writer thread calls write with
+    every item processed. Queues between the stages hold at most size
+    items, which bounds the number of files in memory. The first error
+    raised by a stage stops the others and is raised by run.
+    """
+
+    def __init__(self, read, process, write, readers=1, size=4):
+        """Constructor.
+
+        Keyword arguments:
+        read -- a function taking a path and returning an item.
+        process -- a function taking a path and an item read, returning
+                   an item to be written.
+        write -- a function taking a path and an item processed.
+        readers -- number of reader threads.
+        size -- maximum number of items waiting in each queue.
+        """
+        self.read = read
+        self.process = process
+        self.write = write
+        self.readers = readers
+        self.size = size
+        self.stages = [
+            Stage('read', readers),
+            Stage('tag'),
+            Stage('write')]
+        self.seconds = 0
+        self.error = None
+        self.stopped = threading.Event()
+
+    def put(self, channel, item):
+        while True:
+            try:
+                return channel.put(item, timeout=0.1)
+            except queue.Full:
+                if self.stopped.is_set():
+                    raise Stopped()
+
+    def get(self, channel):
+        while True:
+            try:
+                return channel.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    raise Stopped()
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def reader(self, infiles, output):
+        stage = self.stages[0]
+        try:
+            while not self.stopped.is_set():
+                try:
+                    infile = infiles.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                item = self.read(infile)
+                stage.add(time.perf_counter() - start)
+                self.put(output, (infile, item))
+            self.put(output, DONE)
+        except Stopped:
+            pass
+        except BaseException as e:
+            self.fail(e)
+
+    def writer(self, input):
+        stage = self.stages[2]
+        try:
+            while not self.stopped.is_set():
+                entry = self.get(input)
+                if entry is DONE:
+                    break
+                start = time.perf_counter()
+                self.write(*entry)
+                stage.add(time.perf_counter() - start)
+        except Stopped:
+            pass
+        except BaseException as e:
+            self.fail(e)
+
+    def run(self, infiles):
+        """Read, process and write a list of files.
+
+        Keyword arguments:
+        infiles -- a list of strings for the paths to the files.
+        """
+        started = time.perf_counter()
+        todo = queue.Queue()
+        for infile in infiles:
+            todo.put(infile)
+        read = queue.Queue(self.size)
+        processed = queue.Queue(self.size)
+        threads = [
+            threading.Thread(target=self.reader, args=(todo, read))
+            for i in range(self.readers)]
+        threads.append(threading.Thread(target=self.writer, args=(processed,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        stage = self.stages[1]
+        finished = 0
+        try:
+            while finished < self.readers:
+                entry = self.get(read)
+                if entry is DONE:
+                    finished += 1
+                    continue
+                start = time.perf_counter()
+                item = self.process(*entry)
+                stage.add(time.perf_counter() - start)
+                self.put(processed, (entry[0], item))
+            self.put(processed, DONE)
+        except Stopped:
+            pass
+        except BaseException as e:
+            self.fail(e)
+        for thread in threads:
+            thread.join()
+        self.seconds = time.perf_counter() - started
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        """Get a line with the utilization of every stage."""
+        return 'stages: ' + ', '.join(
+            stage.report(self.seconds) for stage in self.stages)
+
+
+class InstancePool(object):
+    """Call several instances of a program at once, one thread each.
+
+    Calls are dispatched to whichever instance is free. This pays off
+    when the calls mostly wait for the instances, e.g. on their pipes.
+    """
+
+    def __init__(self, instances, name='instance'):
+        """Constructor.
+
+        Keyword arguments:
+        instances -- a list of objects, each used by one call at a time.
+        name -- a string naming the instances in the report.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        self.instances = instances
+        self.free = queue.Queue()
+        self.stages = []
+        for i, instance in enumerate(instances):
+            stage = Stage('{} {}'.format(name, i))
+            self.stages.append(stage)
+            self.free.put((instance, stage))
+        self.executor = ThreadPoolExecutor(len(instances))
+        self.started = time.perf_counter()
+
+    def call(self, function, item):
+        instance, stage = self.free.get()
+        start = time.perf_counter()
+        try:
+            return function(instance, item)
+        finally:
+            stage.add(time.perf_counter() - start)
+            self.free.put((instance, stage))
+
+    def map(self, function, items):
+        """Get function(instance, item) for every item, in their order.
+
+        The first error raised by a call is raised again.
+
+        Keyword arguments:
+        function -- a function taking an instance and an item.
+        items -- a list of items.
+        """
+        return list(self.executor.map(
+            lambda item: self.call(function, item), items))
+
+    def report(self):
+        """Get a line with the utilization of every instance."""
+        seconds = time.perf_counter() - self.started
+        return ', '.join(stage.report(seconds) for stage in self.stages)
+
+    def close(self, wait=True):
+        """Stop the threads.
+
+        Keyword arguments:
+        wait -- False not to wait for the calls still running.
+        """
+        self.executor.shutdown(wait)
+
+
+def split_chunks(texts, n):
+    """Split a list of strings in about n lists of similar length.
+
+    Keyword arguments:
+    texts -- a list of strings.
+    n -- number of lists.
+    """
+    size = sum(len(tc) for tc in texts) / n
+    chunks = [[]]
+    length = 0
+    for tc in texts:
+        if length >= size:
+            chunks.append([])
+            length = 0
+        chunks[-1].append(tc)
+        length += len(tc)
+    return chunks
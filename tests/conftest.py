@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Put the scripts and the TreeTagger stand-in of the benchmarks on the
+path, and run the scripts as the command line does."""
+
+import os
+import re
+import sys
+import pickle
+import argparse
+import subprocess
+import pytest
+
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(TESTS)
+DATA = os.path.join(TESTS, 'data')
+FAKE = os.path.join(REPOSITORY, 'benchmark', 'fake')
+sys.path[:0] = [REPOSITORY, FAKE]
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+class SentenceTokenizer(object):
+    """Stand-in for the Punkt tokenizer: a sentence ends with . ! or ?"""
+
+    def tokenize(self, text):
+        return [s for s in SENTENCE_END.split(text.strip()) if s]
+
+
+def write_corpus(directory, texts):
+    """Write a document per text, with a <p> element per line."""
+    os.makedirs(str(directory))
+    for name, text in texts.items():
+        with open(os.path.join(str(directory), name + '.xml'), mode='w',
+                  encoding='utf-8') as ofile:
+            ofile.write('<?xml version="1.0" encoding="UTF-8"?>\n<text>\n')
+            for line in text.split('\n'):
+                ofile.write('<p>\n{}\n</p>\n'.format(
+                    '\n'.join(line.split())))
+            ofile.write('</text>\n')
+
+
+def outputs(directory):
+    found = {}
+    for name in sorted(os.listdir(str(directory))):
+        if name.endswith('.vrt'):
+            with open(os.path.join(str(directory), name), mode='r',
+                      encoding='utf-8') as ifile:
+                found[name] = ifile.read()
+    return found
+
+
+def environment(tmp_path):
+    """Get the environment of the scripts run by the tests."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [FAKE, TESTS] + [p for p in [env.get('PYTHONPATH')] if p])
+    env['XDG_CACHE_HOME'] = str(tmp_path / 'cache')
+    return env
+
+
+@pytest.fixture
+def run_script(tmp_path):
+    """Get a function running a script with the TreeTagger stand-in."""
+    def run(script, *args):
+        process = subprocess.run(
+            [sys.executable, '-W', 'ignore',
+             os.path.join(REPOSITORY, script)] + [str(a) for a in args],
+            env=environment(tmp_path),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True)
+        assert process.returncode == 0, process.stderr
+        return process.stdout
+    return run
+
+
+@pytest.fixture
+def punkt(tmp_path, monkeypatch):
+    """Make the scripts load SentenceTokenizer instead of Punkt with -s.
+
+    It is saved where treetagger.py keeps its prebuilt tokenizers, for
+    every language and no abbreviation file.
+    """
+    from treetagger import TagWithTreeTagger
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    for language in ['es', 'en', 'de']:
+        path = TagWithTreeTagger.tokenizer_artifact(
+            argparse.Namespace(language=language, abbreviation=None))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='wb') as afile:
+            pickle.dump(SentenceTokenizer(), afile)
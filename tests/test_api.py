@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""Documents tagged from Python as the scripts tag files."""
+
+import os
+import pytest
+import api
+
+
+DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<text>
+<p>He said "yes", then "no." and left .</p>
+<p>Dijo «sí», luego “no”. Y se fue , ¿vale ?</p>
+<p>Er sagte "ja," und ging 1 000 000 Schritte – weg .</p>
+</text>
+"""
+
+
+@pytest.mark.parametrize('language', ['es', 'en', 'de'])
+def test_pipeline(run_script, tmp_path, language):
+    os.makedirs(str(tmp_path / 'in'))
+    with open(str(tmp_path / 'in' / 'd.xml'), mode='w',
+              encoding='utf-8') as ofile:
+        ofile.write(DOCUMENT)
+    run_script('pipeline.py', '-i', tmp_path / 'in', '-o', tmp_path / 'out',
+               '-l', language, '-e', 'p', '-t', 'p', '--tokenize')
+    with open(str(tmp_path / 'out' / 'd.vrt'), mode='r',
+              encoding='utf-8') as ifile:
+        expected = ifile.read()
+    with api.Pipeline(language=language, element='p', text='p',
+                      tokenize=True) as pipeline:
+        assert pipeline.tag_xml(DOCUMENT) == expected
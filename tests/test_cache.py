@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""On-disk cache of tagged sentences."""
+
+from cache import TagCache
+
+
+def tagged(*sentences):
+    return {s: ['{}\tNC\t{}'.format(s, s)] for s in sentences}
+
+
+def statements(cache):
+    found = []
+    cache.connection.set_trace_callback(found.append)
+    return found
+
+
+def test_get_put(tmp_path):
+    cache = TagCache(str(tmp_path / 'c.db'), 'es', 10)
+    assert cache.get(['a', 'b']) == [None, None]
+    cache.put(tagged('a', 'b'))
+    assert cache.get(['b', 'c', 'a']) == [['b\tNC\tb'], None, ['a\tNC\ta']]
+    assert cache.usage() == (2, 3)
+    other = TagCache(str(tmp_path / 'c.db'), 'de', 10)
+    assert other.get(['a']) == [None]
+
+
+def test_eviction(tmp_path):
+    cache = TagCache(str(tmp_path / 'c.db'), 'es', 100)
+    found = statements(cache)
+    for i in range(1000):
+        cache.put(tagged(str(i)))
+        cache.get(['0'])  # the first one is always used again
+    counts = [s for s in found if 'COUNT' in s]
+    assert len(counts) < 1000 // 5
+    cache.flush()
+    rows = cache.connection.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+    assert rows == cache.count
+    assert rows <= 100
+    assert cache.get(['0', '999', '1']) == [['0\tNC\t0'], ['999\tNC\t999'],
+                                             None]
+
+
+def test_deferred_use(tmp_path):
+    cache = TagCache(str(tmp_path / 'c.db'), 'es', 4)
+    cache.put(tagged('a', 'b', 'c', 'd'))
+    found = statements(cache)
+    cache.get(['a'])
+    assert not [s for s in found if s.startswith('UPDATE')]
+    cache.usage()  # written once the file is done
+    assert [s for s in found if s.startswith('UPDATE')]
+    cache.put(tagged('e'))
+    found = cache.get(['a', 'b', 'c', 'd', 'e'])
+    assert found[0] == ['a\tNC\ta'] and found[4] == ['e\tNC\te']
+    assert found[1:4].count(None) == 1
+
+
+def test_shared(tmp_path):
+    first = TagCache(str(tmp_path / 'c.db'), 'es', 50)
+    second = TagCache(str(tmp_path / 'c.db'), 'es', 50)
+    for i in range(100):
+        first.put(tagged('a{}'.format(i)))
+        second.put(tagged('b{}'.format(i)))
+    rows = first.connection.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+    assert rows <= 50 + 50 // 20
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar store of the tokens of VRT documents."""
+
+import os
+import pytest
+import columns
+
+
+VRT = ("<?xml version='1.0' encoding='utf-8'?>\n<text>\n<p>\n<s>\n"
+       "Se\tPP\tse\ncierra\tVLfin\tcerrar\n.\tFS\t.\n</s>\n<s n=\"2\">\n"
+       "A&amp;B\tNP\tA&amp;B\nsolo\n</s>\n</p>\n</text>\n")
+
+
+def store_files(directory):
+    found = {}
+    for name in sorted(os.listdir(str(directory))):
+        with open(os.path.join(str(directory), name), mode='rb') as ifile:
+            found[name] = ifile.read()
+    return found
+
+
+def test_pieces(tmp_path, monkeypatch):
+    os.makedirs(str(tmp_path / 'a'))
+    whole = columns.ColumnWriter(str(tmp_path / 'a'), 'c')
+    whole.add('d1', VRT)
+    whole.add('d2', VRT)
+    whole.close()
+    monkeypatch.setattr(columns, 'CHUNK', 2)
+    os.makedirs(str(tmp_path / 'b'))
+    pieces = columns.ColumnWriter(str(tmp_path / 'b'), 'c')
+    for source in ['d1', 'd2']:
+        document = pieces.document(source)
+        for i in range(0, len(VRT), 7):
+            document.write(VRT[i:i+7])
+        document.close()
+    pieces.close()
+    assert store_files(tmp_path / 'a') == store_files(tmp_path / 'b')
+    assert columns.read_documents(str(tmp_path / 'b' / 'c.documents')) == [
+        ['d1', 0, 5, 0, 2], ['d2', 5, 5, 2, 2]]
+    assert columns.read_vocabulary(str(tmp_path / 'b' / 'c.word.vocab')) == [
+        'Se', 'cierra', '.', 'A&B', 'solo']
+
+
+def test_abort(tmp_path, monkeypatch):
+    os.makedirs(str(tmp_path / 'a'))
+    os.makedirs(str(tmp_path / 'b'))
+    monkeypatch.setattr(columns, 'CHUNK', 1)
+    expected = columns.ColumnWriter(str(tmp_path / 'a'), 'c')
+    expected.add('d1', VRT)
+    expected.add('d3', VRT)
+    expected.close()
+    store = columns.ColumnWriter(str(tmp_path / 'b'), 'c')
+    store.add('d1', VRT)
+    document = store.document('d2')
+    document.write(VRT[:-20])
+    document.abort()
+    store.add('d3', VRT)
+    store.close()
+    assert store_files(tmp_path / 'a') == store_files(tmp_path / 'b')
+
+
+@pytest.mark.parametrize('options', [[], ['-j', 3], ['-z', 'gz', '-j', 2]])
+def test_scripts(run_script, tmp_path, options):
+    os.makedirs(str(tmp_path / 'in'))
+    for i in range(6):
+        with open(str(tmp_path / 'in' / 'd{}.xml'.format(i)), mode='w',
+                  encoding='utf-8') as ofile:
+            ofile.write('<text>\n<p>\nSe\ncierra {}\n.\n</p>\n</text>\n'.format(
+                'el debate ' * i))
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'a',
+               '-l', 'es', '-e', 'p', '--concatenate', 'corpus', '--columns',
+               'c')
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'b',
+               '-l', 'es', '-e', 'p', '--columns', 'c', *options)
+    expected = store_files(tmp_path / 'a')
+    found = store_files(tmp_path / 'b')
+    for name in expected:
+        if name.startswith('c.'):
+            assert found[name] == expected[name]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Compressed input and output files."""
+
+import os
+import pytest
+import compression
+from conftest import write_corpus, outputs
+
+
+def available(name):
+    if name == 'zst':
+        pytest.importorskip('zstandard')
+    return name
+
+
+@pytest.mark.parametrize('name', compression.COMPRESSIONS)
+def test_round_trip(tmp_path, name):
+    available(name)
+    text = 'Se\tVLfin\tser\nñandú\tNC\tñandú\n' * 1000
+    path = str(tmp_path / ('doc.vrt.' + name))
+    with compression.open_file(path, 'w') as ofile:
+        ofile.write(text)
+    assert compression.detect(path) == name
+    with compression.open_file(path) as ifile:
+        assert ifile.read() == text
+    data = text.encode('utf-8')
+    # streams compressed one by one, as --concatenate writes them
+    joined = compression.compress(data, name) + compression.compress(
+        data, name)
+    with open(path, mode='wb') as ofile:
+        ofile.write(joined)
+    with compression.open_file(path) as ifile:
+        assert ifile.read() == text + text
+    assert compression.decompress(
+        compression.compress(data, name), name) == data
+
+
+def test_names():
+    assert compression.detect('a.xml') is None
+    assert compression.strip('a.xml.gz') == 'a.xml'
+    assert compression.strip('a.xml') == 'a.xml'
+    assert compression.suffix(None) == ''
+    assert compression.suffix('xz') == '.xz'
+    names = ['a.xml', 'b.xml.gz', 'c.xml.xz', 'd.txt.gz', 'e.gz']
+    assert compression.filter_files(names, '*.xml') == [
+        'a.xml', 'b.xml.gz', 'c.xml.xz']
+    assert compression.filter_files(names, '*.gz') == [
+        'b.xml.gz', 'd.txt.gz', 'e.gz']
+
+
+def test_tagging(run_script, tmp_path, punkt):
+    texts = {'d{}'.format(i): 'Se cierra el debate {} . Muchas gracias !\n'
+             'Y se levanta la sesión .'.format(i) for i in range(3)}
+    write_corpus(tmp_path / 'plain', texts)
+    os.makedirs(str(tmp_path / 'in'))
+    for k, name in enumerate(sorted(os.listdir(str(tmp_path / 'plain')))):
+        extension = ['', '.gz', '.xz'][k]
+        with open(str(tmp_path / 'plain' / name), mode='rb') as ifile,\
+                compression.open_file(str(tmp_path / 'in' / name) + extension,
+                                      'wb', None) as ofile:
+            ofile.write(ifile.read())
+    common = ['-l', 'es', '-e', 'p', '-s', '-p', '*.xml']
+    run_script('treetagger.py', '-i', tmp_path / 'plain',
+               '-o', tmp_path / 'expected', *common)
+    output = run_script('treetagger.py', '-i', tmp_path / 'in',
+                        '-o', tmp_path / 'out', '-z', 'gz', *common)
+    assert '3 files in' in output
+    expected = outputs(tmp_path / 'expected')
+    assert sorted(os.listdir(str(tmp_path / 'out'))) == [
+        name + '.gz' for name in sorted(expected)]
+    for name, text in expected.items():
+        with compression.open_file(str(tmp_path / 'out' / name) + '.gz') as\
+                ifile:
+            assert ifile.read() == text
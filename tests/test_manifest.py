@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Skipping files already processed with -u."""
+
+import os
+import manifest
+from conftest import write_corpus, outputs
+
+
+def open_manifest(tmp_path, config=None):
+    return manifest.Manifest(
+        str(tmp_path / 'out' / '.manifest'), str(tmp_path / 'in'),
+        config or {'language': 'es'},
+        lambda infile: str(tmp_path / 'out' / os.path.basename(infile)))
+
+
+def make_files(tmp_path, names):
+    os.makedirs(str(tmp_path / 'in'))
+    os.makedirs(str(tmp_path / 'out'))
+    paths = []
+    for name in names:
+        path = str(tmp_path / 'in' / name)
+        with open(path, mode='w', encoding='utf-8') as ofile:
+            ofile.write(name)
+        paths.append(path)
+    return paths
+
+
+def process(tmp_path, done, paths):
+    for path in paths:
+        with open(str(tmp_path / 'out' / os.path.basename(path)),
+                  mode='w') as ofile:
+            ofile.write('done')
+        done.record(path)
+    done.mfile.close()
+
+
+def test_pending(tmp_path):
+    paths = make_files(tmp_path, ['a.xml', 'b.xml', 'c.xml', 'd.xml'])
+    done = open_manifest(tmp_path)
+    assert done.pending(paths) == paths
+    process(tmp_path, done, paths[:3])  # interrupted before d.xml
+    assert open_manifest(tmp_path).pending(paths) == paths[3:]
+    with open(paths[0], mode='a') as ofile:
+        ofile.write('changed')
+    os.remove(str(tmp_path / 'out' / 'b.xml'))
+    assert open_manifest(tmp_path).pending(paths) == [
+        paths[0], paths[1], paths[3]]
+    assert open_manifest(tmp_path, {'language': 'en'}).pending(
+        paths) == paths
+
+
+def test_touched(tmp_path, monkeypatch):
+    paths = make_files(tmp_path, ['a.xml'])
+    done = open_manifest(tmp_path)
+    done.pending(paths)
+    process(tmp_path, done, paths)
+    stat = os.stat(paths[0])
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    hashed = []
+    fingerprint = manifest.fingerprint
+
+    def counted(files):
+        hashed.extend(files)
+        return fingerprint(files)
+    monkeypatch.setattr(manifest, 'fingerprint', counted)
+    for run in range(3):
+        done = open_manifest(tmp_path)
+        assert done.pending(paths) == []
+        done.mfile.close()
+    assert hashed == paths  # only the first run after the change
+
+
+def test_resume(run_script, tmp_path):
+    write_corpus(tmp_path / 'in', {'a': 'uno dos', 'b': 'tres', 'c': 'cuatro'})
+    options = ['-i', tmp_path / 'in', '-o', tmp_path / 'out', '-l', 'es',
+               '-e', 'p', '-u']
+    run_script('treetagger.py', *options)
+    expected = outputs(tmp_path / 'out')
+    os.remove(str(tmp_path / 'out' / 'b.vrt'))
+    output = run_script('treetagger.py', *options)
+    assert '1 files in' in output and 'b.xml' in output
+    assert outputs(tmp_path / 'out') == expected
+    assert '0 files in' in run_script('treetagger.py', *options)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""Fixes of post_treetagger.py, reading the tree or streaming lines."""
+
+import os
+import pytest
+from conftest import outputs
+
+
+SR = 'Sr\tNP\tSr\n.\tFS\t.\n'
+DOCUMENTS = {
+    'sr': '<text id="d0">\n<p>\n' + SR + SR + 'Sra.\tNP\tSra.\n.\tFS\t.\n'
+          '</p>\n<p>\n' + SR + '</p>\n</text>\n',
+    'nested': '<text>\n<!-- a comment -->\n<div n="1">\n<p id="p0">\n<s>\n' +
+              SR + '</s>\n<s>\nSr\tNP\tSr\n</s>\n<s>\n.\tFS\t.\n</s>\n'
+              '<p>\n' + SR + '</p>\n</p>\n<head/>\n' + SR + '</div>\n'
+              '<?pi x?>\n</text>\n',
+    'escaped': '<text>\n<p>\n&lt;\tSYM\t&lt;\n&amp;\tSYM\t&amp;\n' + SR +
+               '</p>\n<pb n="2"/>\n<p/>\n</text>\n',
+    'empty': '<text>\n</text>\n'}
+
+
+@pytest.mark.parametrize('language', ['es', 'en'])
+def test_stream(run_script, tmp_path, language):
+    os.makedirs(str(tmp_path / 'in'))
+    for name, text in DOCUMENTS.items():
+        with open(str(tmp_path / 'in' / (name + '.vrt')), mode='w',
+                  encoding='utf-8') as ofile:
+            ofile.write("<?xml version='1.0' encoding='utf-8'?>\n" + text)
+    common = ['-i', tmp_path / 'in', '-l', language, '-t', 'p', '-g', '*.vrt']
+    run_script('post_treetagger.py', '-o', tmp_path / 'tree', *common)
+    run_script('post_treetagger.py', '-o', tmp_path / 'stream', '--stream',
+               *common)
+    expected = outputs(tmp_path / 'tree')
+    assert len(expected) == len(DOCUMENTS)
+    assert outputs(tmp_path / 'stream') == expected
+    if language == 'es':
+        assert expected['sr.vrt'].count('\tseñor\n') == 3
+
+
+def test_stream_markup(run_script, tmp_path):
+    # not well-formed, only read by --stream: a lone < is copied as markup
+    os.makedirs(str(tmp_path / 'in'))
+    with open(str(tmp_path / 'in' / 'a.vrt'), mode='w',
+              encoding='utf-8') as ofile:
+        ofile.write('<text>\n<p>\n' + SR + '<\n' + SR + '</p>\n</text>\n')
+    run_script('post_treetagger.py', '-i', tmp_path / 'in',
+               '-o', tmp_path / 'out', '-l', 'es', '-t', 'p', '-g', '*.vrt',
+               '--stream')
+    assert outputs(tmp_path / 'out')['a.vrt'].endswith(
+        '<text>\n<p>\nSr.\tNC\tseñor\n<\nSr.\tNC\tseñor\n</p>\n</text>')
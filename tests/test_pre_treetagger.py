@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+"""Character normalization of pre_treetagger.py."""
+
+import os
+import pytest
+from conftest import DATA
+
+
+NORMALIZE = os.path.join(DATA, 'normalize')
+
+
+def read(path):
+    with open(path, mode='r', encoding='utf-8') as ifile:
+        return ifile.read()
+
+
+@pytest.mark.parametrize('language', ['es', 'en', 'de'])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_golden(run_script, tmp_path, language, jobs):
+    # expected/ is the output of pre_treetagger.py before search_and_replace
+    # was compiled into a few passes
+    run_script(
+        'pre_treetagger.py', '-i', NORMALIZE, '-o', tmp_path, '-t', 'p',
+        '-g', 'input.xml', '-l', language, '-j', jobs, '--split_size', 0)
+    assert read(tmp_path / 'input.xml') == read(
+        os.path.join(NORMALIZE, 'expected', language + '.xml'))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""Rules of the rules directory fixing sequences of tokens."""
+
+import pytest
+import rules
+
+
+SR = 'Sr\tNP\tSr\n.\tFS\t.\n'
+SRA = 'Sra.\tNP\tSra.\n.\tFS\t.\n'
+FIXED_SR = 'Sr.\tNC\tseñor\n'
+FIXED_SRA = 'Sra.\tNC\tseñora\n'
+TEXTS = [
+    # back-to-back sequences, missed by the regexes the rules replaced
+    ('\n' + SR + SR + SRA + SR,
+     '\n' + FIXED_SR + FIXED_SR + FIXED_SRA + FIXED_SR),
+    ('\n' + SR + 'Pérez\tNP\tPérez\n' + SRA + SRA,
+     '\n' + FIXED_SR + 'Pérez\tNP\tPérez\n' + FIXED_SRA + FIXED_SRA),
+    # a period not tagged FS is left
+    ('\n' + SR.replace('FS', 'SYM') + SR,
+     '\n' + SR.replace('FS', 'SYM') + FIXED_SR),
+    ('\nSr\tNP\tSr\n', '\nSr\tNP\tSr\n')]
+
+
+@pytest.mark.parametrize('text,fixed', TEXTS)
+def test_apply(text, fixed):
+    ruleset = rules.load_language(rules.DIRECTORY, 'es')
+    assert ruleset.apply(text) == fixed
+    assert sum(ruleset.counts().values()) == fixed.count('\tNC\t')
+
+
+@pytest.mark.parametrize('text,fixed', TEXTS)
+def test_window(text, fixed):
+    lines = []
+    window = rules.Window(rules.load_language(rules.DIRECTORY, 'es'),
+                          lines.append)
+    for line in text.split('\n')[1:-1]:
+        window.add(line)
+    window.flush()
+    assert '\n' + '\n'.join(lines) + '\n' == fixed
+
+
+def test_copied_fields():
+    ruleset = rules.load_language(rules.DIRECTORY, 'en')
+    text = '\nThat\tIN/that\tthat\nthat\tIN/that\tthat\nthat\tDT\tthat\n'
+    assert ruleset.apply(text) == (
+        '\nThat\tIN\tthat\nthat\tIN\tthat\nthat\tDT\tthat\n')
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""Jobs tagged by server.py with its loaded models."""
+
+import os
+import sys
+import subprocess
+import pytest
+from conftest import REPOSITORY, environment, write_corpus, outputs
+
+
+@pytest.fixture
+def server(tmp_path, punkt):
+    """Start server.py, return the path of its socket."""
+    path = str(tmp_path / 'ttg.sock')
+    process = subprocess.Popen(
+        [sys.executable, '-W', 'ignore', os.path.join(REPOSITORY, 'server.py'),
+         '-s', path, '-l', 'es', '-n', '2'],
+        env=environment(tmp_path),
+        stdout=subprocess.PIPE,
+        universal_newlines=True)
+    assert process.stdout.readline().startswith('listening')
+    yield path
+    process.terminate()
+    process.wait(timeout=10)
+    process.stdout.close()
+
+
+@pytest.mark.parametrize('options', [
+    [], ['-s'], ['-s', '--tokenize', '-b', 60], ['-s', '--language_from',
+                                                  'path:0']])
+def test_client(run_script, tmp_path, server, options):
+    texts = {'d{}'.format(i): 'Se cierra el debate {} . Muchas gracias !\n'
+             'Y se levanta la sesión .'.format(i) for i in range(3)}
+    for language in ['es', 'en']:
+        write_corpus(tmp_path / 'in' / language, texts)
+    common = ['-i', tmp_path / 'in', '-l', 'es', '-e', 'p'] + options
+    run_script('treetagger.py', '-o', tmp_path / 'direct', *common)
+    output = run_script('treetagger.py', '-o', tmp_path / 'client',
+                        '--server', server, *common)
+    assert '6 files in' in output
+    for language in ['es', 'en']:
+        expected = outputs(tmp_path / 'direct' / language)
+        assert len(expected) == 3
+        assert outputs(tmp_path / 'client' / language) == expected
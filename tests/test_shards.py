@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Documents wrapped in <text> elements in shards."""
+
+import os
+import pytest
+import shards
+
+
+DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+BODY = '<p>\nSe\tVLfin\tser\n.\tFS\t.\n</p>\n'
+
+
+@pytest.mark.parametrize('prolog,epilog', [
+    ('', ''),
+    (DECLARATION, ''),
+    (DECLARATION + '<!DOCTYPE text>\n', '\n'),
+    (DECLARATION + '<!DOCTYPE text [\n<!ENTITY e "x">\n]>\n'
+     '<?xml-stylesheet href="a.css"?>\n<!-- a\ncomment -->\n',
+     '<!-- after -->\n<?pi x?>\n')])
+def test_wrap(prolog, epilog):
+    assert (shards.wrap('es/a.xml', prolog + '<doc>\n' + BODY + '</doc>\n' +
+                        epilog) ==
+            '<text id="es/a.xml">\n<doc>\n' + BODY + '</doc>\n</text>\n')
+    assert (shards.wrap('es/a.xml', prolog + '<text>\n' + BODY + '</text>\n' +
+                        epilog) ==
+            '<text id="es/a.xml">\n' + BODY + '</text>\n')
+
+
+def test_wrap_text_root():
+    assert (shards.wrap('a&b.xml', '<text lang="es" id="d1">\n</text>') ==
+            '<text lang="es" id="a&amp;b.xml">\n</text>\n')
+    assert shards.wrap('a.xml', '<text/>\n') == '<text id="a.xml"/>\n'
+    assert (shards.wrap('a.xml', '<texts>\n</texts>\n') ==
+            '<text id="a.xml">\n<texts>\n</texts>\n</text>\n')
+    wrapped = shards.wrap('a.xml', DECLARATION + '<text>\n' + BODY + '</text>')
+    assert shards.wrap('a.xml', wrapped) == wrapped
+
+
+def test_replace(tmp_path):
+    writer = shards.ShardWriter(str(tmp_path), 'corpus')
+    writer.add('a.xml', DECLARATION + '<text>\n' + BODY + '</text>\n')
+    writer.add('b.xml', DECLARATION + '<doc>\n</doc>\n')
+    writer.close()
+    index = os.path.join(str(tmp_path), 'corpus.index')
+    extracted = shards.extract(index, 'a.xml')
+    assert extracted == '<text id="a.xml">\n' + BODY + '</text>\n'
+    shards.replace(index, 'a.xml', extracted)
+    with open(os.path.join(str(tmp_path), 'corpus-0000.vrt'),
+              encoding='utf-8') as ifile:
+        assert ifile.read() == (extracted + '<text id="b.xml">\n<doc>\n'
+                                '</doc>\n</text>\n')
+
+
+def test_stale_shards(tmp_path):
+    writer = shards.ShardWriter(str(tmp_path), 'corpus', size=1)
+    for name in ['a.xml', 'b.xml', 'c.xml']:
+        writer.add(name, '<doc>\n</doc>\n')
+    writer.close()
+    other = shards.ShardWriter(str(tmp_path), 'other')
+    other.add('a.xml', '<doc>\n</doc>\n')
+    other.close()
+    writer = shards.ShardWriter(str(tmp_path), 'corpus', size=1)
+    writer.add('a.xml', '<doc>\n</doc>\n')
+    writer.close()
+    assert sorted(os.listdir(str(tmp_path))) == [
+        'corpus-0000.vrt', 'corpus.index', 'other-0000.vrt', 'other.index']
+    writer = shards.ShardWriter(str(tmp_path), 'corpus', compress='gz')
+    writer.add('a.xml', '<doc>\n</doc>\n')
+    writer.close()
+    assert sorted(os.listdir(str(tmp_path))) == [
+        'corpus-0000.vrt.gz', 'corpus.index', 'other-0000.vrt',
+        'other.index']
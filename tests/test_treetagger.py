@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""Tagging of files with treetagger.py."""
+
+import os
+import time
+import pytest
+import treetagger
+from conftest import FAKE, write_corpus, outputs
+
+
+TEXTS = {
+    'd{}'.format(i): 'Se cierra el debate {} .\nMuchas gracias , señor .'.format(
+        i) for i in range(8)}
+
+
+def test_jobs(run_script, tmp_path):
+    write_corpus(tmp_path / 'in', TEXTS)
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'a',
+               '-l', 'es', '-e', 'p')
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'b',
+               '-l', 'es', '-e', 'p', '-j', 3)
+    assert outputs(tmp_path / 'a') == outputs(tmp_path / 'b')
+
+
+def test_jobs_worker_dies(run_script, tmp_path, monkeypatch):
+    texts = dict(TEXTS, crash='Esto KABOOM rompe .')
+    write_corpus(tmp_path / 'in', texts)
+    monkeypatch.setenv('FAKE_TREETAGGER_CRASH', 'KABOOM')
+    output = run_script(
+        'treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'out',
+        '-l', 'es', '-e', 'p', '-j', 3)
+    assert sorted(outputs(tmp_path / 'out')) == sorted(
+        name + '.vrt' for name in TEXTS)
+    assert 'failed: {}'.format(tmp_path / 'in' / 'crash.xml') in output
+
+
+@pytest.mark.parametrize('options', [
+    ['--retries', 0], ['--retries', 1], ['--retries', 1, '-c', 'cache.db'],
+    ['--retries', 0, '--taggers', 2], ['--retries', 0, '-j', 2],
+    ['--retries', 0, '--readers', 1]])
+def test_timeout(run_script, tmp_path, monkeypatch, options):
+    texts = dict(TEXTS, hang='Esto FOREVER cuelga .')
+    write_corpus(tmp_path / 'in', texts)
+    monkeypatch.setenv('FAKE_TREETAGGER_HANG', 'FOREVER')
+    if '-c' in options:
+        options[-1] = tmp_path / options[-1]
+    start = time.time()
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'out',
+               '-l', 'es', '-e', 'p', '--timeout', 1, *options)
+    # every attempt of the stuck file waits for the timeout, no more
+    assert time.time() - start < (options[1] + 1) + 5
+    assert sorted(outputs(tmp_path / 'out')) == sorted(
+        name + '.vrt' for name in TEXTS)
+    with open(str(tmp_path / 'out' / '.treetagger.quarantine'),
+              encoding='utf-8') as qfile:
+        assert qfile.read() == 'hang.xml\ttimeout 1.0 s\n'
+
+
+def test_restart_tagger(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(FAKE)
+    tagger = treetagger.TagWithTreeTagger.__new__(
+        treetagger.TagWithTreeTagger)
+    vars(tagger).update(
+        sentence=False, tokenize=False, abbreviation=None, taggers=2,
+        cache_path=str(tmp_path / 'cache.db'), cache_size=100, models={},
+        pools={}, languages=set())
+    tagger.use_language('es')
+    first, cache = tagger.tagger, tagger.cache
+    cache.put({'Hola .': ['Hola\tNC\thola', '.\tFS\t.']})
+    cache.get(['Hola .'])
+    tagger.restart_tagger('es')
+    tagger.use_language('es')
+    # a new TreeTagger, the same cache with its pending use times
+    assert tagger.tagger is not first
+    assert tagger.tagger_pool.instances[0] is tagger.tagger
+    assert tagger.cache is cache and cache.used
+    tagger.tagger_pool.close()
+
+
+PROLOG = '''<?xml version="1.0" encoding="UTF-8"?>
+<?xml-stylesheet type="text/xsl" href="style.xsl"?>
+<!-- a comment before the root -->
+<text id="t">
+<p>
+Hola
+mundo
+</p>
+<!-- a comment between elements -->
+<p>
+Adiós
+</p>
+</text>
+<!-- a comment after the root -->
+'''
+
+
+def test_stream_prolog(run_script, tmp_path):
+    os.makedirs(str(tmp_path / 'in'))
+    with open(str(tmp_path / 'in' / 'prolog.xml'), mode='w',
+              encoding='utf-8') as ofile:
+        ofile.write(PROLOG)
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'a',
+               '-l', 'es', '-e', 'p')
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'b',
+               '-l', 'es', '-e', 'p', '--stream')
+    tagged = outputs(tmp_path / 'a')
+    assert '<?xml-stylesheet' in tagged['prolog.vrt']
+    assert outputs(tmp_path / 'b') == tagged
+
+
+def test_profile_names(run_script, tmp_path):
+    write_corpus(tmp_path / 'in' / 'a', {'d': 'uno dos'})
+    write_corpus(tmp_path / 'in' / 'b', {'d': 'tres'})
+    run_script('treetagger.py', '-i', tmp_path / 'in', '-o', tmp_path / 'out',
+               '-l', 'es', '-e', 'p', '-m', tmp_path / 'm.jsonl',
+               '--profile', 5)
+    assert sorted(os.listdir(str(tmp_path / 'm-profiles'))) == [
+        'a%2Fd.xml.prof', 'b%2Fd.xml.prof']
+
+
+def test_language_directories(run_script, tmp_path):
+    write_corpus(tmp_path / 'in' / 'es', {'d0': 'Se cierra el debate .'})
+    write_corpus(tmp_path / 'in' / 'en', {'d0': 'The debate is closed .'})
+    options = ['-i', tmp_path / 'in', '-o', tmp_path / 'out', '-e', 'p',
+               '--language_from', 'path:0', '-u']
+    run_script('treetagger.py', *options)
+    es = outputs(tmp_path / 'out' / 'es')['d0.vrt']
+    en = outputs(tmp_path / 'out' / 'en')['d0.vrt']
+    assert 'debate\t' in es and 'closed\t' in en
+    assert '0 files in' in run_script('treetagger.py', *options)
+    assert outputs(tmp_path / 'out' / 'es')['d0.vrt'] == es
+
+
+# several sentences per element, repeated ones (cache hits), a token line
+# looking like a tag that isn't XML (tagged again as tokens) and one that is
+MIXED = '''<?xml version="1.0" encoding="UTF-8"?>
+<text>
+<p>
+Se
+cierra
+el
+debate
+{0}
+.
+Muchas
+gracias
+!
+</p>
+<p>
+La
+sesión
+&lt;queda abierta &gt;
+a
+las
+{0}
+.
+¿
+Hay
+&lt;br/&gt;
+objeciones
+?
+</p>
+<p>
+Muchas
+gracias
+!
+</p>
+</text>
+'''
+
+
+@pytest.mark.parametrize('plain,options', [
+    ([], ['--readers', 2]),
+    ([], ['--taggers', 3]),
+    ([], ['-j', 2]),
+    (['-s'], ['-b', 40]),
+    (['-s'], ['-b', 100000]),
+    (['-s'], ['-c', 'cache.db']),
+    (['-s'], ['--readers', 2]),
+    (['-s'], ['--taggers', 3]),
+    (['-s'], ['-b', 60, '--taggers', 2, '-c', 'cache.db']),
+    (['-s', '--tokenize'], ['-b', 60, '--readers', 2]),
+    (['-s'], ['-j', 2, '-b', 60])])
+def test_same_output(run_script, tmp_path, punkt, plain, options):
+    os.makedirs(str(tmp_path / 'in'))
+    for i in range(4):
+        with open(str(tmp_path / 'in' / 'm{}.xml'.format(i)), mode='w',
+                  encoding='utf-8') as ofile:
+            ofile.write(MIXED.format(i))
+    common = ['-i', tmp_path / 'in', '-l', 'es', '-e', 'p'] + plain
+    run_script('treetagger.py', '-o', tmp_path / 'plain', *common)
+    expected = outputs(tmp_path / 'plain')
+    assert len(expected) == 4
+    options = [tmp_path / o if o == 'cache.db' else o for o in options]
+    for run in ['first', 'second']:  # the second one finds the cache full
+        run_script('treetagger.py', '-o', tmp_path / run, *(common + options))
+        assert outputs(tmp_path / run) == expected
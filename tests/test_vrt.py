@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""VRT serialization against the regex passes it replaced."""
+
+import io
+import re
+import random
+import pytest
+from lxml import etree
+import vrt
+
+
+def tagger_unprettify(tree):
+    """unprettify of treetagger.py before vrt.write."""
+    tree = etree.tostring(
+        tree,
+        encoding="utf-8",
+        method="xml",
+        xml_declaration=True).decode()
+    tree = re.sub(r"(\n) +(<)", r"\1\2", tree)
+    tree = re.sub(r"> *<", r">\n<", tree)
+    tree = re.sub(r"(<.+?>)", r"\1\n", tree)
+    tree = re.sub(r"(</.+?>)", r"\n\1", tree)
+    tree = re.sub(r"(>)([^.])", r"\1\n\2", tree)
+    tree = re.sub(r"\n\n+", r"\n", tree)
+    return tree
+
+
+def post_unprettify(tree):
+    """unprettify of post_treetagger.py before vrt.write."""
+    tree = etree.tostring(
+        tree,
+        encoding="UTF-8",
+        method="xml",
+        xml_declaration=True).decode(encoding='UTF-8')
+    tree = re.sub(r"(\n) +(<)", r"\1\2", tree)
+    tree = re.sub(r"> *<", r">\n<", tree)
+    tree = re.sub(r"(>)([^.])", r"\1\n\2", tree)
+    tree = re.sub(r"\n\n+", r"\n", tree)
+    return tree
+
+
+LAYOUTS = [
+    pytest.param(True, 'utf-8', tagger_unprettify, id='treetagger'),
+    pytest.param(False, 'UTF-8', post_unprettify, id='post')]
+
+
+def written(tree, break_tags, encoding):
+    output = io.StringIO()
+    vrt.write(tree, output, break_tags, encoding)
+    return output.getvalue()
+
+
+DOCUMENTS = {
+    'tokens': '<text id="t1"><p>\nSe\tVLfin\tser\ncierra\tVLfin\tcerrar\n'
+              '.\tFS\t.\n</p></text>',
+    'tail': '<text><p>uno</p> dos <p>tres</p>\ncuatro\n</text>',
+    'empty': '<text><p/><p></p><p> </p><head n="1"/>\n  <p>x</p></text>',
+    'period': '<text><s>a</s>.<s>b</s>. c<s/>.</text>',
+    'indented': '<text>\n  <p>\n    a b\n  </p>\n  <p>c</p>\n</text>',
+    'escaped': '<text a="1 &amp; 2 &lt; &quot;3&quot;&#10;&#9;">'
+               '&lt;a&gt; &amp; b&#13;</text>',
+    'comments': '<!-- before --><text><!-- in --><p>a</p>b<!--x-->'
+                '</text><!-- after -->',
+    'unicode': '<text><p>ñandú «citas» – €</p></text>'}
+# trees written by split_lines instead of the tree walk
+FALLBACK = {
+    'namespace': '<text xmlns:x="urn:x"><x:p x:id="1">a</x:p></text>',
+    'pi': '<?xml-stylesheet href="a.css"?><text><?p i?><p>a</p></text>',
+    'comment': '<text><!-- <p>\n</p> --><p>a</p></text>',
+    'doctype': '<!DOCTYPE text><text><p>a</p></text>',
+    'dtd': '<!DOCTYPE text [<!ENTITY e "x">]><text><p>&e;</p></text>'}
+
+
+@pytest.mark.parametrize('break_tags,encoding,unprettify', LAYOUTS)
+@pytest.mark.parametrize('name', sorted(DOCUMENTS) + sorted(FALLBACK))
+def test_tree(name, break_tags, encoding, unprettify):
+    xml = DOCUMENTS.get(name) or FALLBACK[name]
+    tree = etree.parse(io.BytesIO(xml.encode('utf-8')))
+    assert written(tree, break_tags, encoding) == unprettify(tree)
+
+
+@pytest.mark.parametrize('break_tags,encoding,unprettify', LAYOUTS)
+@pytest.mark.parametrize('name', sorted(DOCUMENTS) + sorted(FALLBACK))
+def test_element(name, break_tags, encoding, unprettify):
+    xml = DOCUMENTS.get(name) or FALLBACK[name]
+    root = etree.parse(io.BytesIO(xml.encode('utf-8'))).getroot()
+    for element in root.iter(tag=etree.Element):
+        element.tail = ' y .\n'  # written after the element
+        assert written(element, break_tags, encoding) == unprettify(element)
+
+
+def test_fallback():
+    for xml in FALLBACK.values():
+        tree = etree.parse(io.BytesIO(xml.encode('utf-8')))
+        assert (tree.docinfo.internalDTD is not None or
+                vrt.IRREGULAR(tree))
+    for xml in DOCUMENTS.values():
+        tree = etree.parse(io.BytesIO(xml.encode('utf-8')))
+        assert tree.docinfo.internalDTD is None
+        assert not vrt.IRREGULAR(tree)
+
+
+def random_tree(rng):
+    """Build a tree with mixed content, attributes, comments and tails."""
+    words = ['a', 'b c', '.', '. d', ' ', '\n', '  e\n', '\n  ', 'f<g',
+             'h & i', '', None]
+
+    def fill(element, depth):
+        element.text = rng.choice(words)
+        if rng.random() < 0.5:
+            element.set('n', rng.choice(words[:-1]))
+        for i in range(rng.randint(0, 4 if depth < 4 else 0)):
+            if rng.random() < 0.1:
+                child = etree.Comment(rng.choice(['x', ' y ', '']))
+                element.append(child)
+            else:
+                child = etree.SubElement(element, rng.choice(['p', 's']))
+                fill(child, depth + 1)
+            child.tail = rng.choice(words)
+    root = etree.Element('text')
+    fill(root, 0)
+    return root.getroottree()
+
+
+@pytest.mark.parametrize('break_tags,encoding,unprettify', LAYOUTS)
+def test_random(break_tags, encoding, unprettify):
+    rng = random.Random(0)
+    for i in range(300):
+        tree = random_tree(rng)
+        assert written(tree, break_tags, encoding) == unprettify(tree)
+        element = tree.getroot()[0] if len(tree.getroot()) else None
+        if element is not None and isinstance(element.tag, str):
+            assert (written(element, break_tags, encoding) ==
+                    unprettify(element))
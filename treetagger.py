@@ -2,60 +2,362 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
 import argparse
+import contextlib
 from lxml import etree
-import fnmatch
-import time
-import nltk
-import mytreetaggerwrapper as ttw
 import html
 import re
+import sys
+import traceback
+import collections
+import socket
+import json
+import pickle
+import hashlib
+import threading
+import vrt
+import compression
+from manifest import Manifest, atomic_open, fingerprint
+from metrics import Metrics
+from stages import StagedLoop, InstancePool
+from shards import ShardWriter, source_id
+from columns import ColumnWriter, Tee
+# nltk, mytreetaggerwrapper, concurrent.futures and cache (sqlite3) are
+# imported when the options need them, to keep startup fast
 
 
-def timeit(method):
-    """Time methods."""
-    def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
+LANGUAGES = ['en', 'es', 'de']
+LANGUAGE_SOURCES = ['attribute', 'path', 'map']
+BOUNDARY = '<ttg_batch_boundary/>'
+# classification of TreeTagger output lines in escape
+PSEUDO_TAG = re.compile(r'<.+ >$')
+TAG = re.compile(r'<.+>$')
+REP = re.compile(r'<rep(.+?) text="(.+)"')
+ARROW = re.compile(r'[<>]\t')
+ORDERS = ['directory', 'largest']
+worker = None
 
-        print('%r %2.2f sec' %
-              (method.__name__, te-ts))
-        return result
 
-    return timed
+class FileTimeout(Exception):
+    """Raised when tagging a file takes longer than --timeout."""
+
+
+def check_languages(parser, args):
+    """Check that -l or a valid --language_from is provided.
+
+    Keyword arguments:
+    parser -- the argparse.ArgumentParser reporting errors.
+    args -- argparse.Namespace with the parsed options.
+    """
+    if args.language is None and args.language_from is None:
+        parser.error("-l is required unless --language_from is provided")
+    if args.language_from is not None:
+        source, _, key = args.language_from.partition(':')
+        if (source not in LANGUAGE_SOURCES or not key or
+                (source == 'path' and not key.isdigit())):
+            parser.error("--language_from must be 'attribute:NAME', 'path:N'"
+                         " or 'map:FILE'")
+
+
+def check_stages(parser, args):
+    """Check that --readers is only combined with options it supports.
+
+    Keyword arguments:
+    parser -- the argparse.ArgumentParser reporting errors.
+    args -- argparse.Namespace with the parsed options.
+    """
+    if args.readers and (args.jobs > 1 or args.stream or args.profile):
+        parser.error("--readers can't be combined with -j, --stream or"
+                     " --profile")
+
+
+def init_worker(tagger):
+    """Load the models of a TagWithTreeTagger once per worker process.
+
+    Keyword arguments:
+    tagger -- a configured TagWithTreeTagger without tokenizer and tagger.
+    """
+    global worker
+    # the copy a spawned process gets, also when the pool forks: without
+    # the manifest, shards and columns of the main process
+    worker = pickle.loads(pickle.dumps(tagger))
+    worker.models = {}
+    worker.pools = {}
+    worker.expired = threading.Event()
+    if worker.language is not None:
+        worker.use_language(worker.language)
+
+
+def tag_file(infile):
+    """Tag a file in a worker process, reporting any failure.
+
+    Return the path, the traceback of the error if any, the hits and
+    misses of the cache, the metrics record and profile of the file, and
+    the documents to be appended to the shards with --concatenate or to
+    the columns with --columns.
+
+    Keyword arguments:
+    infile -- a string for the path to the file to be tagged.
+    """
+    error = None
+    worker.metrics.start(infile)
+    try:
+        worker.use_language(worker.file_language(infile))
+        worker.metrics.set('language', worker.language)
+        worker.retrying(infile, lambda: worker.process_file(infile))
+    except Exception:
+        error = traceback.format_exc()
+        # the TreeTagger pipe may be unusable after an error
+        try:
+            worker.restart_tagger(worker.language)
+        except Exception:
+            pass  # the models are loaded again for the next file anyway
+    record = worker.metrics.stop(error is not None)
+    documents = list(worker.documents)
+    del worker.documents[:]
+    return infile, error, worker.cache_usage(), record, documents
+
+
+def scan_files(directory, fileclue):
+    """Yield the DirEntry of every file matching a pattern in a directory.
+
+    Files come in the order of os.walk: the ones of a directory, then the
+    ones of each subdirectory (symbolic links to directories are not
+    followed).
+
+    Keyword arguments:
+    directory -- a string for the directory path
+    fileclue -- a string as glob pattern
+    """
+    try:
+        with os.scandir(directory) as scan:
+            entries = list(scan)
+    except OSError:
+        return
+    directories = []
+    files = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if not entry.is_symlink():
+                directories.append(entry)
+        else:
+            files.append(entry)
+    matching = set(compression.filter_files([e.name for e in files], fileclue))
+    for entry in files:
+        if entry.name in matching:
+            yield entry
+    for entry in directories:
+        yield from scan_files(entry.path, fileclue)
+
+
+def kill_tagger(tagger):
+    """Kill the processes of a TreeTagger instance, closing its pipes.
+
+    Keyword arguments:
+    tagger -- a TreeTagger instance.
+    """
+    import subprocess
+    for value in list(vars(tagger).values()):
+        if isinstance(value, subprocess.Popen):
+            try:
+                value.kill()
+            except OSError:
+                pass  # already gone
+
+
+def call_tagger(tagger, text, tokenize):
+    """Tag text with a TreeTagger instance.
+
+    Keyword arguments:
+    tagger -- a TreeTagger instance.
+    text -- a string with the text to be tagged.
+    tokenize -- True to tokenize the text.
+    """
+    if tokenize:
+        return tagger.tag_text(
+            text,
+            notagdns=True,
+            notagip=True,
+            notagurl=True,
+            notagemail=True)
+    return tagger.tag_text(
+        text,
+        notagdns=True,
+        notagip=True,
+        notagurl=True,
+        notagemail=True,
+        tagonly=True)
+
+
+def document_head(root):
+    """Serialize what precedes the root element of a document.
+
+    Keyword arguments:
+    root -- the root Element of the document being parsed.
+    """
+    head = [vrt.XML_DECLARATION.format('utf-8'), '\n']
+    doctype = root.getroottree().docinfo.doctype
+    if doctype:
+        head.append(doctype + '\n')
+    for sibling in reversed(list(root.itersiblings(preceding=True))):
+        head.append(etree.tostring(
+            sibling, encoding='utf-8', with_tail=False).decode())
+    return ''.join(head)
+
+
+def start_and_end_tags(element):
+    """Serialize the start tag, with text, and the end tag of an Element.
+
+    Keyword arguments:
+    element -- the Element whose tags have to be serialized.
+    """
+    shallow = etree.Element(element.tag, element.attrib, nsmap=element.nsmap)
+    shallow.text = element.text or ''
+    shallow = etree.tostring(shallow, encoding='utf-8').decode()
+    split = shallow.rindex('</')
+    return shallow[:split], shallow[split:]
+
+
+def tail_string(element):
+    """Serialize the tail of an Element.
+
+    Keyword arguments:
+    element -- the Element whose tail has to be serialized.
+    """
+    if not element.tail:
+        return ''
+    dummy = etree.Element('dummy')
+    dummy.tail = element.tail
+    return etree.tostring(dummy, encoding='utf-8').decode()[len('<dummy/>'):]
+
+
+class StreamWriter(object):
+    """Write a serialized tree piece by piece, one tag or token per line.
+
+    Pieces are buffered until the buffer can be cut between two tags, so
+    that the output is the same as splitting the whole document at once.
+    """
+
+    def __init__(self, ofile):
+        self.ofile = ofile
+        self.buffer = []
+        self.newline = None
+
+    def write(self, piece):
+        if not piece:
+            return
+        if (piece.startswith('<') and self.buffer and
+                self.buffer[-1].endswith('>')):
+            self.flush()
+        self.buffer.append(piece)
+
+    def flush(self):
+        text = vrt.split_lines(''.join(self.buffer))
+        self.buffer = []
+        if self.newline is not None:
+            # the whole document has a single line break between two tags
+            text = text.lstrip('\n')
+            if not self.newline:
+                text = '\n' + text
+        if text:
+            self.ofile.write(text)
+            self.newline = text.endswith('\n')
 
 
 class TagWithTreeTagger(object):
     """Tag text with TreeTagger."""
 
-    @timeit
     def __init__(self):
         self.cli()
+        if self.server is not None:
+            self.main_client()
+        else:
+            self.run()
+            print(self.metrics.summary())
+
+    def run(self):
+        """Tag the files selected by the options."""
+        self.metrics = self.init_metrics()
         self.infiles = self.get_files(self.indir, self.pattern)
+        self.manifest = self.init_manifest()
+        if self.manifest is not None:
+            quarantined = self.read_quarantine()
+            self.infiles = self.manifest.pending(
+                [f for f in self.infiles if f not in quarantined])
         self.counter = 0
-        self.tokenizer = self.init_tokenizer()
-        self.tagger = self.init_tagger()
-        self.main()
+        self.hits = 0
+        self.misses = 0
+        self.languages = set()
+        self.stages = None
+        self.documents = []  # waiting to be appended to shards and columns
+        self.shards = self.init_shards()
+        self.column_store = self.init_columns()
+        try:
+            if self.jobs > 1:
+                self.main_parallel()
+            elif self.readers:
+                self.models = {}
+                self.pools = {}
+                self.main_staged()
+            else:
+                self.models = {}  # loaded by use_language for the first file
+                self.pools = {}  # language: InstancePool with --taggers
+                self.main()
+        finally:
+            for pool in getattr(self, 'pools', {}).values():
+                pool.close()
+            if self.shards is not None:
+                self.shards.close()
+            if self.column_store is not None:
+                self.column_store.close()
+        self.metrics.close()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['manifest'] = None  # only the main process records files
+        state['shards'] = None  # and writes the shards
+        state['column_store'] = None  # and the columns
+        state['pools'] = {}  # threads can't be sent to another process
+        state['expired'] = None
+        return state
 
     def __str__(self):
         message = "{} files in '{}' tagged!".format(
             str(self.counter),
-            self.language)
+            "', '".join(sorted(self.languages)) or self.language)
+        if self.cache_path is not None:
+            message += "\ncache: {} hits, {} misses".format(
+                self.hits, self.misses)
+        if self.stages is not None:
+            message += "\n" + self.stages
+        for language, pool in sorted(getattr(self, 'pools', {}).items()):
+            message += "\ntaggers ({}): {}".format(language, pool.report())
+        files = ''
+        if hasattr(self, 'metrics'):  # not in the client of a server
+            files = self.metrics.files_summary()
+        if files:
+            message += "\n" + files
         return message
 
     def get_files(self, directory, fileclue):
         """Get all files in a directory matching a pattern.
 
+        With --order largest, the largest files come first, so that the
+        last ones to be tagged are small.
+
         Keyword arguments:
         directory -- a string for the input folder path
         fileclue -- a string as glob pattern
         """
-        matches = []
-        for root, dirnames, filenames in os.walk(directory):
-            for filename in fnmatch.filter(filenames, fileclue):
-                matches.append(os.path.join(root, filename))
-        return matches
+        entries = list(scan_files(directory, fileclue))
+        if self.order == 'largest':
+            entries.sort(key=lambda entry: -entry.stat().st_size)
+        return [entry.path for entry in entries]
 
     def read_xml(self, infile):
         """Parse a XML file.
@@ -64,41 +366,9 @@ class TagWithTreeTagger(object):
         infile -- a string for the path to the file to be read.
         """
         parser = etree.XMLParser(remove_blank_text=True)
-        with open(infile, encoding='utf-8', mode='r') as input:
-            return etree.parse(input, parser)
-
-    def unprettify(self, tree):
-        """Remove any indentation introduced by pretty print."""
-        tree = etree.tostring(  # convert XML tree to string
-            tree,
-            encoding="utf-8",
-            method="xml",
-            xml_declaration=True).decode()
-        tree = re.sub(  # remove trailing spaces before tag
-            r"(\n) +(<)",
-            r"\1\2",
-            tree)
-        tree = re.sub(  # put each XML element in a different line
-            r"> *<",
-            r">\n<",
-            tree)
-        tree = re.sub(  # put opening tag and FL output in different lines
-            r"(<.+?>)",
-            r"\1\n",
-            tree)
-        tree = re.sub(  # put FL output and closing tag in different liens
-            r"(</.+?>)",
-            r"\n\1",
-            tree)
-        tree = re.sub(
-            r"(>)([^.])",
-            r"\1\n\2",
-            tree)
-        tree = re.sub(  # remove unnecessary empty lines
-            r"\n\n+",
-            r"\n",
-            tree)
-        return tree
+        with self.metrics.phase('read'):
+            with compression.open_file(infile) as input:
+                return etree.parse(input, parser)
 
     def serialize(self, infile, root):
         """Serialize Element as XML file.
@@ -107,13 +377,156 @@ class TagWithTreeTagger(object):
         infile -- a string for the path to the input file processed.
         root -- Element to be serialized as XML.
         """
-        ofile_name = os.path.splitext(os.path.basename(infile))[0]
-        ofile_path = os.path.join(self.outdir, ofile_name+'.vrt')
-        xml = self.unprettify(root)
-        with open(ofile_path, mode='w', encoding='utf-8') as ofile:
-            ofile.write(xml)
+        with self.metrics.phase('write'):
+            with self.open_output(infile) as ofile:
+                vrt.write(root, ofile)
         pass
 
+    @contextlib.contextmanager
+    def open_output(self, infile):
+        """Open the VRT output of a file for writing.
+
+        With --concatenate, the document is kept in self.documents to be
+        appended to the shards by the main process. With --columns, its
+        tokens are appended to the columns as it is written, or read back
+        from the file by the main process if this is a worker.
+
+        Keyword arguments:
+        infile -- a string for the path to the input file processed.
+        """
+        source = source_id(infile, self.indir)
+        if self.concatenate is None:
+            outpath = self.output_path(infile)
+            document = None
+            if self.column_store is not None:
+                document = self.column_store.document(source)
+            try:
+                with atomic_open(outpath) as ofile:
+                    if document is not None:
+                        ofile = Tee(ofile, document)
+                    yield ofile
+            except BaseException:
+                if document is not None:
+                    document.abort()
+                raise
+            if document is not None:
+                document.close()
+            elif self.columns is not None:
+                self.documents.append((source, None, outpath))
+            self.metrics.count('bytes_out', os.path.getsize(outpath))
+        else:
+            ofile = io.StringIO()
+            yield ofile
+            text = ofile.getvalue()
+            self.documents.append((source, text, None))
+            self.metrics.count('bytes_out', len(text.encode('utf-8')))
+
+    def init_shards(self):
+        """Create the ShardWriter of the run if --concatenate is provided."""
+        if self.concatenate is None:
+            return None
+        return ShardWriter(
+            self.outdir,
+            self.concatenate,
+            self.shard_size * 1024 * 1024,
+            self.compress)
+
+    def init_columns(self):
+        """Create the ColumnWriter of the run if --columns is provided."""
+        if self.columns is None:
+            return None
+        return ColumnWriter(self.outdir, self.columns, self.boundary())
+
+    def boundary(self):
+        """Get the name of the elements holding a sentence in the output."""
+        if self.sentence:
+            return 's'
+        return self.element
+
+    def flush_documents(self):
+        """Append the documents kept by open_output to shards and columns."""
+        for source, text, path in self.documents:
+            if self.shards is not None:
+                self.shards.add(source, text)
+            if self.column_store is not None:
+                if text is None:
+                    self.column_store.add_file(source, path)
+                else:
+                    self.column_store.add(source, text)
+        del self.documents[:]
+
+    def output_path(self, infile):
+        """Get the path of the VRT file for an input file.
+
+        Keyword arguments:
+        infile -- a string for the path to the input file processed.
+        """
+        # the subdirectories of the input directory are kept, so files with
+        # the same name in different ones don't overwrite each other
+        ofile_name = os.path.splitext(
+            compression.strip(os.path.relpath(infile, self.indir)))[0]
+        return os.path.join(
+            self.outdir, ofile_name+'.vrt'+compression.suffix(self.compress))
+
+    def config(self):
+        """Get the options and code versions the output depends on."""
+        config = {
+            'language': self.default_language,
+            'language_from': self.language_from,
+            'language_map': None,
+            'element': self.element,
+            'is_root': self.is_root,
+            'sentence': self.sentence,
+            'tokenize': self.tokenize,
+            'abbreviation': None,
+            'compress': self.compress,
+            'version': fingerprint([__file__, vrt.__file__])}
+        if self.abbreviation is not None:
+            config['abbreviation'] = fingerprint([self.abbreviation])
+        if self.language_from == 'map':
+            config['language_map'] = fingerprint([self.language_key])
+        return config
+
+    def quarantine_path(self):
+        return os.path.join(self.outdir, '.treetagger.quarantine')
+
+    def read_quarantine(self):
+        """Get the paths of the files put in quarantine by previous runs."""
+        quarantined = set()
+        if os.path.exists(self.quarantine_path()):
+            with open(self.quarantine_path(), mode='r',
+                      encoding='utf-8') as qfile:
+                for line in qfile:
+                    quarantined.add(os.path.join(
+                        self.indir, line.rstrip('\n').split('\t')[0]))
+        return quarantined
+
+    def quarantine(self, infile):
+        """Record a file that timed out in every attempt.
+
+        Runs with -u skip the files in quarantine until their line is
+        removed from .treetagger.quarantine in the output directory.
+
+        Keyword arguments:
+        infile -- a string for the path to the file.
+        """
+        print("{} timed out, put in quarantine".format(infile),
+              file=sys.stderr)
+        with open(self.quarantine_path(), mode='a', encoding='utf-8') as qfile:
+            qfile.write('{}\ttimeout {} s\n'.format(
+                os.path.relpath(infile, self.indir), self.timeout))
+        pass
+
+    def init_manifest(self):
+        """Load the manifest of the output directory if -u is provided."""
+        if not self.incremental:
+            return None
+        return Manifest(
+            os.path.join(self.outdir, '.treetagger.manifest'),
+            self.indir,
+            self.config(),
+            self.output_path)
+
     def process_abbreviations(self):
         """Convert TTG abbreviations to NLTK tokenizer._params.abbrev_types."""
         with open(self.abbreviation, mode='r', encoding='utf-8') as afile:
@@ -125,17 +538,59 @@ class TagWithTreeTagger(object):
         return abbreviations
 
     def init_tokenizer(self):
-        """Instantiate a tokenizer suitable for the language at stake."""
+        """Instantiate a tokenizer suitable for the language at stake.
+
+        The Punkt model with the abbreviations of -a is kept as a pickle
+        named after the fingerprint of its sources in the user's cache
+        directory, so that later runs only have to unpickle it.
+        """
+        artifact = self.tokenizer_artifact()
+        if os.path.exists(artifact):
+            try:
+                with open(artifact, mode='rb') as afile:
+                    return pickle.load(afile)
+            except Exception:
+                pass  # unreadable, built again below
+        import nltk
         lang = {'en': 'english', 'de': 'german', 'es': 'spanish'}
         tokenizer = nltk.data.load(
             'tokenizers/punkt/{}.pickle'.format(lang[self.language]))
         if self.abbreviation is not None:
             extra_abbreviations = self.process_abbreviations()
             tokenizer._params.abbrev_types.update(extra_abbreviations)
+        try:
+            directory = os.path.dirname(artifact)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with atomic_open(artifact, mode='wb', encoding=None) as afile:
+                pickle.dump(tokenizer, afile, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass  # the cache directory is not writable
         return tokenizer
 
+    def tokenizer_artifact(self):
+        """Get the path of the prebuilt tokenizer for the current options.
+
+        Its name is a fingerprint of the language, the version of nltk,
+        the NLTK_DATA directories and the content of the abbreviation file.
+        """
+        try:
+            from importlib.metadata import version
+            nltk_version = version('nltk')
+        except Exception:
+            nltk_version = None
+        sources = [self.language, nltk_version, os.environ.get('NLTK_DATA')]
+        if self.abbreviation is not None:
+            sources.append(fingerprint([self.abbreviation]))
+        key = hashlib.sha1(repr(sources).encode('utf-8')).hexdigest()
+        directory = os.environ.get(
+            'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(
+            directory, 'ttg', 'punkt-{}-{}.pickle'.format(self.language, key))
+
     def init_tagger(self):
         """Instantiate a TreeTagger tagger for the language at stake."""
+        import mytreetaggerwrapper as ttw
         if self.abbreviation is not None:
             tagger = ttw.TreeTagger(
                 TAGLANG=self.language,
@@ -144,6 +599,186 @@ class TagWithTreeTagger(object):
             tagger = ttw.TreeTagger(TAGLANG=self.language)
         return tagger
 
+    def file_language(self, infile):
+        """Get the language of a file from --language_from, or -l.
+
+        Keyword arguments:
+        infile -- a string for the path to the file to be tagged.
+        """
+        language = None
+        if self.language_from == 'attribute':
+            key = re.sub(r'^xml:', '{http://www.w3.org/XML/1998/namespace}',
+                         self.language_key)
+            with compression.open_file(infile, 'rb', None) as ifile:
+                for event, root in etree.iterparse(ifile, events=('start',)):
+                    language = root.get(key)
+                    break
+        elif self.language_from == 'path':
+            segments = os.path.relpath(infile, self.indir).split(os.sep)
+            if len(segments) > int(self.language_key):
+                language = segments[int(self.language_key)]
+        elif self.language_from == 'map':
+            language = self.language_map.get(
+                os.path.relpath(infile, self.indir),
+                self.language_map.get(os.path.basename(infile)))
+        if language is not None:
+            language = re.split(r'[-_]', language.strip().lower())[0]
+        if language not in LANGUAGES:
+            language = self.default_language
+        if language is None:
+            raise ValueError("no language found for {}".format(infile))
+        return language
+
+    def use_language(self, language):
+        """Switch to the models of a language, loading them if needed.
+
+        Keyword arguments:
+        language -- one of 'en', 'es' or 'de'.
+        """
+        self.language = language
+        if language not in self.models:
+            self.models[language] = (
+                self.init_tokenizer() if self.sentence else None,
+                None,
+                self.init_cache())
+        self.tokenizer, self.tagger, self.cache = self.models[language]
+        if self.tagger is None:  # not loaded yet, or restarted
+            self.tagger = self.init_tagger()
+            self.models[language] = (self.tokenizer, self.tagger, self.cache)
+            if self.taggers > 1:
+                self.pools[language] = InstancePool(
+                    [self.tagger] +
+                    [self.init_tagger() for i in range(self.taggers - 1)],
+                    'tagger')
+        self.tagger_pool = self.pools.get(language)
+        self.languages.add(language)
+
+    def restart_tagger(self, language):
+        """Kill the TreeTagger instances of a language, started when used.
+
+        The tokenizer and the cache are kept, with the use times the cache
+        hasn't written yet.
+
+        Keyword arguments:
+        language -- one of 'en', 'es' or 'de'.
+        """
+        if language in self.models:
+            tokenizer, tagger, cache = self.models[language]
+            self.models[language] = (tokenizer, None, cache)
+            if tagger is not None:
+                kill_tagger(tagger)
+        pool = self.pools.pop(language, None)
+        if pool is not None:
+            pool.close(wait=False)
+            for tagger in pool.instances:
+                kill_tagger(tagger)
+        pass
+
+    @contextlib.contextmanager
+    def watchdog(self, infile):
+        """Kill the TreeTagger instances if a file takes too long.
+
+        After --timeout seconds, the instances of the language are killed,
+        which makes the TreeTagger call waiting for them fail, and
+        FileTimeout is raised once the instances have been dropped.
+
+        Keyword arguments:
+        infile -- a string for the path to the file being tagged.
+        """
+        if not self.timeout:
+            yield
+            return
+        language = self.language
+        taggers = [self.tagger]
+        if self.tagger_pool is not None:
+            taggers = self.tagger_pool.instances
+
+        def expire():
+            self.expired.set()
+            for tagger in taggers:
+                kill_tagger(tagger)
+        self.expired.clear()
+        timer = threading.Timer(self.timeout, expire)
+        timer.daemon = True
+        timer.start()
+        timed_out = False
+        try:
+            yield
+        except Exception:
+            if not self.expired.is_set():
+                raise
+            timed_out = True
+        finally:
+            timer.cancel()
+        if self.expired.is_set():
+            # killed when the file was done, if not timed_out
+            self.restart_tagger(language)
+        if timed_out:
+            raise FileTimeout("{} took more than {} s".format(
+                infile, self.timeout))
+
+    def retrying(self, infile, attempt):
+        """Tag a file, again with new TreeTagger instances after a timeout.
+
+        FileTimeout is raised if the last of the --retries attempts times
+        out as well.
+
+        Keyword arguments:
+        infile -- a string for the path to the file being tagged.
+        attempt -- a function tagging the file, return what it returns.
+        """
+        language = self.language
+        for i in range(self.retries + 1):
+            try:
+                with self.watchdog(infile):
+                    return attempt()
+            except FileTimeout:
+                self.metrics.count('timeouts')
+                if i == self.retries:
+                    self.metrics.set('timeout', True)
+                    raise
+                self.use_language(language)
+
+    def read_language_map(self, path):
+        """Read a file with a path or file name and a language per line.
+
+        Keyword arguments:
+        path -- a string for the path to the mapping file.
+        """
+        language_map = {}
+        with open(path, mode='r', encoding='utf-8') as mfile:
+            for line in mfile:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    infile, language = line.rsplit(None, 1)
+                    language_map[os.path.normpath(infile)] = language
+        return language_map
+
+    def init_metrics(self):
+        """Create the Metrics of the run, written to -m if provided."""
+        return Metrics(self.metrics_path, self.profile, self.indir)
+
+    def init_cache(self):
+        """Open the cache of tagged sentences if -c is provided."""
+        if self.cache_path is None:
+            return None
+        namespace = [self.language, 'tokenize' if self.tokenize else 'tagonly']
+        if self.abbreviation is not None:
+            namespace.append(fingerprint([self.abbreviation]))
+        from cache import TagCache
+        return TagCache(self.cache_path, ' '.join(namespace), self.cache_size)
+
+    def cache_usage(self):
+        """Return cache hits and misses since the last call."""
+        hits = 0
+        misses = 0
+        for tokenizer, tagger, cache in self.models.values():
+            if cache is not None:
+                usage = cache.usage()
+                hits += usage[0]
+                misses += usage[1]
+        return hits, misses
+
     def get_sentences(self, element):
         """Split element's text in sentences.
 
@@ -151,173 +786,640 @@ class TagWithTreeTagger(object):
         element -- Element whose text has to be split.
         """
         text = element.text
-        sentences = self.tokenizer.tokenize(text)
+        with self.metrics.phase('split'):
+            sentences = self.tokenizer.tokenize(text)
         element.text = None
         return sentences
 
     def escape(self, tags):
-        output = []
-        for tag in tags:
-            if re.match(r'<.+ >$', tag):
-                try:
-                    etree.fromstring(tag)
-                    output.append(tag)
-                except:
-                    tag = re.sub(r'(<)(.+) (>)', r'\1\n\2\n\3', tag)
-                    tag = self.tagger.tag_text(
-                        tag,
-                        notagdns=True,
-                        notagip=True,
-                        notagurl=True,
-                        notagemail=True,
-                        tagonly=True)
-                    tag = [html.escape(t) for t in tag]
-                    output += tag
-            elif not re.match(r'<.+>$', tag):
-                output.append(html.escape(tag))
-            else:
-                test = re.match(r'<rep(.+?) text="(.+)"', tag)
-                if test is not None:
-                    output.append('<rep{} text="{}"/>'.format(
-                        test.group(1), html.escape(test.group(2))))
+        """Escape TreeTagger output lines that are not well formed XML.
+
+        Lines looking like a tag that can't be parsed are tagged again as
+        tokens, all of them with a single TreeTagger call.
+
+        Keyword arguments:
+        tags -- a list of TreeTagger output lines.
+        """
+        with self.metrics.phase('escape'):
+            output = []
+            retag = []  # positions in output and text to be tagged again
+            for tag in tags:
+                if tag[:1] != '<':
+                    output.append(html.escape(tag))
+                elif PSEUDO_TAG.match(tag):
+                    try:
+                        etree.fromstring(tag)
+                        output.append(tag)
+                    except Exception:
+                        # same as re.sub(r'(<)(.+) (>)', r'\1\n\2\n\3', tag)
+                        retag.append((len(output), '<\n{}\n>'.format(
+                            tag[1:-2])))
+                        output.append(None)
+                elif not TAG.match(tag):
+                    output.append(html.escape(tag))
                 else:
-                    if re.match(r'[<>]\t', tag):
+                    test = REP.match(tag)
+                    if test is not None:
+                        output.append('<rep{} text="{}"/>'.format(
+                            test.group(1), html.escape(test.group(2))))
+                    elif ARROW.match(tag):
                         output.append(html.escape(tag))
                     else:
                         output.append(tag)
-        return output
+        if not retag:
+            return output
+        tagged = self.tag_batch([text for i, text in retag], tokenize=False)
+        with self.metrics.phase('escape'):
+            for (i, text), lines in zip(retag, tagged):
+                output[i] = [html.escape(t) for t in lines]
+            escaped = []
+            for tag in output:
+                if isinstance(tag, list):
+                    escaped += tag
+                else:
+                    escaped.append(tag)
+            return escaped
 
-    def main(self):
-        for infile in self.infiles:
-            print(infile)
-            tree = self.read_xml(infile)
-            if self.is_root:
-                root = tree.getroot()
-                if self.sentence:
-                    sentences = self.get_sentences(root)
-                    for s in sentences:
-                        if self.tokenize:
-                            tags = self.tagger.tag_text(
-                                html.unescape(s),
-                                notagdns=True,
-                                notagip=True,
-                                notagurl=True,
-                                notagemail=True)
-                        else:
-                            tags = self.tagger.tag_text(
-                                html.unescape(s),
-                                notagdns=True,
-                                notagip=True,
-                                notagurl=True,
-                                notagemail=True,
-                                tagonly=True)
-                        tags = self.escape(tags)
-                        xml = etree.SubElement(root, 's')
-                        for tag in tags:
-                            try:
-                                xml.append(etree.fromstring(tag))
-                            except:
-                                dummy_token = etree.Element('dummy')
-                                dummy_token.text = '\n{}\n'.format(tag)
-                                xml.append(dummy_token)
-                        etree.strip_tags(xml, 'dummy')
+    def tag(self, text, tokenize=None):
+        """Tag text with TreeTagger, tokenizing it if requested.
+
+        Keyword arguments:
+        text -- a string with the text to be tagged.
+        tokenize -- True to tokenize the text, --tokenize if None.
+        """
+        if tokenize is None:
+            tokenize = self.tokenize
+        with self.metrics.phase('tag'):
+            tags = call_tagger(self.tagger, text, tokenize)
+        if self.timeout and self.expired.is_set():
+            raise FileTimeout()  # the output of a killed TreeTagger
+        self.metrics.count('tagger_calls')
+        self.metrics.count('tagger_lines', len(tags))
+        return tags
+
+    def tag_all(self, texts, tokenize=None):
+        """Tag a list of texts, a TreeTagger call each.
+
+        With --taggers, the calls are spread over the TreeTagger instances
+        of the language, and the output keeps the order of texts.
+
+        Keyword arguments:
+        texts -- a list of strings with the texts to be tagged.
+        tokenize -- True to tokenize the texts, --tokenize if None.
+        """
+        if self.tagger_pool is None or len(texts) < 2:
+            return [self.tag(text, tokenize) for text in texts]
+        if tokenize is None:
+            tokenize = self.tokenize
+        with self.metrics.phase('tag'):
+            tagged = self.tagger_pool.map(
+                lambda tagger, text: call_tagger(tagger, text, tokenize),
+                texts)
+        if self.timeout and self.expired.is_set():
+            raise FileTimeout()
+        self.metrics.count('tagger_calls', len(texts))
+        self.metrics.count('tagger_lines', sum(len(t) for t in tagged))
+        return tagged
+
+    def tag_batch(self, sentences, tokenize=None):
+        """Tag several sentences with a single TreeTagger call.
+
+        Sentences are separated by a boundary tag that TreeTagger passes
+        through untouched. If the boundaries do not come back as expected,
+        the sentences are tagged one by one.
+
+        Keyword arguments:
+        sentences -- a list of unescaped sentences.
+        tokenize -- True to tokenize the text, --tokenize if None.
+        """
+        boundary = '\n{}\n'.format(BOUNDARY)
+        return self.split_batch(
+            sentences, self.tag(boundary.join(sentences), tokenize), tokenize)
+
+    def split_batch(self, sentences, tags, tokenize=None):
+        """Split the TreeTagger output of a batch of sentences.
+
+        Keyword arguments:
+        sentences -- a list of unescaped sentences.
+        tags -- the output of TreeTagger for the batch.
+        tokenize -- True to tokenize the text, --tokenize if None.
+        """
+        tagged = [[]]
+        for tag in tags:
+            if tag == BOUNDARY:
+                tagged.append([])
+            else:
+                tagged[-1].append(tag)
+        if len(tagged) != len(sentences):
+            tagged = [self.tag(s, tokenize) for s in sentences]
+        return tagged
+
+    def tag_sentences(self, sentences):
+        """Tag a list of sentences, looking them up in the cache first.
+
+        Keyword arguments:
+        sentences -- a list of sentences as returned by get_sentences.
+        """
+        sentences = [html.unescape(s) for s in sentences]
+        self.metrics.count('sentences', len(sentences))
+        if self.cache is None:
+            return self.tag_batches(sentences)
+        with self.metrics.phase('cache'):
+            tagged = self.cache.get(sentences)
+        missing = list(dict.fromkeys(
+            s for s, tags in zip(sentences, tagged) if tags is None))
+        new = dict(zip(missing, self.tag_batches(missing)))
+        with self.metrics.phase('cache'):
+            self.cache.put(new)
+        return [new[s] if tags is None else tags
+                for s, tags in zip(sentences, tagged)]
+
+    def tag_batches(self, sentences):
+        """Tag a list of unescaped sentences, in batches if requested.
+
+        Keyword arguments:
+        sentences -- a list of unescaped sentences.
+        """
+        if not self.batch:
+            return self.tag_all(sentences)
+        batches = [[]]
+        size = 0
+        for s in sentences:
+            if batches[-1] and size + len(s) > self.batch:
+                batches.append([])
+                size = 0
+            batches[-1].append(s)
+            size += len(s)
+        if not batches[-1]:
+            return []
+        boundary = '\n{}\n'.format(BOUNDARY)
+        tagged = []
+        for batch, tags in zip(batches, self.tag_all(
+                [boundary.join(batch) for batch in batches])):
+            tagged += self.split_batch(batch, tags)
+        return tagged
+
+    def append_tags(self, xml, tags):
+        """Append TreeTagger output to a sentence Element.
+
+        Token lines become text (one token per line), lines holding well
+        formed XML become child Elements.
+
+        Keyword arguments:
+        xml -- Element where the tokens are appended.
+        tags -- a list of escaped TreeTagger output lines.
+        """
+        with self.metrics.phase('build'):
+            self.build_sentence(xml, tags)
+
+    def build_sentence(self, xml, tags):
+        """Add the tokens and elements of TreeTagger output to an Element.
+
+        Consecutive tokens are joined in a single text, each one in its own
+        line, instead of being added one by one.
+
+        Keyword arguments:
+        xml -- Element where the tokens are appended.
+        tags -- a list of escaped TreeTagger output lines.
+        """
+        text = []
+        last = None
+        has_elements = False
+        for tag in tags:
+            element = None
+            if '<' in tag:  # escaped tokens can't be XML
+                try:
+                    element = etree.fromstring(tag)
+                except etree.XMLSyntaxError:
+                    pass
+            if element is None:
+                text.append('\n{}\n'.format(tag))
+                continue
+            if text:
+                if last is None:
+                    xml.text = ''.join(text)
                 else:
-                    if self.tokenize:
-                        # text = html.unescape(
-                        #         etree.tostring(root, encoding='utf-8').decode())
-                        lines = [x.strip() for x in etree.tostring(root, encoding='utf-8', pretty_print=True).decode().split('\n')]
-                        text = list()
-                        for line in lines:
-                        # for element in root.iter():
-                            if not re.match(r'<{}'.format(self.element), line):
-                                text.append(line)
-                            else:
-                                text.append(html.unescape(line))
-                        # text = etree.tostring(root, encoding='utf-8').decode()
-                        text = "\n".join(text)
-                        tags = self.tagger.tag_text(
-                            text,
-                            notagdns=True,
-                            notagip=True,
-                            notagurl=True,
-                            notagemail=True)
-                    else:
-                        tags = self.tagger.tag_text(
-                            html.unescape(
-                                etree.tostring(root, encoding='utf-8').decode()),
-                            notagdns=True,
-                            notagip=True,
-                            notagurl=True,
-                            notagemail=True,
-                            tagonly=True)
-                    tags = self.escape(tags)
-                    tags = '\n'.join(tags)
-                    xml = etree.fromstring(tags)
+                    last.tail = ''.join(text)
+                text = []
+            xml.append(element)
+            last = element
+            has_elements = True
+        if text:
+            if last is None:
+                xml.text = ''.join(text)
             else:
-                elements = tree.xpath('.//{}'.format(self.element))
-                for e in elements:
-                    if self.sentence:
-                        sentences = self.get_sentences(e)
-                        for s in sentences:
-                            if self.tokenize:
-                                tags = self.tagger.tag_text(
-                                    html.unescape(s),
-                                    notagdns=True,
-                                    notagip=True,
-                                    notagurl=True,
-                                    notagemail=True)
-                            else:
-                                tags = self.tagger.tag_text(
-                                    html.unescape(s),
-                                    notagdns=True,
-                                    notagip=True,
-                                    notagurl=True,
-                                    notagemail=True,
-                                    tagonly=True)
-                            tags = self.escape(tags)
-                            xml = etree.SubElement(e, 's')
-                            for tag in tags:
-                                try:
-                                    xml.append(etree.fromstring(tag))
-                                except:
-                                    dummy_token = etree.Element('dummy')
-                                    dummy_token.text = '\n{}\n'.format(tag)
-                                    xml.append(dummy_token)
-                            etree.strip_tags(xml, 'dummy')
+                last.tail = ''.join(text)
+        if has_elements:  # keep the old behaviour for parsed <dummy>
+            etree.strip_tags(xml, 'dummy')
 
-                    else:
-                        if self.tokenize:
-                            tags = self.tagger.tag_text(
-                                html.unescape(
-                                    etree.tostring(e, encoding='utf-8').decode()),
-                                notagdns=True,
-                                notagip=True,
-                                notagurl=True,
-                                notagemail=True)
+    def tag_elements(self, elements):
+        """Split elements in sentences and tag them.
+
+        Return the list of sentence Elements added.
+
+        Keyword arguments:
+        elements -- a list of Elements whose text has to be tagged.
+        """
+        parents = []
+        sentences = []
+        for e in elements:
+            for s in self.get_sentences(e):
+                parents.append(e)
+                sentences.append(s)
+        output = []
+        for e, tags in zip(parents, self.tag_sentences(sentences)):
+            xml = etree.SubElement(e, 's')
+            self.append_tags(xml, self.escape(tags))
+            output.append(xml)
+        return output
+
+    def process_file(self, infile):
+        """Tag a file and serialize the result.
+
+        Keyword arguments:
+        infile -- a string for the path to the file to be tagged.
+        """
+        if self.stream:
+            with self.metrics.phase('stream'):
+                return self.stream_file(infile)
+        tree = self.read_file(infile)
+        self.write_file(infile, self.tag_document(infile, tree))
+
+    def read_file(self, infile):
+        """Read a file to be tagged, return what tag_document takes.
+
+        Keyword arguments:
+        infile -- a string for the path to the file to be tagged.
+        """
+        return self.read_xml(infile)
+
+    def tag_document(self, infile, tree):
+        """Tag a file read by read_file, return what write_file takes.
+
+        Keyword arguments:
+        infile -- a string for the path to the file to be tagged.
+        tree -- ElementTree returned by read_file.
+        """
+        return self.tag_tree(tree)
+
+    def write_file(self, infile, root):
+        """Write the output of tag_document.
+
+        Keyword arguments:
+        infile -- a string for the path to the file tagged.
+        root -- Element or ElementTree returned by tag_document.
+        """
+        self.serialize(infile, root)
+
+    def tag_tree(self, tree):
+        """Tag a parsed file.
+
+        Return the ElementTree or Element to be serialized.
+
+        Keyword arguments:
+        tree -- ElementTree to be tagged.
+        """
+        if self.is_root:
+            root = tree.getroot()
+            if self.sentence:
+                xml = self.tag_elements([root])[-1]
+            else:
+                if self.tokenize:
+                    # text = html.unescape(
+                    #         etree.tostring(root, encoding='utf-8').decode())
+                    lines = [x.strip() for x in etree.tostring(root, encoding='utf-8', pretty_print=True).decode().split('\n')]
+                    text = list()
+                    for line in lines:
+                    # for element in root.iter():
+                        if not re.match(r'<{}'.format(self.element), line):
+                            text.append(line)
                         else:
-                            tags = self.tagger.tag_text(
-                                html.unescape(
-                                    etree.tostring(e, encoding='utf-8').decode()),
-                                notagdns=True,
-                                notagip=True,
-                                notagurl=True,
-                                notagemail=True,
-                                tagonly=True)
-                        tags = self.escape(tags)
-                        tags = '\n'.join(tags)
-                        xml = etree.fromstring(tags)
-                        e.getparent().replace(e, xml)
-            if self.is_root:
-                self.serialize(infile, xml)
+                            text.append(html.unescape(line))
+                    # text = etree.tostring(root, encoding='utf-8').decode()
+                    text = "\n".join(text)
+                    tags = self.tag(text)
+                else:
+                    tags = self.tag(
+                        html.unescape(
+                            etree.tostring(root, encoding='utf-8').decode()))
+                tags = self.escape(tags)
+                with self.metrics.phase('build'):
+                    xml = etree.fromstring('\n'.join(tags))
+        else:
+            elements = tree.xpath('.//{}'.format(self.element))
+            if self.sentence:
+                self.tag_elements(elements)
             else:
-                self.serialize(infile, tree)
+                tagged = self.tag_all([
+                    html.unescape(etree.tostring(e, encoding='utf-8').decode())
+                    for e in elements])
+                for e, tags in zip(elements, tagged):
+                    tags = self.escape(tags)
+                    with self.metrics.phase('build'):
+                        xml = etree.fromstring('\n'.join(tags))
+                        e.getparent().replace(e, xml)
+        if self.is_root:
+            return xml
+        return tree
+
+    def main(self):
+        for infile in self.infiles:
+            print(infile)
+            try:
+                with self.metrics.file(infile):
+                    self.use_language(self.file_language(infile))
+                    self.metrics.set('language', self.language)
+                    self.retrying(infile, lambda: self.process_file(infile))
+                    self.flush_documents()
+            except FileTimeout:
+                self.quarantine(infile)
+                continue
             self.counter += 1
-            text = None
-            xml = None
-            tags = None
-            tree = None
+            hits, misses = self.cache_usage()
+            self.hits += hits
+            self.misses += misses
+            if self.manifest is not None:
+                self.manifest.record(infile)
+        pass
+
+    def main_staged(self):
+        """Tag files while the next ones are read and the previous written.
+
+        Reader threads parse the next files and a writer thread serializes
+        the tagged ones, so TreeTagger doesn't wait for the disk and lxml.
+        """
+        loop = StagedLoop(
+            self.read_stage,
+            self.tag_stage,
+            self.write_stage,
+            self.readers,
+            self.queue_size)
+        loop.run(self.infiles)
+        self.stages = loop.report()
+
+    def read_stage(self, infile):
+        self.metrics.start(infile)
+        language = self.file_language(infile)
+        tree = self.read_file(infile)
+        return language, tree, self.metrics.suspend()
+
+    def tag_stage(self, infile, item):
+        language, tree, record = item
+        print(infile)
+        self.metrics.resume(record)
+        self.use_language(language)
+        self.metrics.set('language', language)
+        trees = [tree]
+
+        def attempt():
+            # a timed out attempt may have tagged part of the tree
+            tree = trees.pop() if trees else self.read_file(infile)
+            return self.tag_document(infile, tree)
+        try:
+            root = self.retrying(infile, attempt)
+        except FileTimeout:
+            root = None  # quarantined by write_stage
+        hits, misses = self.cache_usage()
+        self.hits += hits
+        self.misses += misses
+        return root, self.metrics.suspend()
+
+    def write_stage(self, infile, item):
+        root, record = item
+        self.metrics.resume(record)
+        if root is None:
+            self.metrics.add(*self.metrics.stop(error=True))
+            self.quarantine(infile)
+            return
+        self.write_file(infile, root)
+        self.flush_documents()
+        self.metrics.add(*self.metrics.stop())
+        self.counter += 1
+        if self.manifest is not None:
+            self.manifest.record(infile)
+
+    def main_parallel(self):
+        """Tag files in a pool of processes, each with its own TreeTagger.
+
+        If a worker process dies (killed when out of memory, or by a crash
+        of TreeTagger), the files that were being tagged are tagged again
+        one at a time, and the one killing its worker again is reported as
+        failed. The rest of the files are tagged in a new pool.
+        """
+        infiles = self.infiles
+        while infiles:
+            suspects, infiles = self.run_pool(infiles, self.jobs)
+            for infile in suspects:
+                died, unused = self.run_pool([infile], 1)
+                if died:
+                    self.metrics.start(infile)
+                    self.metrics.add(*self.metrics.stop(error=True))
+                    print("{} failed:\nthe worker process died".format(
+                        infile), file=sys.stderr)
+        pass
+
+    def run_pool(self, infiles, jobs):
+        """Tag files in a pool of processes until one of them dies.
+
+        Return the files whose worker may have died and the files left.
+
+        Keyword arguments:
+        infiles -- a list of strings for the paths to the files.
+        jobs -- number of worker processes.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        infiles = collections.deque(infiles)
+        pending = collections.deque()  # (file, future) in input order
+        died = []
+        with ProcessPoolExecutor(
+                jobs, initializer=init_worker, initargs=(self,)) as pool:
+            while infiles or pending:
+                try:
+                    while infiles and len(pending) < 2 * jobs:
+                        pending.append(
+                            (infiles[0], pool.submit(tag_file, infiles[0])))
+                        infiles.popleft()
+                except BrokenProcessPool:
+                    pass  # the file is left, the dead worker found below
+                if not pending:
+                    break
+                infile, future = pending.popleft()
+                try:
+                    self.add_result(*future.result())
+                except BrokenProcessPool:
+                    died.append(infile)
+                    for infile, future in pending:
+                        try:
+                            self.add_result(*future.result())
+                        except BrokenProcessPool:
+                            died.append(infile)
+                    break
+        return died, list(infiles)
+
+    def add_result(self, infile, error, usage, record, documents):
+        """Report a file tagged by a worker process.
+
+        Keyword arguments:
+        infile, error, usage, record, documents -- as returned by tag_file.
+        """
+        print(infile)
+        self.documents.extend(documents)
+        self.flush_documents()
+        self.hits += usage[0]
+        self.misses += usage[1]
+        if 'language' in record[0]:
+            self.languages.add(record[0]['language'])
+        self.metrics.add(*record)
+        if error is None:
+            self.counter += 1
+            if self.manifest is not None:
+                self.manifest.record(infile)
+        elif record[0].get('timeout'):
+            self.quarantine(infile)
+        else:
+            print("{} failed:\n{}".format(infile, error), file=sys.stderr)
+        pass
+
+    def main_client(self):
+        """Send the job to a tagging server and report its progress."""
+        self.counter = 0
+        self.languages = set()
+        self.hits = 0
+        self.misses = 0
+        self.stages = None  # the server tags files one after another
+        options = dict(vars(self.args))
+        for option in ['input', 'output', 'abbreviation', 'cache', 'metrics']:
+            if options[option] is not None:
+                options[option] = os.path.abspath(options[option])
+        if self.language_from == 'map':
+            options['language_from'] = 'map:' + os.path.abspath(
+                self.language_key)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.server)
+        client.sendall((json.dumps(options) + '\n').encode('utf-8'))
+        with client.makefile(mode='r', encoding='utf-8') as replies:
+            for reply in replies:
+                reply = json.loads(reply)
+                if 'file' in reply:
+                    print(reply['file'])
+                    if reply['error'] is not None:
+                        print("{} failed:\n{}".format(
+                            reply['file'], reply['error']), file=sys.stderr)
+                elif 'fatal' in reply:
+                    sys.exit("server error:\n{}".format(reply['fatal']))
+                else:
+                    self.counter = reply['counter']
+                    self.languages = set(reply['languages'])
+                    self.hits = reply['hits']
+                    self.misses = reply['misses']
+                    print(reply['summary'])
+        client.close()
+        pass
+
+    def stream_file(self, infile):
+        """Tag a file element by element while it is being parsed.
+
+        Every outermost element matching -e is tagged as soon as it is
+        complete, written to the VRT file and freed, so memory usage does
+        not grow with the size of the document. With --concatenate, the
+        VRT of the document is kept by open_output until it is complete:
+        shards.py wraps every document and compresses it on its own.
+
+        Keyword arguments:
+        infile -- a string for the path to the file to be tagged.
+        """
+        with compression.open_file(infile, 'rb', None) as ifile,\
+                self.open_output(infile) as ofile:
+            writer = StreamWriter(ofile)
+            for piece in self.stream_pieces(ifile):
+                writer.write(piece)
+            writer.flush()
         pass
 
+    def stream_pieces(self, ifile):
+        """Parse and tag XML, yield it serialized piece by piece.
+
+        Pieces are tags, text and tagged elements, to be laid out by a
+        StreamWriter.
+
+        Keyword arguments:
+        ifile -- a binary file object with the XML.
+        """
+        context = etree.iterparse(
+            ifile,
+            events=('start', 'end', 'comment', 'pi'),
+            remove_blank_text=True)
+        opened = []  # ancestors whose start tag has been written
+        target = None  # outermost element to be tagged being parsed
+        pending = None  # last written element, its tail comes later
+        for event, element in context:
+            if target is not None and element is not target:
+                continue
+            if pending is not None:
+                yield tail_string(pending)
+                pending = None
+            parent = element.getparent()
+            if event == 'start':
+                if parent is None:
+                    root = element
+                    yield document_head(root)
+                if element.tag == self.element:
+                    target = element
+                continue
+            if parent is None and event != 'end':
+                continue  # written with the head or after the root
+            if opened and opened[-1][0] is element:
+                yield opened.pop()[1]
+                pending = element
+            else:
+                ancestors = list(element.iterancestors())[::-1]
+                for ancestor in ancestors[len(opened):]:
+                    start, end = start_and_end_tags(ancestor)
+                    yield start
+                    opened.append((ancestor, end))
+                if element is target:
+                    target = None
+                    xml = self.tag_element(element)
+                    if xml is element:
+                        pending = element
+                else:
+                    xml = element
+                    pending = element
+                yield etree.tostring(
+                    xml, encoding='utf-8', with_tail=False).decode()
+            # free what has already been written
+            tail = element.tail
+            element.clear()
+            element.tail = tail
+            if parent is not None:  # the siblings of the root stay
+                while element.getprevious() is not None:
+                    del parent[0]
+        if pending is not None:
+            yield tail_string(pending)
+        for sibling in root.itersiblings():
+            yield etree.tostring(
+                sibling, encoding='utf-8', with_tail=False).decode()
+
+    def tag_element(self, element):
+        """Tag a complete element parsed in streaming mode.
+
+        Return the Element to be serialized instead of the input one.
+
+        Keyword arguments:
+        element -- an outermost Element matching -e.
+        """
+        if self.sentence:
+            self.tag_elements(element.xpath(
+                'descendant-or-self::{}'.format(self.element)))
+            return element
+        tags = self.tag(
+            html.unescape(
+                etree.tostring(element, encoding='utf-8').decode()))
+        tags = self.escape(tags)
+        with self.metrics.phase('build'):
+            return etree.fromstring('\n'.join(tags))
+
     def cli(self):
         """CLI parses command-line arguments"""
         parser = argparse.ArgumentParser()
@@ -331,9 +1433,19 @@ class TagWithTreeTagger(object):
             help="path to the output directory.")
         parser.add_argument(
             "-l", "--language",
-            required=True,
-            choices=['en', 'es', 'de'],
-            help="language of the version to be processed.")
+            required=False,
+            default=None,
+            choices=LANGUAGES,
+            help="language of the version to be processed (the default one\
+                  if --language_from is provided).")
+        parser.add_argument(
+            "--language_from",
+            required=False,
+            default=None,
+            help="if provided, where the language of each file is found:\
+                  'attribute:NAME' of the root element, 'path:N' for the Nth\
+                  directory below the input directory, or 'map:FILE' with a\
+                  path or file name and a language per line.")
         parser.add_argument(
             "-e", "--element",
             required=False,
@@ -369,19 +1481,209 @@ class TagWithTreeTagger(object):
             default=None,
             help="path to the abbreviation file, if not provided uses default\
                   TreeTagger's abbreviation file.")
+        parser.add_argument(
+            "-z", "--compress",
+            required=False,
+            default=None,
+            choices=compression.COMPRESSIONS,
+            help="if provided, output files are compressed (input files are\
+                  decompressed according to their extension).")
+        parser.add_argument(
+            "--concatenate",
+            required=False,
+            default=None,
+            help="if provided, documents are written to NAME-0000.vrt...\
+                  in the output directory, each one in a <text> element,\
+                  with their offsets in NAME.index.")
+        parser.add_argument(
+            "--shard_size",
+            required=False,
+            default=0,
+            type=int,
+            help="maximum size of every file written with --concatenate in\
+                  MB, a single file if 0.")
+        parser.add_argument(
+            "--columns",
+            required=False,
+            default=None,
+            help="if provided, the word, POS and lemma of every token are\
+                  also appended as arrays of ids to NAME.word, NAME.pos and\
+                  NAME.lemma in the output directory, with their\
+                  vocabularies and the sentence and document offsets.")
+        parser.add_argument(
+            "--stream",
+            required=False,
+            default=False,
+            action="store_true",
+            help="if provided, elements are tagged and written while the\
+                  file is parsed, keeping memory usage flat (with\
+                  --concatenate, the VRT of each document is still kept in\
+                  memory until it is appended to the shard).")
+        parser.add_argument(
+            "-b", "--batch",
+            required=False,
+            default=0,
+            type=int,
+            help="if provided, sentences are sent to TreeTagger in batches\
+                  of up to BATCH characters.")
+        parser.add_argument(
+            "-j", "--jobs",
+            required=False,
+            default=1,
+            type=int,
+            help="number of worker processes, each one with its own\
+                  TreeTagger instance.")
+        parser.add_argument(
+            "--taggers",
+            required=False,
+            default=1,
+            type=int,
+            help="number of TreeTagger instances per language (and per\
+                  process with -j) tagging the elements or sentences of a\
+                  file at once.")
+        parser.add_argument(
+            "--readers",
+            required=False,
+            default=0,
+            type=int,
+            help="if provided, number of threads reading the next files\
+                  while the current one is tagged, another thread writes\
+                  the tagged files.")
+        parser.add_argument(
+            "--queue_size",
+            required=False,
+            default=4,
+            type=int,
+            help="maximum number of files read or tagged waiting for the\
+                  next stage with --readers.")
+        parser.add_argument(
+            "--order",
+            required=False,
+            default='directory',
+            choices=ORDERS,
+            help="order in which files are tagged: as found in the input\
+                  directory or the largest first, so that no large file is\
+                  left for the end of a run with -j.")
+        parser.add_argument(
+            "--timeout",
+            required=False,
+            default=0,
+            type=float,
+            help="if provided, seconds after which the TreeTagger instances\
+                  tagging a file are killed and started again; a file\
+                  timing out in every attempt is put in quarantine and\
+                  skipped by the next runs with -u.")
+        parser.add_argument(
+            "--retries",
+            required=False,
+            default=1,
+            type=int,
+            help="number of times a file timing out is tagged again with\
+                  --timeout.")
+        parser.add_argument(
+            "-u", "--incremental",
+            required=False,
+            default=False,
+            action="store_true",
+            help="if provided, files whose output is up to date are skipped\
+                  and processed files are recorded in a manifest in the\
+                  output directory.")
+        parser.add_argument(
+            "-c", "--cache",
+            required=False,
+            default=None,
+            help="if provided, path to a database where tagged sentences are\
+                  kept to avoid tagging them again (it can be shared by\
+                  several runs).")
+        parser.add_argument(
+            "--cache_size",
+            required=False,
+            default=1000000,
+            type=int,
+            help="maximum number of sentences in the cache, the least\
+                  recently used ones are removed first.")
+        parser.add_argument(
+            "-m", "--metrics",
+            required=False,
+            default=None,
+            help="if provided, path to a file where the time of every phase,\
+                  counts and memory usage of each file are written as JSON\
+                  lines.")
+        parser.add_argument(
+            "--profile",
+            required=False,
+            default=0,
+            type=int,
+            help="if provided, files are profiled and the profiles of the\
+                  PROFILE slowest ones are written next to the metrics file.")
+        parser.add_argument(
+            "--server",
+            required=False,
+            default=None,
+            help="if provided, path to the socket of a tagging server\
+                  (server.py) doing the job with its loaded models.")
         args = parser.parse_args()
+        if args.stream and args.is_root:
+            parser.error("--stream can't be combined with -r")
+        check_languages(parser, args)
+        check_stages(parser, args)
+        if args.concatenate is not None and args.incremental:
+            parser.error("--concatenate can't be combined with -u")
+        if args.columns is not None and args.incremental:
+            parser.error("--columns can't be combined with -u")
+        self.server = args.server
+        del args.server
+        self.configure(args)
+        pass
+
+    def configure(self, args):
+        """Set options from parsed arguments.
+
+        Keyword arguments:
+        args -- argparse.Namespace with the options of cli
+        """
+        self.args = args
         self.indir = args.input
         self.outdir = args.output
-        if not os.path.exists(self.outdir):
+        if self.outdir is not None and not os.path.exists(self.outdir):
             os.makedirs(self.outdir)
         self.language = args.language
+        self.default_language = args.language
+        self.language_from = None
+        self.language_key = None
+        if args.language_from is not None:
+            self.language_from, _, self.language_key = (
+                args.language_from.partition(':'))
+        if self.language_from == 'map':
+            self.language_map = self.read_language_map(self.language_key)
         self.element = args.element
         self.pattern = args.pattern
         self.sentence = args.sentence
         self.tokenize = args.tokenize
         self.abbreviation = args.abbreviation
         self.is_root = args.is_root
+        self.compress = args.compress
+        self.concatenate = args.concatenate
+        self.shard_size = args.shard_size
+        self.columns = args.columns
+        self.stream = args.stream
+        self.batch = args.batch
+        self.jobs = args.jobs
+        self.taggers = args.taggers
+        self.tagger_pool = None
+        self.readers = args.readers
+        self.queue_size = args.queue_size
+        self.order = args.order
+        self.timeout = args.timeout
+        self.retries = args.retries
+        self.expired = threading.Event()
+        self.incremental = args.incremental
+        self.cache_path = args.cache
+        self.cache_size = args.cache_size
+        self.metrics_path = args.metrics
+        self.profile = args.profile
         pass
 
 
-print(TagWithTreeTagger())
+if __name__ == '__main__':
+    print(TagWithTreeTagger())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Serialize XML trees as VRT: one XML tag or token per line."""
+
+import re
+from lxml import etree
+
+
+XML_DECLARATION = "<?xml version='1.0' encoding='{}'?>"
+TEXT = str.maketrans({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;'})
+ATTRIBUTE = str.maketrans({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+    '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'})
+NEWLINES = re.compile(r"\n\n+")
+ENTITY = re.compile(r"&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);")
+ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+# markup that VrtWriter doesn't reproduce exactly
+IRREGULAR = etree.XPath(
+    "boolean(//namespace::*[name() != 'xml'] | //@*[namespace-uri()]"
+    " | //comment()[contains(., '<') or contains(., '>')"
+    " or contains(., '\n')] | //processing-instruction())")
+
+
+def replace_entity(match):
+    name = match.group(1)
+    if name[:2] == '#x':
+        return chr(int(name[2:], 16))
+    if name[0] == '#':
+        return chr(int(name[1:]))
+    return ENTITIES[name]
+
+
+def unescape(text):
+    """Replace the entities and character references of escaped text.
+
+    Keyword arguments:
+    text -- a string with text as written in a VRT file.
+    """
+    if '&' not in text:
+        return text
+    return ENTITY.sub(replace_entity, text)
+
+
+def split_lines(tree, break_tags=True):
+    """Put each XML tag and token of a serialized tree in its own line.
+
+    Keyword arguments:
+    tree -- a string with serialized XML.
+    break_tags -- if True, text is never left on the line of a tag.
+    """
+    tree = re.sub(  # remove trailing spaces before tag
+        r"(\n) +(<)",
+        r"\1\2",
+        tree)
+    tree = re.sub(  # put each XML element in a different line
+        r"> *<",
+        r">\n<",
+        tree)
+    if break_tags:
+        tree = re.sub(  # put opening tag and FL output in different lines
+            r"(<.+?>)",
+            r"\1\n",
+            tree)
+        tree = re.sub(  # put FL output and closing tag in different liens
+            r"(</.+?>)",
+            r"\n\1",
+            tree)
+    tree = re.sub(
+        r"(>)([^.])",
+        r"\1\n\2",
+        tree)
+    tree = re.sub(  # remove unnecessary empty lines
+        r"\n\n+",
+        r"\n",
+        tree)
+    return tree
+
+
+def write(tree, ofile, break_tags=True, encoding='utf-8'):
+    """Write a tree or an Element (with its tail) as VRT.
+
+    The output is the same as serializing the tree with lxml and applying
+    split_lines, but it is written while walking the tree once.
+
+    Keyword arguments:
+    tree -- ElementTree or Element to be serialized.
+    ofile -- a file object open for writing text.
+    break_tags -- if True, text is never left on the line of a tag.
+    encoding -- the encoding name given in the XML declaration.
+    """
+    if isinstance(tree, etree._ElementTree):
+        irregular = tree.docinfo.internalDTD is not None
+    else:
+        irregular = False
+    if irregular or IRREGULAR(tree):
+        ofile.write(split_lines(etree.tostring(
+            tree,
+            encoding=encoding,
+            method="xml",
+            xml_declaration=True).decode(), break_tags))
+        return
+    writer = VrtWriter(ofile, break_tags)
+    writer.write_tree(tree, encoding)
+    writer.close()
+
+
+class VrtWriter(object):
+    """Write XML as VRT while walking the tree.
+
+    It applies the rules of split_lines to every tag and text as they are
+    written, keeping track of the surrounding line breaks.
+    """
+
+    def __init__(self, ofile, break_tags=True):
+        self.ofile = ofile
+        self.break_tags = break_tags
+        self.buffer = []
+        self.size = 0
+        self.text = None  # text waiting for the next tag
+        self.started = False  # at least a tag was written
+        self.after_tag = False  # a line break may follow the last tag
+        self.newline = False  # output ends with a line break
+
+    def write_tree(self, tree, encoding='utf-8'):
+        """Write a whole document.
+
+        Keyword arguments:
+        tree -- ElementTree or Element to be serialized.
+        encoding -- the encoding name given in the XML declaration.
+        """
+        self.write_tag(XML_DECLARATION.format(encoding))
+        self.write_text('\n')
+        if isinstance(tree, etree._ElementTree):
+            root = tree.getroot()
+            if tree.docinfo.doctype:
+                self.write_tag(tree.docinfo.doctype)
+                self.write_text('\n')
+            for sibling in reversed(list(root.itersiblings(preceding=True))):
+                self.write_element(sibling)
+            self.write_element(root)
+            for sibling in root.itersiblings():
+                self.write_element(sibling)
+        else:
+            self.write_element(tree)
+            if tree.tail is not None:
+                self.write_text(tree.tail.translate(TEXT))
+
+    def write_element(self, element):
+        """Write an Element and its descendants, without its tail.
+
+        Keyword arguments:
+        element -- the Element to be serialized.
+        """
+        tag = element.tag
+        if not isinstance(tag, str):  # comments and processing instructions
+            self.write_tag(etree.tostring(
+                element, encoding='utf-8', with_tail=False).decode())
+            return
+        attributes = ''.join(
+            ' {}="{}"'.format(key, value.translate(ATTRIBUTE))
+            for key, value in element.items())
+        if element.text is None and not len(element):
+            self.write_tag('<{}{}/>'.format(tag, attributes))
+            return
+        self.write_tag('<{}{}>'.format(tag, attributes))
+        if element.text is not None:
+            self.write_text(element.text.translate(TEXT))
+        for child in element:
+            self.write_element(child)
+            if child.tail is not None:
+                self.write_text(child.tail.translate(TEXT))
+        self.write_tag('</{}>'.format(tag), closing=True)
+
+    def write_text(self, text):
+        """Write escaped text, it is only output with the next tag.
+
+        Keyword arguments:
+        text -- a string with escaped text.
+        """
+        self.text = text
+
+    def write_tag(self, tag, closing=False):
+        """Write a serialized tag, comment or declaration.
+
+        Keyword arguments:
+        tag -- a string with the serialized tag.
+        closing -- True if tag is an end tag.
+        """
+        if self.started:
+            text = self.text or ''
+            stripped = text.rstrip(' ')
+            if stripped != text and stripped.endswith('\n'):
+                text = stripped  # no indentation before a tag
+            if not stripped:
+                text = '\n'  # only spaces between two tags
+            self.emit(text)
+        self.text = None
+        self.started = True
+        if self.break_tags:
+            if closing:
+                self.emit('\n')
+            self.emit(tag)
+            self.emit('\n')
+        else:
+            self.emit(tag)
+            self.after_tag = True
+
+    def emit(self, piece):
+        """Add a piece of output collapsing consecutive line breaks."""
+        if not piece:
+            return
+        if self.after_tag:
+            self.after_tag = False
+            if piece[0] != '.':
+                piece = '\n' + piece
+        if self.newline:
+            piece = piece.lstrip('\n')
+        if '\n\n' in piece:
+            piece = NEWLINES.sub('\n', piece)
+        if piece:
+            self.buffer.append(piece)
+            self.newline = piece.endswith('\n')
+            self.size += 1
+            if self.size > 4096:
+                self.flush()
+
+    def flush(self):
+        self.ofile.write(''.join(self.buffer))
+        self.buffer = []
+        self.size = 0
+
+    def close(self):
+        """Write any pending text and flush the output."""
+        if self.text:
+            self.emit(self.text)
+            self.text = None
+        self.flush()